@@ -0,0 +1,30 @@
+'''
+Общие настройки бенчмарков: путь к модулям бота и фиктивные ключи.
+'''
+
+import logging
+import os
+import sys
+import tempfile
+
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot")
+if BOT_DIR not in sys.path:
+    sys.path.insert(0, BOT_DIR)
+
+# config.py требует ключи при импорте, для бенчмарков подойдут фиктивные.
+os.environ.setdefault("BOT_TG_TOKEN", "42:BENCHMARK")
+os.environ.setdefault("OW_API_KEY", "benchmark")
+# Хранилища бота в бенчмарках не должны трогать рабочие данные.
+_DATA_DIR = tempfile.mkdtemp(prefix="bot-bench-")
+os.environ.setdefault("USER_STORAGE", "memory")
+os.environ.setdefault("USER_STORAGE_PATH", os.path.join(_DATA_DIR, "users.sqlite3"))
+os.environ.setdefault("FOOD_CACHE_PATH", os.path.join(_DATA_DIR, "food_cache.sqlite3"))
+os.environ.setdefault("FOOD_DB_PATH", os.path.join(_DATA_DIR, "food_db"))
+os.environ.setdefault("CITY_INDEX_PATH", os.path.join(_DATA_DIR, "city_index"))
+os.environ.setdefault("EVENT_LOG_DIR", os.path.join(_DATA_DIR, "events"))
+
+from config import logger  # noqa: E402
+
+# Построчные логи обработчиков искажают замеры.
+logger.setLevel(logging.WARNING)
@@ -0,0 +1,97 @@
+'''
+Пакетные калькуляторы норм воды, калорий и тренировок (utils.*_batch) против
+скалярных функций в цикле на случайных профилях от 1 тыс. до 1 млн строк.
+
+Перед замером результаты пакетных версий сверяются со скалярными на всех
+строках: они должны совпадать точно.
+
+Запуск: python benchmarks/bench_calc.py --max-rows 1000000
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import _common  # noqa: F401
+from models import ActivityType, Gender
+from utils import (
+    calc_calories_intake, calc_calories_intake_batch, calc_water_intake, calc_water_intake_batch,
+    calc_workout, calc_workout_batch
+)
+
+
+def make_rows(count: int, rng: np.random.Generator) -> dict:
+    return {
+        # Вес с дробной частью, как его вводят пользователи.
+        "weight": np.round(rng.uniform(40, 150, count), 1),
+        "height": np.round(rng.uniform(140, 210, count), 1),
+        "age": rng.integers(10, 90, count),
+        "gender": rng.integers(0, 2, count),
+        "activity": rng.integers(0, 300, count),
+        "activity_type": rng.integers(0, len(ActivityType), count),
+        "temperature": np.round(rng.uniform(-30, 40, count), 1),
+        "workout_time": rng.integers(1, 240, count),
+    }
+
+
+def scalar(rows: dict) -> tuple:
+    columns = {name: values.tolist() for name, values in rows.items()}
+    genders = [str(Gender(code)) for code in columns["gender"]]
+    types = [ActivityType(code).key for code in columns["activity_type"]]
+    water = [calc_water_intake(w, a, t) for w, a, t in
+             zip(columns["weight"], columns["activity"], columns["temperature"])]
+    calories = [calc_calories_intake(w, h, g, age, a, kind) for w, h, g, age, a, kind in
+                zip(columns["weight"], columns["height"], genders, columns["age"], columns["activity"], types)]
+    workouts = [calc_workout(kind, minutes) for kind, minutes in zip(types, columns["workout_time"])]
+    return water, calories, workouts
+
+
+def batch(rows: dict) -> tuple:
+    water = calc_water_intake_batch(rows["weight"], rows["activity"], rows["temperature"])
+    calories = calc_calories_intake_batch(
+        rows["weight"], rows["height"], rows["gender"], rows["age"], rows["activity"], rows["activity_type"]
+    )
+    workouts = calc_workout_batch(rows["activity_type"], rows["workout_time"])
+    return water, calories, workouts
+
+
+def check(scalar_result: tuple, batch_result: tuple):
+    water, calories, workouts = scalar_result
+    batch_water, batch_calories, (batch_burned, batch_water_opt) = batch_result
+    assert np.array_equal(np.array(water), batch_water), "норма воды не совпадает"
+    assert np.array_equal(np.array(calories), batch_calories), "норма калорий не совпадает"
+    assert np.array_equal(np.array([burned for burned, _ in workouts]), batch_burned), "калории тренировок"
+    assert np.array_equal(np.array([water for _, water in workouts]), batch_water_opt), "вода тренировок"
+
+
+def measure(func, rows: dict, repeat: int) -> tuple:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(rows)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(args):
+    rng = np.random.default_rng(1)
+    print(f"{'rows':>9} {'scalar ms':>10} {'batch ms':>9} {'speedup':>8} {'ns/row':>7} {'exact':>6}")
+    count = 1000
+    while count <= args.max_rows:
+        rows = make_rows(count, rng)
+        # Граничные значения: ровно 30 минут активности и ровно 25 градусов.
+        rows["activity"][:2] = (30, 29)
+        rows["temperature"][:2] = (25.0, 25.1)
+        scalar_time, scalar_result = measure(scalar, rows, 1 if count >= 10 ** 5 else 3)
+        batch_time, batch_result = measure(batch, rows, 5)
+        check(scalar_result, batch_result)
+        print(f"{count:9d} {scalar_time * 1000:10.1f} {batch_time * 1000:9.2f} {scalar_time / batch_time:7.0f}x "
+              f"{batch_time / count * 1e9:7.1f} {'yes':>6}", flush=True)
+        count *= 10
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-rows", type=int, default=1_000_000)
+    main(parser.parse_args())
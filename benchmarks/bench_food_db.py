@@ -0,0 +1,135 @@
+'''
+Офлайн-база продуктов: импорт синтетической выгрузки Open Food Facts на
+несколько миллионов строк и задержка поиска по ней.
+
+Выгрузка генерируется в формате CSV Open Food Facts (разделитель - табуляция)
+из названий вида "<продукт> <уточнение> <бренд>". Импорт выполняется в
+дочернем процессе для двух размеров выгрузки, чтобы сравнить пиковую память
+(она не должна расти с размером). Поиск замеряется для точных названий,
+одного слова, двух слов, слов с опечаткой и отсутствующих продуктов.
+
+Запуск: python benchmarks/bench_food_db.py --rows 2000000
+'''
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+import _common  # noqa: F401
+from food_db import FoodDB
+from food_import import import_dump
+
+BASES = (
+    "молоко", "кефир", "йогурт", "творог", "сыр", "сметана", "масло", "хлеб", "батон", "гречка", "рис",
+    "овсянка", "макароны", "курица", "говядина", "свинина", "индейка", "колбаса", "сосиски", "яблоко",
+    "банан", "апельсин", "шоколад", "печенье", "конфеты", "сок", "чай", "кофе", "пельмени", "вареники",
+    "огурцы", "томаты", "картофель", "морковь", "капуста", "горошек", "кукуруза", "фасоль", "тунец", "лосось"
+)
+QUALIFIERS = (
+    "натуральный", "классический", "отборный", "домашний", "фермерский", "обезжиренный", "сливочный",
+    "копченый", "вареный", "замороженный", "охлажденный", "консервированный", "цельнозерновой", "молочный",
+    "горький", "сладкий", "соленый", "маринованный", "свежий", "деревенский"
+)
+SYLLABLES = ("ба", "ве", "го", "да", "ке", "ли", "ми", "но", "пра", "ро", "св", "та", "фу", "ха", "ши", "эко")
+
+
+def brands(count: int, rng: random.Random) -> list:
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+
+def generate_dump(path: str, rows: int, seed: int = 1) -> None:
+    rng = random.Random(seed)
+    names = brands(20000, rng)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("code\tproduct_name\tenergy-kcal_100g\n")
+        for code in range(rows):
+            words = [rng.choice(BASES)]
+            if rng.random() < 0.7:
+                words.append(rng.choice(QUALIFIERS))
+            words.append(rng.choice(names))
+            if rng.random() < 0.3:
+                words.append(f"{rng.choice((1.5, 2.5, 3.2, 5, 9))}%")
+            file.write(f"{code}\t{' '.join(words)}\t{rng.uniform(20, 600):.1f}\n")
+
+
+def import_child(source: str, output: str, chunk_size: int, queue) -> None:
+    queue.put(import_dump(source, output, chunk_size))
+
+
+def run_import(source: str, output: str, chunk_size: int) -> dict:
+    '''
+    Импорт в дочернем процессе: пиковая память процесса импорта без учета бенчмарка.
+    '''
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=import_child, args=(source, output, chunk_size, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    # Максимальный RSS среди завершенных дочерних процессов, КиБ в Linux.
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return result
+
+
+def typo(word: str, rng: random.Random) -> str:
+    index = rng.randrange(1, len(word))
+    return word[:index] + rng.choice("аеоиу") + word[index + 1:]
+
+
+def queries(db: FoodDB, count: int, rng: random.Random) -> dict:
+    exact = [db._name(rng.randrange(db.rows)) for _ in range(count)]
+    return {
+        "exact name": exact,
+        "one word": [rng.choice(BASES) for _ in range(count)],
+        "two words": [f"{rng.choice(BASES)} {rng.choice(QUALIFIERS)}" for _ in range(count)],
+        "typo": [f"{typo(rng.choice(BASES), rng)} {rng.choice(QUALIFIERS)}" for _ in range(count)],
+        "miss": ["".join(rng.choice("жщъыэю") for _ in range(8)) for _ in range(count)],
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(args):
+    directory = tempfile.mkdtemp(prefix="food-db-bench-")
+    source = os.path.join(directory, "products.csv")
+    output = os.path.join(directory, "food_db")
+
+    print(f"{'rows':>10} {'import s':>9} {'rows/s':>9} {'peak MB':>8} {'dump MB':>8} {'db MB':>8}")
+    for rows in (args.rows // 4, args.rows):
+        generate_dump(source, rows)
+        result = run_import(source, output, args.chunk_size)
+        size = sum(os.path.getsize(os.path.join(output, name)) for name in os.listdir(output))
+        print(f"{rows:10d} {result['seconds']:9.1f} {rows / result['seconds']:9.0f} {result['peak_rss_mb']:8.1f} "
+              f"{os.path.getsize(source) / 2 ** 20:8.1f} {size / 2 ** 20:8.1f}", flush=True)
+
+    db = FoodDB(output)
+    start = time.perf_counter()
+    db.open()
+    print(f"\nopen: {(time.perf_counter() - start) * 1000:.2f} ms, rows {db.rows}, words {len(db.words)}")
+    rng = random.Random(2)
+    print(f"{'query':12} {'p50 ms':>8} {'p99 ms':>8} {'hit %':>6}")
+    for kind, items in queries(db, args.queries, rng).items():
+        latencies, hits = [], 0
+        for query in items:
+            start = time.perf_counter()
+            hits += db.lookup(query) is not None
+            latencies.append(time.perf_counter() - start)
+        print(f"{kind:12} {percentile(latencies, 0.5) * 1000:8.2f} {percentile(latencies, 0.99) * 1000:8.2f} "
+              f"{hits / len(items) * 100:6.1f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=300, help="запросов каждого вида")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="строк индекса в памяти при сортировке")
+    main(parser.parse_args())
@@ -0,0 +1,158 @@
+'''
+Накладные расходы хранилища FSM на шаг мастера /set_profile: MemoryStorage,
+RedisStorage из aiogram и RedisFSMStorage бота.
+
+Redis заменяется fakeredis (есть в requirements.txt) с искусственной задержкой
+--rtt на каждый запрос или конвейер, чтобы учесть сетевые обращения; с
+--redis-url замер идет на настоящем сервере.
+
+Отдельно проверяется, что одновременные update_data одного пользователя не
+теряют поля друг друга.
+
+Запуск: python benchmarks/bench_fsm.py --users 300 --rtt 0.0003
+'''
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+
+import _common  # noqa: F401
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+from fakeredis.aioredis import FakeRedis
+from redis.asyncio import Redis
+
+from bench_handlers import SCENARIO, Updates, fake_calories, fake_weather
+from fakes import RecordingSession
+from food_cache import food_cache
+from fsm_storage import RedisFSMStorage
+from handlers import router
+from weather_cache import weather_cache
+
+# Шаги мастера /set_profile из общего сценария.
+WIZARD = SCENARIO[:9]
+
+
+class CountingRedis(FakeRedis):
+    '''
+    fakeredis с подсчетом обращений к серверу и задержкой сети на каждое.
+    '''
+
+    rtt = 0.0
+    round_trips = 0
+
+    async def execute_command(self, *args, **options):
+        CountingRedis.round_trips += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        async def counted(raise_on_error=True):
+            CountingRedis.round_trips += 1
+            if self.rtt:
+                await asyncio.sleep(self.rtt)
+            return await execute(raise_on_error)
+
+        pipe.execute = counted
+        return pipe
+
+
+def make_redis(args) -> Redis:
+    if args.redis_url:
+        return Redis.from_url(args.redis_url)
+    return CountingRedis()
+
+
+async def measure(dp: Dispatcher, storage, args, first_id: int) -> dict:
+    # Роутер подключается к диспетчеру один раз, хранилище меняется между замерами.
+    dp.fsm.storage = storage
+    bot = Bot(token="42:BENCHMARK", session=RecordingSession())
+    updates = Updates()
+    timings = defaultdict(list)
+    CountingRedis.round_trips = 0
+    for user_id in range(first_id, first_id + args.users):
+        for step, kind, payload in WIZARD:
+            start = time.perf_counter()
+            await dp.feed_update(bot, updates.build(user_id, kind, payload))
+            timings[step].append(time.perf_counter() - start)
+    await storage.close()
+    total = sum(sum(values) for values in timings.values())
+    return {
+        "steps": {step: statistics.mean(values) * 1e6 for step, values in timings.items()},
+        "wizard_us": total / args.users * 1e6,
+        "round_trips": CountingRedis.round_trips / (args.users * len(WIZARD))
+    }
+
+
+async def lost_fields(storage, writers: int) -> int:
+    '''
+    Одновременные update_data одного пользователя с разными полями, каждое
+    после get_state, как в начале обработки обновления: число потерянных полей.
+    '''
+
+    key = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+    async def writer(index: int):
+        await storage.get_state(key)
+        await storage.update_data(key, {f"field{index}": index})
+
+    await asyncio.gather(*(writer(index) for index in range(writers)))
+    lost = writers - len(await storage.get_data(key))
+    await storage.close()
+    return lost
+
+
+async def main(args):
+    weather_cache._fetch = fake_weather
+    food_cache._fetch = fake_calories
+    CountingRedis.rtt = args.rtt
+    await food_cache.start()
+
+    storages = {
+        "memory": lambda: MemoryStorage(),
+        "aiogram-redis": lambda: RedisStorage(make_redis(args), state_ttl=args.ttl, data_ttl=args.ttl),
+        "bot-redis": lambda: RedisFSMStorage(make_redis(args), ttl=args.ttl),
+    }
+    # Прогрев кэшей и импорта обработчиков.
+    dp = Dispatcher()
+    dp.include_router(router)
+    await measure(dp, MemoryStorage(), argparse.Namespace(users=5), 1)
+    results = {}
+    for offset, (name, factory) in enumerate(storages.items(), 1):
+        results[name] = await measure(dp, factory(), args, offset * 10 ** 6)
+    await food_cache.close()
+
+    base = results["memory"]["steps"]
+    print(f"{'step':16}" + "".join(f"{name:>16}" for name in results))
+    for step, _, _ in WIZARD:
+        print(f"{step:16}" + "".join(f"{result['steps'][step]:14.1f}us" for result in results.values()))
+    print(f"{'wizard total':16}" + "".join(f"{result['wizard_us']:14.1f}us" for result in results.values()))
+    print(f"{'overhead/step':16}" + "".join(
+        f"{statistics.mean(result['steps'][s] - base[s] for s, _, _ in WIZARD):14.1f}us"
+        for result in results.values()
+    ))
+    if not args.redis_url:
+        print(f"{'redis calls/step':16}" + "".join(f"{result['round_trips']:16.2f}" for result in results.values()))
+
+    lost = {name: await lost_fields(factory(), args.writers) for name, factory in storages.items()}
+    print(f"{'lost fields':16}" + "".join(f"{value:16d}" for value in lost.values()))
+    print(f"({args.writers} concurrent update_data calls of one user, each with its own field)")
+    assert lost["bot-redis"] == 0, "RedisFSMStorage.update_data потерял поля"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--rtt", type=float, default=0.0003, help="задержка сети fakeredis на запрос, с")
+    parser.add_argument("--ttl", type=int, default=3600)
+    parser.add_argument("--redis-url", help="настоящий Redis вместо fakeredis")
+    parser.add_argument("--writers", type=int, default=20, help="одновременных update_data при проверке")
+    asyncio.run(main(parser.parse_args()))
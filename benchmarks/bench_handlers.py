@@ -0,0 +1,219 @@
+'''
+Бенчмарк обработчиков внутри процесса: настоящий Dispatcher с handlers.router,
+синтетические обновления и сессия бота без сети (RecordingSession).
+
+Сценарий пользователя: полный мастер /set_profile, затем /log_water, /log_food,
+/log_workout, /check_progress и /new_day. Внешние API заменены заглушками,
+поэтому замеряется только код бота и aiogram.
+
+Запуск:
+    python benchmarks/bench_handlers.py --users 500 --output before.json
+    python benchmarks/bench_handlers.py --users 500 --output after.json --compare before.json
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections import defaultdict
+
+import _common  # noqa: F401
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from fakes import RecordingSession, make_callback_update, make_message_update
+from events import event_log
+from food_cache import food_cache
+from handlers import router
+from render import render_service
+from utils import WeatherInfo
+from weather_cache import weather_cache
+
+# Шаги сценария: (имя шага, тип обновления, текст или данные callback).
+SCENARIO = (
+    ("/set_profile", "message", "/set_profile"),
+    ("weight", "message", "70"),
+    ("height", "message", "175"),
+    ("age", "message", "30"),
+    ("gender", "message", "м"),
+    ("activity", "message", "45"),
+    ("activity_type", "callback", "activity:run"),
+    ("city", "message", "Москва"),
+    ("calorie_goal", "message", "-"),
+    ("/log_water", "message", "/log_water 250"),
+    ("/log_food", "message", "/log_food банан, 120"),
+    ("/log_workout", "message", "/log_workout бег 30"),
+    ("/check_progress", "message", "/check_progress"),
+    ("/new_day", "message", "/new_day"),
+)
+
+
+async def fake_weather(city: str, city_id: int = None) -> WeatherInfo:
+    return WeatherInfo(18.0, 3 * 3600)
+
+
+async def fake_calories(name: str) -> float:
+    return 89.0
+
+
+class Updates:
+    '''
+    Генератор синтетических обновлений со сквозной нумерацией update_id.
+    '''
+
+    def __init__(self):
+        self.next_id = 1
+
+    def build(self, user_id: int, kind: str, payload: str) -> Update:
+        update_id, self.next_id = self.next_id, self.next_id + 1
+        if kind == "callback":
+            return Update.model_validate(make_callback_update(update_id, user_id, payload))
+        return Update.model_validate(make_message_update(update_id, user_id, payload))
+
+
+async def run_user(dp: Dispatcher, bot: Bot, updates: Updates, user_id: int, timings=None, allocations=None):
+    '''
+    Прохождение сценария одним пользователем, обновления по порядку.
+    '''
+
+    for step, kind, payload in SCENARIO:
+        update = updates.build(user_id, kind, payload)
+        if allocations is not None:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        await dp.feed_update(bot, update)
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            timings[step].append(elapsed)
+        if allocations is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            allocations[step].append((peak - before, current - before))
+
+
+async def sequential_pass(dp, bot, updates, users: int, first_id: int) -> dict:
+    timings = defaultdict(list)
+    for user_id in range(first_id, first_id + users):
+        await run_user(dp, bot, updates, user_id, timings=timings)
+    return {
+        step: {
+            "mean_us": statistics.mean(values) * 1e6,
+            "p50_us": statistics.median(values) * 1e6,
+            "p99_us": sorted(values)[int(len(values) * 0.99) - 1 if len(values) > 1 else 0] * 1e6
+        }
+        for step, values in timings.items()
+    }
+
+
+async def concurrent_pass(dp, bot, updates, users: int, first_id: int) -> dict:
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(dp, bot, updates, user_id) for user_id in range(first_id, first_id + users)))
+    elapsed = time.perf_counter() - start
+    total = users * len(SCENARIO)
+    return {"updates": total, "seconds": elapsed, "updates_per_sec": total / elapsed}
+
+
+async def allocation_pass(dp, bot, updates, users: int, first_id: int) -> dict:
+    allocations = defaultdict(list)
+    tracemalloc.start()
+    try:
+        for user_id in range(first_id, first_id + users):
+            await run_user(dp, bot, updates, user_id, allocations=allocations)
+    finally:
+        tracemalloc.stop()
+    return {
+        step: {
+            "peak_bytes": statistics.mean(peak for peak, _ in values),
+            "retained_bytes": statistics.mean(retained for _, retained in values)
+        }
+        for step, values in allocations.items()
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result: dict, baseline: dict = None):
+    throughput = result["concurrent"]["updates_per_sec"]
+    line = f"throughput    {throughput:10.0f} updates/s"
+    if baseline:
+        base = baseline["concurrent"]["updates_per_sec"]
+        line += f"   baseline {base:10.0f} ({(throughput / base - 1) * 100:+.1f}%)"
+    print(line)
+    print(f"{'step':16} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'peak KB':>9} {'kept KB':>9}")
+    for step, _, _ in SCENARIO:
+        timing = result["handlers"][step]
+        memory = result["allocations"][step]
+        row = (f"{step:16} {timing['mean_us']:10.1f} {timing['p50_us']:10.1f} {timing['p99_us']:10.1f} "
+               f"{memory['peak_bytes'] / 1024:9.1f} {memory['retained_bytes'] / 1024:9.1f}")
+        if baseline and step in baseline["handlers"]:
+            base = baseline["handlers"][step]["mean_us"]
+            row += f"   {(timing['mean_us'] / base - 1) * 100:+6.1f}%"
+        print(row)
+
+
+async def main(args):
+    weather_cache._fetch = fake_weather
+    food_cache._fetch = fake_calories
+    await food_cache.start()
+    await event_log.start()
+    render_service.start()
+
+    session = RecordingSession()
+    bot = Bot(token="42:BENCHMARK", session=session)
+    dp = Dispatcher()
+    dp.include_router(router)
+    updates = Updates()
+
+    try:
+        # Прогрев: кеши графиков, погоды и продуктов, пул отрисовки.
+        await sequential_pass(dp, bot, updates, args.warmup, 1)
+        handlers = await sequential_pass(dp, bot, updates, args.users, 10 ** 6)
+        concurrent = await concurrent_pass(dp, bot, updates, args.users, 2 * 10 ** 6)
+        allocations = await allocation_pass(dp, bot, updates, min(args.users, args.alloc_users), 3 * 10 ** 6)
+    finally:
+        await render_service.close()
+        await food_cache.close()
+        event_log.close()
+
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "users": args.users,
+        "api_calls": len(session.calls),
+        "concurrent": concurrent,
+        "handlers": handlers,
+        "allocations": allocations
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"commit {result['commit']} vs {baseline.get('commit')}")
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--alloc-users", type=int, default=100,
+                        help="число пользователей для замера аллокаций (tracemalloc замедляет работу)")
+    parser.add_argument("--output", help="файл JSON с результатами")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для сравнения")
+    asyncio.run(main(parser.parse_args()))
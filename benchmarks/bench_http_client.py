@@ -0,0 +1,92 @@
+'''
+Сравнение задержки и числа TCP-соединений: новая ClientSession на каждый
+запрос против общего HTTP-клиента. Запуск: python benchmarks/bench_http_client.py
+'''
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import _common  # noqa: F401
+import aiohttp
+from aiohttp import web
+
+import utils
+from http_client import http_client
+
+
+async def start_fake_weather(host: str, port: int):
+    '''
+    Локальный сервер, имитирующий OpenWeatherMap и считающий TCP-соединения.
+    '''
+
+    connections = set()
+
+    async def weather(request: web.Request):
+        connections.add(id(request.transport))
+        return web.json_response({"main": {"temp": 21.5}, "timezone": 10800})
+
+    app = web.Application()
+    app.router.add_get("/data/2.5/weather", weather)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, connections
+
+
+async def per_call_session(url: str):
+    '''
+    Прежнее поведение: отдельная сессия на каждый вызов.
+    '''
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, params={"q": "Москва"}) as response:
+            data = await response.json()
+            return data["main"]["temp"]
+
+
+async def run(label: str, call, requests: int, concurrency: int, connections: set):
+    connections.clear()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{label:<12} rps={requests / elapsed:8.1f}  "
+        f"p50={statistics.median(latencies):6.2f} ms  "
+        f"p99={latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms  "
+        f"tcp_connections={len(connections)}"
+    )
+
+
+async def main(args):
+    runner, connections = await start_fake_weather(args.host, args.port)
+    url = f"http://{args.host}:{args.port}/data/2.5/weather"
+    utils.OPEN_WEATHER_URL = url
+    try:
+        await run("per-call", lambda: per_call_session(url), args.requests, args.concurrency, connections)
+        await http_client.start()
+        await run("shared", lambda: utils.open_weather_api("Москва"), args.requests, args.concurrency, connections)
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    asyncio.run(main(parser.parse_args()))
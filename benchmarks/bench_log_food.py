@@ -0,0 +1,90 @@
+'''
+Логирование приема пищи из нескольких продуктов: отдельное сообщение
+/log_food на каждый продукт против одного сообщения со всеми продуктами.
+
+Open Food Facts заменен заглушкой из fakes.py с задержкой --latency, кэш
+продуктов для каждого приема пищи холодный (SQLite в памяти), поэтому каждый
+продукт требует запроса к API. Отчет: время записи приема пищи, число запросов
+к API, ответов бота и обновлений.
+
+Запуск: python benchmarks/bench_log_food.py --meals 30 --latency 0.15
+'''
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+FAKE_PORT = 8092
+# Адрес API читается config.py при импорте, поэтому задается до импорта модулей бота.
+os.environ.setdefault("OPEN_FOOD_FACT_URL", f"http://127.0.0.1:{FAKE_PORT}/cgi/search.pl")
+
+import _common  # noqa: F401,E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+
+import handlers  # noqa: E402
+from bench_handlers import SCENARIO, Updates, fake_weather  # noqa: E402
+from fakes import FakeOpenFoodFacts, RecordingSession  # noqa: E402
+from food_cache import FoodCache  # noqa: E402
+from http_client import http_client  # noqa: E402
+from weather_cache import weather_cache  # noqa: E402
+
+# Прием пищи: продукт "гречка" повторяется и запрашивается в API один раз.
+MEAL = (("гречка", 150), ("курица", 200), ("хлеб", 40), ("сыр", 30), ("яблоко", 120), ("гречка", 50))
+
+
+def messages(mode: str) -> list:
+    if mode == "single":
+        return [f"/log_food {name}, {weight}" for name, weight in MEAL]
+    return ["/log_food " + "; ".join(f"{name}, {weight}" for name, weight in MEAL)]
+
+
+async def measure(dp: Dispatcher, fake: FakeOpenFoodFacts, args, mode: str, first_id: int) -> dict:
+    bot = Bot(token="42:BENCHMARK", session=RecordingSession())
+    updates = Updates()
+    timings = []
+    fake.requests = 0
+    for user_id in range(first_id, first_id + args.meals):
+        for _, kind, payload in SCENARIO[:9]:
+            await dp.feed_update(bot, updates.build(user_id, kind, payload))
+        handlers.food_cache = FoodCache(path=":memory:")
+        calls = len(bot.session.calls)
+        start = time.perf_counter()
+        for text in messages(mode):
+            await dp.feed_update(bot, updates.build(user_id, "message", text))
+        timings.append(time.perf_counter() - start)
+        await handlers.food_cache.close()
+        replies = len(bot.session.calls) - calls
+    return {
+        "meal_ms": statistics.mean(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "api_requests": fake.requests / args.meals,
+        "replies": replies,
+        "updates": len(messages(mode))
+    }
+
+
+async def main(args):
+    weather_cache._fetch = fake_weather
+    fake = FakeOpenFoodFacts(latency=args.latency)
+    await fake.start("127.0.0.1", FAKE_PORT)
+    await http_client.start()
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+    print(f"{'mode':8} {'meal ms':>9} {'max ms':>9} {'api req':>8} {'replies':>8} {'updates':>8}")
+    try:
+        for offset, mode in enumerate(("single", "batch"), 1):
+            result = await measure(dp, fake, args, mode, offset * 10 ** 6)
+            print(f"{mode:8} {result['meal_ms']:9.1f} {result['max_ms']:9.1f} {result['api_requests']:8.1f} "
+                  f"{result['replies']:8d} {result['updates']:8d}")
+    finally:
+        await http_client.close()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meals", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.15, help="задержка ответа Open Food Facts, с")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,177 @@
+'''
+Время, которое логирование обработчиков отнимает у event loop.
+
+Вывод логов имитируется потоком с задержкой записи --write-latency (stdout
+контейнера при медленном драйвере логов). Сравниваются:
+
+- sync f-string: прежняя настройка - StreamHandler в потоке вызова и
+  сообщение, собранное f-строкой до вызова логгера;
+- queue: AsyncQueueHandler (logs.py) с записью JSON в фоновом потоке и
+  ленивым форматированием ("... %s", user_id);
+- queue sampled: то же с долей записей INFO обработчиков --sample-rate;
+- queue overflow: маленькая очередь при медленном выводе - записи
+  отбрасываются со счетчиком, вызов не ждет.
+
+Для каждого режима: время вызовов логгера в потоке event loop (p50/p99 и
+сумма), максимальная задержка event loop, записано и отброшено записей.
+Отдельно - стоимость отключенного уровня DEBUG с f-строкой и без нее.
+Перед замерами проверяется, что вызовы логгера в модулях бота не собирают
+сообщение до вызова (f-строкой, format или %).
+
+Запуск: python benchmarks/bench_logging.py --records 5000
+'''
+
+import argparse
+import ast
+import asyncio
+import glob
+import io
+import logging
+import os
+import time
+
+import _common
+from logs import JsonFormatter, LogPipeline, TEXT_FORMAT, log_context
+
+
+class SlowStream(io.TextIOBase):
+    '''
+    Поток вывода с блокирующей записью заданной длительности.
+    '''
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        time.sleep(self.latency)
+        self.lines += text.count("\n")
+        return len(text)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    bench_logger = logging.getLogger(f"bench.{name}")
+    bench_logger.handlers[:] = [handler]
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    return bench_logger
+
+
+async def run_handlers(bench_logger: logging.Logger, records: int, lazy: bool) -> tuple:
+    '''
+    Обработка records обновлений с одной записью INFO в каждом: время вызовов
+    логгера и максимальная задержка event loop.
+    '''
+
+    lags = []
+    running = True
+
+    async def monitor():
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    task = asyncio.ensure_future(monitor())
+    calls = []
+    for user_id in range(records):
+        token = log_context.set((user_id, "/log_water"))
+        start = time.perf_counter()
+        if lazy:
+            bench_logger.info("/log_water: пользователь %s вызвал логирование воды.", user_id)
+        else:
+            bench_logger.info(f"/log_water: пользователь {user_id} вызвал логирование воды.")
+        calls.append(time.perf_counter() - start)
+        log_context.reset(token)
+        # Обработчики уступают event loop между обновлениями.
+        if user_id % 10 == 0:
+            await asyncio.sleep(0)
+    running = False
+    await task
+    return calls, max(lags) if lags else 0.0
+
+
+def eager_calls(path: str) -> list:
+    '''
+    Строки вызовов логгера, сообщение которых собирается до вызова.
+    '''
+
+    with open(path, encoding="utf-8") as file:
+        tree = ast.parse(file.read(), path)
+    lines = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id.endswith("logger")
+                and node.args):
+            message = node.args[0]
+            if (isinstance(message, ast.JoinedStr)
+                    or isinstance(message, ast.BinOp) and isinstance(message.op, ast.Mod)
+                    or isinstance(message, ast.Call) and isinstance(message.func, ast.Attribute)
+                    and message.func.attr == "format"):
+                lines.append(node.lineno)
+    return lines
+
+
+def check_lazy_calls():
+    eager = {}
+    for path in sorted(glob.glob(os.path.join(_common.BOT_DIR, "*.py"))):
+        lines = eager_calls(path)
+        if lines:
+            eager[os.path.basename(path)] = lines
+    assert not eager, f"сообщения логов собираются до вызова: {eager}"
+
+
+async def main(args):
+    check_lazy_calls()
+    print(f"write latency {args.write_latency * 1e6:.0f} us, {args.records} records\n")
+    print(f"{'mode':16} {'call p50 us':>11} {'call p99 us':>11} {'loop ms':>8} {'max lag ms':>10} "
+          f"{'written':>8} {'dropped':>8} {'sampled':>8}")
+
+    stream = SlowStream(args.write_latency)
+    sync_handler = logging.StreamHandler(stream)
+    sync_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    calls, lag = await run_handlers(make_logger("sync", sync_handler), args.records, lazy=False)
+    print(f"{'sync f-string':16} {percentile(calls, 0.5) * 1e6:11.1f} {percentile(calls, 0.99) * 1e6:11.1f} "
+          f"{sum(calls) * 1000:8.1f} {lag * 1000:10.1f} {stream.lines:8d} {0:8d} {0:8d}", flush=True)
+
+    for mode, maxsize, sample_rate in (
+        ("queue", args.records, 1.0),
+        ("queue sampled", args.records, args.sample_rate),
+        ("queue overflow", 100, 1.0),
+    ):
+        stream = SlowStream(args.write_latency)
+        output = logging.StreamHandler(stream)
+        output.setFormatter(JsonFormatter())
+        pipeline = LogPipeline(output, maxsize, sample_rate)
+        pipeline.start()
+        calls, lag = await run_handlers(make_logger(mode, pipeline.handler), args.records, lazy=True)
+        pipeline.stop()
+        stats = pipeline.stats()
+        print(f"{mode:16} {percentile(calls, 0.5) * 1e6:11.1f} {percentile(calls, 0.99) * 1e6:11.1f} "
+              f"{sum(calls) * 1000:8.1f} {lag * 1000:10.1f} {stream.lines:8d} {stats['dropped']:8d} "
+              f"{stats['sampled_out']:8d}", flush=True)
+
+    disabled = make_logger("disabled", logging.NullHandler())
+    profile = {"weight": 70.0, "height": 175.0, "city": "Москва"}
+    print(f"\n{'disabled DEBUG':16} {'ns/call':>11}")
+    for mode, call in (
+        ("f-string", lambda i: disabled.debug(f"профиль {i}: {profile}")),
+        ("lazy", lambda i: disabled.debug("профиль %s: %s", i, profile)),
+    ):
+        start = time.perf_counter()
+        for i in range(args.records * 20):
+            call(i)
+        print(f"{mode:16} {(time.perf_counter() - start) / (args.records * 20) * 1e9:11.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--write-latency", type=float, default=0.0005, help="задержка записи в stdout, с")
+    parser.add_argument("--sample-rate", type=float, default=0.1, help="доля записей INFO обработчиков")
+    asyncio.run(main(parser.parse_args()))
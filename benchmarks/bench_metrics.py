@@ -0,0 +1,50 @@
+'''
+Накладные расходы MetricsMiddleware на одно обновление и время формирования /metrics.
+Запуск: python benchmarks/bench_metrics.py --updates 200000
+'''
+
+import argparse
+import asyncio
+import time
+
+import _common  # noqa: F401
+from aiogram.types import Message
+
+from fakes import make_message_update
+from metrics import MetricsMiddleware, metrics
+
+COMMANDS = ["/start", "/log_water 200", "/log_food банан", "/check_progress", "/new_day", "70"]
+
+
+async def handler(event, data):
+    return None
+
+
+async def run(call, events: list) -> float:
+    data = {"raw_state": "Profile:weight"}
+    start = time.perf_counter()
+    for event in events:
+        await call(handler, event, data)
+    return (time.perf_counter() - start) / len(events) * 1e9
+
+
+async def main(args):
+    events = [
+        Message.model_validate(make_message_update(i, i % 1000, COMMANDS[i % len(COMMANDS)])["message"])
+        for i in range(args.updates)
+    ]
+    middleware = MetricsMiddleware()
+    bare = await run(lambda h, e, d: h(e, d), events)
+    instrumented = await run(middleware, events)
+    start = time.perf_counter()
+    exposition = metrics.render()
+    render_ms = (time.perf_counter() - start) * 1000
+    print(f"bare          {bare:8.0f} ns/update")
+    print(f"middleware    {instrumented:8.0f} ns/update  overhead={instrumented - bare:6.0f} ns")
+    print(f"/metrics      {render_ms:8.2f} ms, {len(exposition)} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=200000)
+    asyncio.run(main(parser.parse_args()))
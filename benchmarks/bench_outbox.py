@@ -0,0 +1,170 @@
+'''
+Очередь исходящих сообщений (outbox.py) против заменителя Bot API с лимитами.
+
+Заменитель Telegram из fakes.py отвечает 429 с retry_after на отправки сверх
+--chat-limit в секунду в один чат и --global-limit в секунду всего. Сценарии:
+
+- broadcast: итоги дня в --chats чатов одновременно (как рассылка смены дня)
+  напрямую, напрямую с повтором после retry_after и через очередь;
+- interactive: ответы пользователям во время рассылки через очередь с
+  приоритетом ответов и без него (все отправки в одной очереди);
+- burst: --burst текстов в один чат одновременно с объединением сообщений.
+
+Отчет: доставлено сообщений, вызовов API, ответов 429, время и темп отправки,
+для ответов пользователям - задержка p50/p99.
+
+Запуск: python benchmarks/bench_outbox.py --chats 600
+'''
+
+import argparse
+import asyncio
+import time
+
+import _common  # noqa: F401
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from fakes import FakeTelegram
+from outbox import OutboundQueue, bulk_sends
+
+FAKE_PORT = 8094
+
+
+def queue(args) -> OutboundQueue:
+    '''
+    Очередь с лимитами чуть ниже лимитов заменителя: за любую секунду не больше
+    chat_limit отправок в чат (1 в секунду с запасом chat_limit - 1) и global_limit всего.
+    '''
+
+    return OutboundQueue(args.global_limit - 1, 1, args.chat_limit - 1)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def reset(fake: FakeTelegram):
+    # Окна лимитов заменителя очищаются через секунду без отправок.
+    await asyncio.sleep(1.1)
+    fake.calls.clear()
+    fake.flood_errors = 0
+
+
+def make_bot(url: str, outbox: OutboundQueue = None) -> Bot:
+    bot = Bot("42:BENCHMARK", session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    if outbox is not None:
+        bot.session.middleware(outbox)
+    return bot
+
+
+async def send(bot: Bot, chat_id: int, text: str, retry: bool = False) -> bool:
+    for _ in range(20):
+        try:
+            await bot.send_message(chat_id, text)
+            return True
+        except TelegramRetryAfter as e:
+            if not retry:
+                return False
+            await asyncio.sleep(e.retry_after)
+    return False
+
+
+async def bulk(bot: Bot, chat_id: int, text: str, retry: bool = False) -> bool:
+    with bulk_sends():
+        return await send(bot, chat_id, text, retry)
+
+
+def report(name: str, fake: FakeTelegram, delivered: int, seconds: float, extra: str = ""):
+    print(f"{name:30} {delivered:9d} {len(fake.calls) + fake.flood_errors:9d} {fake.flood_errors:6d} "
+          f"{seconds:8.2f} {delivered / seconds:8.1f} {extra}", flush=True)
+
+
+async def broadcast(args, fake: FakeTelegram, url: str):
+    for name, outbox, retry in (
+        ("direct", None, False),
+        ("direct + retry_after", None, True),
+        ("outbox", queue(args), False),
+    ):
+        await reset(fake)
+        bot = make_bot(url, outbox)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bulk(bot, 1000 + chat, "Итоги дня", retry) for chat in range(args.chats)))
+        report(f"broadcast {name}", fake, sum(results), time.perf_counter() - start)
+        if outbox is not None:
+            await outbox.close()
+        await bot.session.close()
+
+
+async def interactive(args, fake: FakeTelegram, url: str):
+    for name, prioritized in (("fifo", False), ("priority", True)):
+        await reset(fake)
+        outbox = queue(args)
+        bot = make_bot(url, outbox)
+        latencies = []
+
+        async def reply(chat_id: int):
+            start = time.perf_counter()
+            if prioritized:
+                await send(bot, chat_id, "Ответ")
+            else:
+                await bulk(bot, chat_id, "Ответ")
+            latencies.append(time.perf_counter() - start)
+
+        async def users():
+            replies = []
+            for i in range(args.replies):
+                replies.append(asyncio.ensure_future(reply(i)))
+                await asyncio.sleep(0.1)
+            await asyncio.gather(*replies)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(bulk(bot, 1000 + chat, "Итоги дня") for chat in range(args.chats)), users()
+        )
+        report(f"interactive {name}", fake, sum(results[:-1]) + len(latencies), time.perf_counter() - start,
+               f"reply p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+        await outbox.close()
+        await bot.session.close()
+
+
+async def burst(args, fake: FakeTelegram, url: str):
+    for name, outbox in (
+        ("direct", None),
+        ("outbox", queue(args)),
+    ):
+        await reset(fake)
+        bot = make_bot(url, outbox)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(send(bot, 7, f"Сообщение {i}") for i in range(args.burst)))
+        merged = f"merged {outbox.merged}" if outbox is not None else ""
+        report(f"burst {name}", fake, sum(results), time.perf_counter() - start, merged)
+        if outbox is not None:
+            await outbox.close()
+        await bot.session.close()
+
+
+async def main(args):
+    fake = FakeTelegram(args.latency, chat_limit=args.chat_limit, global_limit=args.global_limit)
+    url = await fake.start("127.0.0.1", FAKE_PORT)
+    print(f"limits: {args.chat_limit}/s per chat, {args.global_limit}/s total; api latency {args.latency * 1000:.0f} ms\n")
+    print(f"{'scenario':30} {'delivered':>9} {'api calls':>9} {'429':>6} {'seconds':>8} {'msg/s':>8}")
+    await broadcast(args, fake, url)
+    await interactive(args, fake, url)
+    await burst(args, fake, url)
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=600, help="чатов в рассылке")
+    parser.add_argument("--replies", type=int, default=50, help="ответов пользователям во время рассылки")
+    parser.add_argument("--burst", type=int, default=10, help="текстов в один чат одновременно")
+    parser.add_argument("--chat-limit", type=int, default=4, help="отправок в чат за секунду")
+    parser.add_argument("--global-limit", type=int, default=30, help="отправок всего за секунду")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа API, с")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+'''
+Память на одного пользователя (tracemalloc): профиль-словарь с ~14 строковыми
+ключами против записи UserProfile со __slots__, перечислениями и интернированным городом.
+Запуск: python benchmarks/bench_profiles_memory.py --users 100000 1000000
+'''
+
+import argparse
+import gc
+import random
+import tracemalloc
+
+import _common  # noqa: F401
+
+from models import ActivityType, Gender, UserProfile
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Самара"]
+
+
+def make_values(rng: random.Random) -> dict:
+    return {
+        "weight": rng.uniform(50, 100), "height": rng.uniform(150, 200), "age": rng.randint(14, 100),
+        "gender": rng.choice("мж"), "activity": rng.randint(1, 180),
+        "activity_type": rng.choice(["Бег", "Йога", "Плавание", "Силовая"]),
+        "city": rng.choice(CITIES), "water_goal": rng.uniform(1500, 4000),
+        "calorie_goal": rng.uniform(1500, 3500), "logged_water": 0, "logged_calories": 0,
+        "burned_calories": 0, "tz_offset": 10800, "day": 739000
+    }
+
+
+def as_dict(values: dict) -> dict:
+    # Название города приходит из текста сообщения, у каждого пользователя своя строка.
+    return dict(values, city=values["city"].encode().decode())
+
+
+def as_record(values: dict) -> UserProfile:
+    return UserProfile(
+        values["weight"], values["height"], values["age"], Gender.from_text(values["gender"]),
+        values["activity"], ActivityType.from_text(values["activity_type"]), values["city"],
+        values["water_goal"], values["calorie_goal"], values["logged_water"], values["logged_calories"],
+        values["burned_calories"], values["tz_offset"], values["day"]
+    )
+
+
+def measure(build, users: int) -> float:
+    rng = random.Random(1)
+    values = [make_values(rng) for _ in range(users)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = {user_id: build(values[user_id]) for user_id in range(users)}
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table
+    return (after - before) / users
+
+
+def main(args):
+    for users in args.users:
+        dict_bytes = measure(as_dict, users)
+        record_bytes = measure(as_record, users)
+        print(
+            f"users={users:<8} dict={dict_bytes:7.1f} B/user  slots={record_bytes:7.1f} B/user  "
+            f"saved={(1 - record_bytes / dict_bytes) * 100:5.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[100000, 1000000])
+    main(parser.parse_args())
@@ -0,0 +1,72 @@
+'''
+Задержка event loop при N одновременных /check_progress: построение графиков
+в event loop (как раньше) против пула процессов RenderService.
+Запуск: python benchmarks/bench_render.py --concurrency 20
+'''
+
+import argparse
+import asyncio
+import time
+
+import _common  # noqa: F401
+
+from render import RenderService
+from utils import plot_water_chart, plot_calories_chart
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.005):
+    '''
+    Максимальное и среднее опоздание пробуждения периодической задачи.
+    '''
+
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - start - interval) * 1000)
+    return lags
+
+
+async def inline_progress(i: int):
+    plot_water_chart(1000 + i, 1500).getvalue()
+    plot_calories_chart(2500, 1200 + i, 300).getvalue()
+
+
+async def pooled_progress(service: RenderService, i: int):
+    await service.render(plot_water_chart, 1000 + i, 1500)
+    await service.render(plot_calories_chart, 2500, 1200 + i, 300)
+
+
+async def run(label: str, make_call, concurrency: int):
+    stop = asyncio.Event()
+    probe = asyncio.ensure_future(measure_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(make_call(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = sorted(await probe)
+    print(
+        f"{label:<8} wall={elapsed:6.2f} s  "
+        f"loop_lag_max={lags[-1]:8.1f} ms  "
+        f"loop_lag_p99={lags[int(len(lags) * 0.99) - 1]:8.1f} ms  samples={len(lags)}"
+    )
+
+
+async def main(args):
+    service = RenderService(workers=args.workers, queue_size=args.queue_size)
+    service.start()
+    # Прогрев процессов, чтобы не учитывать импорт matplotlib.
+    await asyncio.gather(*(pooled_progress(service, i) for i in range(args.workers)))
+    try:
+        await run("inline", inline_progress, args.concurrency)
+        await run("pool", lambda i: pooled_progress(service, i), args.concurrency)
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,127 @@
+'''
+Поведение защиты внешних API (resilience.Upstream) под внедренными сбоями.
+
+Заменитель OpenWeatherMap из fakes.py получает поток запросов с постоянной
+частотой в нескольких сценариях: исправный, нестабильный (доля ошибок 500),
+медленный (ответ дольше таймаута) и отключение с восстановлением. Каждый
+сценарий прогоняется без защиты (только таймауты HTTP-клиента) и через
+Upstream. Отчет: доля успешных ответов, задержки вызова, число ожидающих
+вызовов в боте и запросов к API.
+
+Запуск: python benchmarks/bench_resilience.py --rate 50 --duration 10
+'''
+
+import argparse
+import asyncio
+import os
+import time
+
+FAKE_PORT = 8091
+# Адрес API читается config.py при импорте, поэтому задается до импорта модулей бота.
+os.environ.setdefault("OPEN_WEATHER_URL", f"http://127.0.0.1:{FAKE_PORT}/data/2.5/weather")
+
+import _common  # noqa: F401,E402
+from fakes import FakeOpenWeather  # noqa: E402
+from http_client import http_client  # noqa: E402
+from resilience import CircuitBreaker, Upstream, UpstreamUnavailable  # noqa: E402
+from utils import fetch_weather  # noqa: E402
+
+# Запрос к API без защиты: fetch_weather под декоратором resilient.
+unprotected_fetch = fetch_weather.__wrapped__
+
+# Сценарии: (имя, задержка API, доля ошибок, доля длительности теста до восстановления API).
+SCENARIOS = (
+    ("healthy", 0.05, 0.0, None),
+    ("flaky 30%", 0.05, 0.3, None),
+    ("slow 10s", 10.0, 0.0, None),
+    ("outage+recovery", 0.05, 1.0, 0.5),
+)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_scenario(args, fake: FakeOpenWeather, latency: float, error_rate: float, recover_at, call) -> dict:
+    # Запросы предыдущего прогона, которые API еще обрабатывает, не должны попасть в замер.
+    while fake.in_flight:
+        await asyncio.sleep(0.1)
+    fake.latency, fake.error_rate = latency, error_rate
+    fake.requests = fake.errors = fake.peak_in_flight = 0
+    outcomes = {"ok": 0, "unavailable": 0, "error": 0}
+    latencies = []
+    pending = 0
+    peak_pending = 0
+
+    async def one():
+        nonlocal pending, peak_pending
+        pending += 1
+        peak_pending = max(peak_pending, pending)
+        start = time.perf_counter()
+        try:
+            await call("Москва")
+            outcomes["ok"] += 1
+        except UpstreamUnavailable:
+            outcomes["unavailable"] += 1
+        except Exception:
+            outcomes["error"] += 1
+        finally:
+            latencies.append(time.perf_counter() - start)
+            pending -= 1
+
+    tasks = []
+    start = time.perf_counter()
+    total = int(args.rate * args.duration)
+    for i in range(total):
+        if recover_at is not None and i == int(total * recover_at):
+            fake.error_rate = 0.0
+        tasks.append(asyncio.ensure_future(one()))
+        await asyncio.sleep(max(0.0, start + (i + 1) / args.rate - time.perf_counter()))
+    await asyncio.gather(*tasks)
+    return {
+        "success": outcomes["ok"] / total,
+        "unavailable": outcomes["unavailable"],
+        "errors": outcomes["error"],
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "peak_pending": peak_pending,
+        "api_requests": fake.requests,
+        "api_peak_in_flight": fake.peak_in_flight,
+        "elapsed": time.perf_counter() - start
+    }
+
+
+async def main(args):
+    fake = FakeOpenWeather()
+    await fake.start("127.0.0.1", FAKE_PORT)
+    await http_client.start()
+    print(f"{'scenario':16} {'mode':11} {'ok %':>6} {'unavail':>7} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'pending':>7} {'api req':>7} {'api conc':>8} {'wall s':>6}")
+    try:
+        for name, latency, error_rate, recover_at in SCENARIOS:
+            upstream = Upstream("bench", breaker=CircuitBreaker(reset=args.breaker_reset))
+            modes = (
+                ("unprotected", unprotected_fetch),
+                ("upstream", lambda city: upstream.call(unprotected_fetch, city)),
+            )
+            for mode, call in modes:
+                result = await run_scenario(args, fake, latency, error_rate, recover_at, call)
+                print(f"{name:16} {mode:11} {result['success'] * 100:6.1f} {result['unavailable']:7d} "
+                      f"{result['errors']:6d} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f} "
+                      f"{result['max_ms']:8.1f} {result['peak_pending']:7d} {result['api_requests']:7d} "
+                      f"{result['api_peak_in_flight']:8d} {result['elapsed']:6.1f}", flush=True)
+    finally:
+        await http_client.close()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50, help="вызовов в секунду")
+    parser.add_argument("--duration", type=float, default=10, help="секунды подачи вызовов")
+    parser.add_argument("--breaker-reset", type=float, default=1.0, help="время до пробного запроса, с")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,135 @@
+'''
+Смена дня (RolloverScheduler.run_once) в хранилище SQLite, где большинство
+пользователей не в памяти: прежний сброс через загрузку профиля в горячий
+уровень против сброса одним запросом в базе без загрузки.
+
+Регистрируются --users пользователей в нескольких часовых поясах, у всех
+наступил новый местный день; --logged-fraction из них записали логи за
+прошедший день. Активные пользователи (--active-fraction) обращаются к боту
+перед сменой дня и после нее, их профили должны оставаться в памяти.
+
+Отчет: время обхода, записанных в базу строк, профилей в памяти, доля
+активных пользователей в памяти после обхода и доля попаданий в память их
+обращений после смены дня.
+
+Запуск: python benchmarks/bench_rollover.py --users 200000 --hot-size 20000
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import _common  # noqa: F401
+
+from models import ActivityType, Gender, UserProfile
+from rollover import RolloverScheduler
+from storage import SQLiteUserStorage, reset_profile_day
+from utils import local_day
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Самара"]
+TZ_OFFSETS = [2 * 3600, 3 * 3600, 5 * 3600, 7 * 3600]
+
+
+class AdmittingStorage(SQLiteUserStorage):
+    '''
+    Прежний сброс: профиль загружается в горячий уровень и записывается целиком.
+    '''
+
+    async def reset_day(self, user_id: int, day: int, water_goal: float = None, if_before: bool = False):
+        previous = reset_profile_day(await self._load(user_id), day, water_goal, if_before)
+        if previous is not None:
+            self._mark_dirty(user_id)
+        return previous
+
+
+class StubWeather:
+    '''
+    Погода без сети: обход меряет только работу хранилища.
+    '''
+
+    ttl = 600
+
+    async def prefetch(self, names, max_age: float = 0.0) -> int:
+        return 0
+
+    async def get(self, city: str) -> float:
+        return 20.0
+
+
+def make_profile(rng: random.Random, now: float, logged: bool) -> UserProfile:
+    tz_offset = rng.choice(TZ_OFFSETS)
+    return UserProfile(
+        weight=rng.uniform(50, 100), height=rng.uniform(150, 200), age=rng.randint(14, 100),
+        gender=rng.choice(list(Gender)), activity=rng.randint(1, 180), activity_type=ActivityType.RUN,
+        city=rng.choice(CITIES), water_goal=2500.0, calorie_goal=2200.0, tz_offset=tz_offset,
+        day=local_day(tz_offset, now) - 1, logged_water=500 if logged else 0,
+        logged_calories=1200 if logged else 0
+    )
+
+
+async def run(args, storage_class) -> dict:
+    rng = random.Random(42)
+    now = time.time()
+    with tempfile.TemporaryDirectory() as directory:
+        storage = storage_class(path=os.path.join(directory, "users.sqlite3"), flush_batch=10000,
+                                hot_size=args.hot_size)
+        await storage.start()
+        for user_id in range(args.users):
+            await storage.set(user_id, make_profile(rng, now, rng.random() < args.logged_fraction))
+            if user_id % 1000 == 0:
+                await asyncio.sleep(0)
+        await storage.flush()
+
+        active = rng.sample(range(args.users), max(1, int(args.users * args.active_fraction)))
+        for user_id in active:
+            await storage.get(user_id)
+        changes = storage._db.total_changes
+
+        scheduler = RolloverScheduler(storage, StubWeather(), notify=False)
+        start = time.perf_counter()
+        rolled = await scheduler.run_once(now)
+        await storage.flush()
+        elapsed = time.perf_counter() - start
+
+        retained = sum(1 for user_id in active if user_id in storage._rows)
+        hits = storage.hits
+        for user_id in active:
+            await storage.get(user_id)
+        result = {
+            "seconds": elapsed,
+            "rolled": rolled,
+            "written": storage._db.total_changes - changes,
+            "hot": len(storage._rows),
+            "retained": retained / len(active),
+            "hit_rate": (storage.hits - hits) / len(active)
+        }
+        # Пользователи с логами сменили день, остальным сбрасывать было нечего.
+        stale = 0
+        for user_id in range(0, args.users, max(1, args.users // 1000)):
+            stale += bool((await storage.get(user_id)).logged_water)
+        assert stale == 0, f"{stale} профилей остались с логами прошедшего дня"
+        await storage.close()
+        return result
+
+
+def main(args):
+    print(f"{args.users} users, hot tier {args.hot_size}, {args.logged_fraction:.0%} logged yesterday, "
+          f"{args.active_fraction:.0%} active\n")
+    print(f"{'reset':14} {'seconds':>8} {'rolled':>8} {'rows written':>12} {'in memory':>9} "
+          f"{'active kept':>11} {'hit rate':>8}")
+    for label, storage_class in (("admit to hot", AdmittingStorage), ("cold update", SQLiteUserStorage)):
+        result = asyncio.run(run(args, storage_class))
+        print(f"{label:14} {result['seconds']:8.2f} {result['rolled']:8d} {result['written']:12d} "
+              f"{result['hot']:9d} {result['retained']:11.3f} {result['hit_rate']:8.3f}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--hot-size", type=int, default=20000, help="профилей в памяти")
+    parser.add_argument("--logged-fraction", type=float, default=0.2, help="доля пользователей с логами за день")
+    parser.add_argument("--active-fraction", type=float, default=0.05, help="доля активных пользователей")
+    main(parser.parse_args())
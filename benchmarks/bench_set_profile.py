@@ -0,0 +1,161 @@
+'''
+Заполнение профиля: мастер /set_profile по шагам против одного сообщения
+/set_profile 70 175 30 м 45 бег Москва - и частичного ввода с продолжением
+мастером.
+
+Настоящий Dispatcher с handlers.router, сессия бота без сети (RecordingSession),
+погода и продукты - заглушки. Для каждого сценария на одного пользователя:
+обновлений, вызовов Bot API, операций хранилища FSM, вызовов хранилища
+пользователей (записей из них), запросов погоды и время обработчиков.
+
+Запуск: python benchmarks/bench_set_profile.py --users 1000
+'''
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import _common  # noqa: F401
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from bench_handlers import Updates, fake_weather
+from fakes import RecordingSession
+from handlers import router
+from storage import users
+from weather_cache import weather_cache
+
+WIZARD = (
+    ("message", "/set_profile"),
+    ("message", "70"),
+    ("message", "175"),
+    ("message", "30"),
+    ("message", "м"),
+    ("message", "45"),
+    ("callback", "activity:run"),
+    ("message", "Москва"),
+    ("message", "-"),
+)
+
+SCENARIOS = (
+    ("wizard", WIZARD),
+    ("one message", (("message", "/set_profile 70 175 30 м 45 бег Москва -"),)),
+    ("partial + wizard", (
+        ("message", "/set_profile 70 175 30"),
+        ("message", "м"),
+        ("message", "45"),
+        ("callback", "activity:run"),
+        ("message", "Москва"),
+        ("message", "-"),
+    )),
+)
+
+# Методы хранилищ, обращения к которым считаются.
+FSM_METHODS = ("get_state", "set_state", "get_data", "set_data")
+USER_METHODS = ("get", "set", "update", "incr")
+USER_WRITES = ("set", "update", "incr")
+
+
+class CountingStorage(MemoryStorage):
+    '''
+    Хранилище FSM в памяти со счетчиком операций.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.ops = Counter()
+
+    async def get_state(self, key):
+        self.ops["get_state"] += 1
+        return await super().get_state(key)
+
+    async def set_state(self, key, state=None):
+        self.ops["set_state"] += 1
+        await super().set_state(key, state)
+
+    async def get_data(self, key):
+        self.ops["get_data"] += 1
+        return await super().get_data(key)
+
+    async def set_data(self, key, data):
+        self.ops["set_data"] += 1
+        await super().set_data(key, data)
+
+
+def count_calls(obj, names, counter: Counter):
+    for name in names:
+        method = getattr(obj, name)
+
+        async def counted(*args, _method=method, _name=name, **kwargs):
+            counter[_name] += 1
+            return await _method(*args, **kwargs)
+
+        setattr(obj, name, counted)
+
+
+async def main(args):
+    weather_requests = Counter()
+
+    async def counted_weather(city: str, city_id: int = None):
+        weather_requests["fetch"] += 1
+        return await fake_weather(city, city_id)
+
+    weather_cache._fetch = counted_weather
+    lookups = Counter()
+    count_calls(weather_cache, ("get_info",), lookups)
+    user_calls = Counter()
+    count_calls(users, USER_METHODS, user_calls)
+
+    storage = CountingStorage()
+    session = RecordingSession()
+    bot = Bot(token="42:BENCHMARK", session=session)
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+    updates = Updates()
+
+    print(f"{args.users} users per scenario\n")
+    print(f"{'scenario':18} {'updates':>7} {'api calls':>9} {'fsm ops':>7} {'user calls':>10} {'user writes':>11} "
+          f"{'weather':>7} {'handler us':>10}")
+    results = {}
+    for index, (name, steps) in enumerate(SCENARIOS):
+        session.calls.clear()
+        storage.ops.clear()
+        user_calls.clear()
+        lookups.clear()
+        elapsed = 0.0
+        for user_id in range((index + 1) * 10 ** 6, (index + 1) * 10 ** 6 + args.users):
+            for kind, payload in steps:
+                update = updates.build(user_id, kind, payload)
+                start = time.perf_counter()
+                await dp.feed_update(bot, update)
+                elapsed += time.perf_counter() - start
+            profile = await users.get(user_id)
+            assert profile is not None and profile.calorie_goal is not None, name
+        user_calls["get"] -= args.users
+        per_user = {
+            "updates": len(steps),
+            "api": len(session.calls) / args.users,
+            "fsm": sum(storage.ops.values()) / args.users,
+            "user_calls": sum(user_calls.values()) / args.users,
+            "user_writes": sum(user_calls[method] for method in USER_WRITES) / args.users,
+            "weather": lookups["get_info"] / args.users,
+            "handler_us": elapsed / args.users * 1e6
+        }
+        results[name] = per_user
+        print(f"{name:18} {per_user['updates']:7d} {per_user['api']:9.1f} {per_user['fsm']:7.1f} "
+              f"{per_user['user_calls']:10.1f} {per_user['user_writes']:11.1f} {per_user['weather']:7.1f} "
+              f"{per_user['handler_us']:10.0f}", flush=True)
+
+    wizard, fast = results["wizard"], results["one message"]
+    print(f"\none message vs wizard: updates {wizard['updates']} -> {fast['updates']}, "
+          f"Bot API calls {wizard['api']:.0f} -> {fast['api']:.0f}, FSM ops {wizard['fsm']:.0f} -> {fast['fsm']:.0f}, "
+          f"profile writes {wizard['user_writes']:.0f} -> {fast['user_writes']:.0f}; "
+          f"upstream weather requests {weather_requests['fetch']} (cached by city)")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
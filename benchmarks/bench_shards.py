@@ -0,0 +1,57 @@
+'''
+Масштабирование шардированного режима: один и тот же нагрузочный сценарий
+(benchmarks/loadtest.py, пользователи без пауз) для SHARDS = 1, 2, ..., N.
+SHARDS=1 - обычный бот в одном процессе, больше 1 - супервизор и воркеры.
+
+Запуск: python benchmarks/bench_shards.py --shards 1,2,4 --users 500 --duration 20
+'''
+
+import asyncio
+import os
+
+from loadtest import LoadTest, bot_environment, build_parser, spawn_bot, start_services, stop_bot
+
+
+async def run(args, shards: int) -> dict:
+    services, urls = await start_services(args)
+    environment = bot_environment(args, urls)
+    environment["SHARDS"] = str(shards)
+    process = None
+    try:
+        with open(args.bot_log, "w") as log_file:
+            process = spawn_bot(environment, log_file)
+            await asyncio.wait_for(services["telegram"].polling.wait(), args.start_timeout)
+            test = LoadTest(args, services["telegram"])
+            elapsed = await test.run(process.pid)
+            result = test.report(elapsed, services)
+    finally:
+        if process is not None:
+            stop_bot(process)
+        for service in services.values():
+            await service.stop()
+    return result
+
+
+async def main(args):
+    counts = [int(count) for count in args.shards.split(",")]
+    results = {}
+    for shards in counts:
+        print(f"\n=== SHARDS={shards} ===")
+        results[shards] = await run(args, shards)
+
+    base = results[counts[0]]["throughput_updates_per_sec"]
+    print(f"\nядер: {os.cpu_count()}")
+    print(f"{'shards':>6} {'upd/s':>10} {'speedup':>8} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>9}")
+    for shards, result in results.items():
+        peak = max((point["rss_mb"] or 0 for point in result["timeline"]), default=0)
+        print(f"{shards:6d} {result['throughput_updates_per_sec']:10.1f} "
+              f"{result['throughput_updates_per_sec'] / base:8.2f} {result['p50_ms']:9.1f} "
+              f"{result['p99_ms']:9.1f} {peak:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = build_parser(__doc__)
+    parser.add_argument("--shards", default=",".join(str(2 ** i) for i in range(4) if 2 ** i <= (os.cpu_count() or 1) * 2))
+    parser.set_defaults(users=500, ramp=2, duration=20, think=0.0, tg_latency=0.005, owm_latency=0.05,
+                        off_latency=0.05)
+    asyncio.run(main(parser.parse_args()))
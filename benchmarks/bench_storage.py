@@ -0,0 +1,70 @@
+'''
+Пропускная способность хранилищ пользователей на 10k и 100k профилей:
+создание профилей и поток обновлений счетчиков (log_water / log_food).
+Запуск: python benchmarks/bench_storage.py --users 10000 100000
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import _common  # noqa: F401
+
+from models import ActivityType, Gender, UserProfile
+from storage import MemoryUserStorage, SQLiteUserStorage
+
+
+def make_profile(rng: random.Random) -> UserProfile:
+    return UserProfile(
+        weight=rng.uniform(50, 100), height=rng.uniform(150, 200), age=rng.randint(14, 100),
+        gender=rng.choice(list(Gender)), activity=rng.randint(1, 180), activity_type=ActivityType.RUN,
+        city="Москва", water_goal=2500.0, calorie_goal=2200.0
+    )
+
+
+async def run(label: str, storage, users: int, updates: int):
+    rng = random.Random(42)
+    await storage.start()
+
+    start = time.perf_counter()
+    for user_id in range(users):
+        await storage.set(user_id, make_profile(rng))
+    create_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(updates):
+        user_id = rng.randrange(users)
+        await storage.incr(user_id, "logged_water", 250)
+        await storage.get(user_id)
+    update_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await storage.close()
+    close_elapsed = time.perf_counter() - start
+
+    commits = getattr(storage, "commits", 0)
+    print(
+        f"{label:<8} users={users:<7} create={users / create_elapsed:10.0f} ops/s  "
+        f"incr+get={updates / update_elapsed:10.0f} ops/s  final_flush={close_elapsed * 1000:7.1f} ms  "
+        f"commits={commits}"
+    )
+
+
+async def main(args):
+    for users in args.users:
+        await run("memory", MemoryUserStorage(), users, args.updates)
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SQLiteUserStorage(path=os.path.join(directory, "users.sqlite3"),
+                                        flush_interval=args.flush_interval)
+            await run("sqlite", storage, users, args.updates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--updates", type=int, default=200000)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,165 @@
+'''
+Дневные агрегаты для /history и /trends: память на пользователя и время
+построения тренда.
+
+Агрегаты Rollups (events.py) целиком, заполненные через Rollups.load,
+сравниваются со словарем {(user_id, день): [4 показателя]}, в котором
+агрегаты хранятся за всю историю. Память измеряется tracemalloc для истории
+в 30 и 365 дней, время тренда - для 30-дневного ряда Rollups.series. Отдельно замеряется построение графика
+тренда за месяц с прореживанием до TREND_MAX_POINTS точек и без него.
+
+Затем в журнал событий во временном каталоге записывается история всех
+пользователей, и агрегаты каждого строятся при первом обращении
+(EventLog.load_rollups) при --max-users буферах в памяти: время построения
+по индексам сегментов (p50/p99) и число буферов в памяти.
+
+Запуск: python benchmarks/bench_trends.py --users 2000
+'''
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import _common  # noqa: F401
+from config import ROLLUP_DAYS, TREND_MAX_POINTS
+from events import FOOD, ROLLUP_COLUMNS, WATER, WORKOUT, ActivityEvent, EventLog, Rollups, event_day, event_totals
+from utils import downsample, plot_trends_chart
+
+TODAY = date(2026, 1, 1).toordinal()
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def day_activity(rng: random.Random, user_id: int, day: int):
+    '''
+    События активности пользователя за день: вода, еда и тренировка в полдень по UTC.
+    '''
+
+    ts = (day - EPOCH) * 86400 + 43200
+    yield ActivityEvent(user_id, ts, WATER, rng.uniform(200, 500), 0.0, "")
+    yield ActivityEvent(user_id, ts, FOOD, 100.0, rng.uniform(300, 900), "")
+    yield ActivityEvent(user_id, ts, WORKOUT, 30.0, rng.uniform(0, 400), "")
+
+
+def activity(users: int, days: int):
+    '''
+    События активности по дням в порядке записи: по три в день на пользователя.
+    '''
+
+    rng = random.Random(1)
+    for day in range(TODAY - days + 1, TODAY + 1):
+        for user_id in range(users):
+            yield from day_activity(rng, user_id, day)
+
+
+def fill_rollups(users: int, days: int) -> Rollups:
+    rng = random.Random(1)
+    rollups = Rollups(max_users=users)
+    for user_id in range(users):
+        rollups.load(user_id, (event for day in range(TODAY - days + 1, TODAY + 1)
+                               for event in day_activity(rng, user_id, day)))
+    return rollups
+
+
+def fill_dict(users: int, days: int) -> dict:
+    daily = {}
+    for event in activity(users, days):
+        key = (event.user_id, event_day(event.ts).toordinal())
+        totals = daily.get(key)
+        if totals is None:
+            totals = daily[key] = [0.0] * ROLLUP_COLUMNS
+        for column, amount in event_totals(event):
+            totals[column] += amount
+    return daily
+
+
+def memory_per_user(fill, users: int, days: int) -> float:
+    tracemalloc.start()
+    structure = fill(users, days)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del structure
+    return size / users
+
+
+def trend_time(rollups: Rollups, users: int, days: int = 30) -> float:
+    start = time.perf_counter()
+    for user_id in range(users):
+        rollups.series(user_id, days, date.fromordinal(TODAY))
+    return (time.perf_counter() - start) / users
+
+
+def render_time(rows: list, points: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        bucket, values = downsample([row[:3] for row in rows], points)
+        plot_trends_chart(TODAY - len(rows) + 1, bucket, *values.T.ravel())
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def lazy_load(users: int, days: int, max_users: int) -> dict:
+    '''
+    Построение агрегатов из журнала при первом обращении к каждому пользователю.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = EventLog(directory=directory)
+        log.rollups = Rollups(max_users=max_users)
+        await log.start()
+        # События пишутся с временем из истории, а не текущим, поэтому в обход append.
+        for event in activity(users, days):
+            log._write(event)
+        latencies = []
+        for user_id in random.Random(2).sample(range(users), users):
+            start = time.perf_counter()
+            await log.load_rollups(user_id)
+            latencies.append(time.perf_counter() - start)
+            assert log.rollups.series(user_id, 1, date.fromordinal(TODAY))[0][1] > 0, user_id
+        result = {
+            "segments": len(log.segments()), "rings": len(log.rollups),
+            "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99)
+        }
+        log.close()
+        return result
+
+
+def main(args):
+    print(f"ring depth {ROLLUP_DAYS} days, {ROLLUP_COLUMNS} columns\n")
+    print(f"{'history':>8} {'rollups B/user':>14} {'dict B/user':>12} {'trend us':>9}")
+    for days in (30, 365):
+        rollup_bytes = memory_per_user(fill_rollups, args.users, days)
+        dict_bytes = memory_per_user(fill_dict, args.users, days)
+        rollups = fill_rollups(args.users, days)
+        print(f"{days:8d} {rollup_bytes:14.0f} {dict_bytes:12.0f} "
+              f"{trend_time(rollups, args.users) * 1e6:9.1f}", flush=True)
+
+    rows = fill_rollups(1, 90)
+    print(f"\n{'chart':16} {'points':>6} {'render ms':>10}")
+    for days in (30, 90):
+        series = rows.series(0, days, date.fromordinal(TODAY))
+        for points in (days, TREND_MAX_POINTS):
+            bucket, _ = downsample(series, points)
+            print(f"{f'{days} days':16} {-(-days // bucket):6d} {render_time(series, points) * 1000:10.1f}", flush=True)
+
+    print(f"\n{'history':>8} {'segments':>8} {'rings in memory':>15} {'load p50 ms':>11} {'load p99 ms':>11}")
+    for days in (30, ROLLUP_DAYS):
+        result = asyncio.run(lazy_load(args.users, days, args.max_users))
+        print(f"{days:8d} {result['segments']:8d} {result['rings']:15d} {result['p50'] * 1000:11.2f} "
+              f"{result['p99'] * 1000:11.2f}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--max-users", type=int, default=500, help="буферов агрегатов в памяти")
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+'''
+Профили в памяти хранилища SQLite: без ограничения (все загруженные профили
+остаются в памяти) против горячего уровня из --hot-size профилей с
+вытеснением давно не используемых.
+
+Для каждого числа зарегистрированных пользователей (--users) в отдельном
+процессе: регистрация всех пользователей, затем день трафика - --requests
+обращений log_water / check_progress (incr + get), --active-share из которых
+приходится на активных пользователей (--active-fraction зарегистрированных),
+остальные - на случайных.
+
+Отчет: пиковый RSS процесса, профилей в памяти, доля попаданий в память,
+задержка обращения с загрузкой профиля с диска (p50/p99) и темп обращений.
+
+Запуск: python benchmarks/bench_user_tiers.py --users 50000 200000 400000
+'''
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+import _common  # noqa: F401
+
+from models import ActivityType, Gender, UserProfile
+from storage import SQLiteUserStorage
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Самара"]
+
+
+def make_profile(rng: random.Random) -> UserProfile:
+    return UserProfile(
+        weight=rng.uniform(50, 100), height=rng.uniform(150, 200), age=rng.randint(14, 100),
+        gender=rng.choice(list(Gender)), activity=rng.randint(1, 180), activity_type=ActivityType.RUN,
+        city=rng.choice(CITIES), water_goal=2500.0, calorie_goal=2200.0
+    )
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args, users: int, hot_size: int) -> dict:
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLiteUserStorage(path=os.path.join(directory, "users.sqlite3"), flush_batch=10000,
+                                    hot_size=hot_size)
+        await storage.start()
+        for user_id in range(users):
+            await storage.set(user_id, make_profile(rng))
+            if user_id % 1000 == 0:
+                await asyncio.sleep(0)
+        await storage.flush()
+
+        active = rng.sample(range(users), max(1, int(users * args.active_fraction)))
+        hits = storage.hits
+        load_latencies = []
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            user_id = rng.choice(active) if rng.random() < args.active_share else rng.randrange(users)
+            misses = storage.misses
+            call_start = time.perf_counter()
+            await storage.incr(user_id, "logged_water", 250)
+            await storage.get(user_id)
+            if storage.misses > misses:
+                load_latencies.append(time.perf_counter() - call_start)
+        elapsed = time.perf_counter() - start
+        hits = storage.hits - hits
+        # Каждое обращение - два вызова хранилища, второй всегда попадает в память.
+        lookups = 2 * args.requests
+        result = {
+            "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "hot": len(storage._rows),
+            "hit_rate": hits / lookups,
+            "load_p50": percentile(load_latencies, 0.5),
+            "load_p99": percentile(load_latencies, 0.99),
+            "loads": len(load_latencies),
+            "rate": args.requests / elapsed
+        }
+        await storage.close()
+        return result
+
+
+def run_case(args, users: int, hot_size: int) -> dict:
+    return asyncio.run(run(args, users, hot_size))
+
+
+def main(args):
+    print(f"{args.requests} requests, {args.active_fraction:.0%} active users get {args.active_share:.0%} of them\n")
+    print(f"{'tier':12} {'users':>8} {'peak RSS MB':>11} {'in memory':>9} {'hit rate':>8} "
+          f"{'loads':>7} {'load p50 us':>11} {'load p99 us':>11} {'req/s':>8}")
+    # Каждый замер в новом процессе: пиковый RSS не переносится между замерами.
+    context = multiprocessing.get_context("spawn")
+    for users in args.users:
+        for label, hot_size in (("unbounded", users + 1), (f"hot {args.hot_size}", args.hot_size)):
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (args, users, hot_size))
+            print(f"{label:12} {users:8d} {result['rss_mb']:11.1f} {result['hot']:9d} {result['hit_rate']:8.3f} "
+                  f"{result['loads']:7d} {result['load_p50'] * 1e6:11.0f} {result['load_p99'] * 1e6:11.0f} "
+                  f"{result['rate']:8.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[50000, 200000, 400000])
+    parser.add_argument("--hot-size", type=int, default=20000, help="профилей в памяти")
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--active-fraction", type=float, default=0.05, help="доля активных пользователей")
+    parser.add_argument("--active-share", type=float, default=0.9, help="доля обращений активных пользователей")
+    main(parser.parse_args())
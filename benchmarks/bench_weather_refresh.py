@@ -0,0 +1,198 @@
+'''
+Запросы погоды к OpenWeatherMap при разных написаниях городов в профилях.
+
+Пользователям назначаются города заменителя OpenWeatherMap (fakes.py) в
+разных написаниях: "Москва", "москва", "МОСКВА ", "Moscow" и т.п. Сравниваются
+три способа получить погоду для всех пользователей в одном цикле обновления
+(после истечения TTL кэша):
+
+- no cache: запрос на пользователя (одновременные запросы одного написания объединяются);
+- text cache: прежний кэш по нормализованному названию - запрос на написание;
+- city ids: индекс городов приводит написания к id, погода всех городов
+  загружается групповыми запросами (WeatherRefresher), пользователи получают
+  значения из кэша.
+
+Отдельно замеряется распознавание города индексом (точное или другое
+написание) и подсказка похожего города при опечатке на списке из repo (bot/cities.tsv) и на синтетическом
+списке размера полного списка OpenWeatherMap.
+
+Запуск: python benchmarks/bench_weather_refresh.py --users 2000
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+FAKE_PORT = 8093
+# Адрес API читается config.py при импорте, поэтому задается до импорта модулей бота.
+os.environ.setdefault("OPEN_WEATHER_URL", f"http://127.0.0.1:{FAKE_PORT}/data/2.5/weather")
+
+import _common  # noqa: F401,E402
+from config import UPSTREAM_CONCURRENCY  # noqa: E402
+from city_index import CityIndex, build_index, city_index  # noqa: E402
+from fakes import FAKE_CITY_NAMES, FakeOpenWeather  # noqa: E402
+from http_client import http_client  # noqa: E402
+from models import UserProfile, cities  # noqa: E402
+from storage import MemoryUserStorage  # noqa: E402
+from weather_cache import WeatherCache, WeatherRefresher  # noqa: E402
+
+SYLLABLES = ("ка", "ли", "но", "ров", "ск", "град", "во", "ме", "за", "пол", "ту", "ря", "бе", "ши", "ан", "ов")
+
+
+def spellings() -> list:
+    '''
+    Написания городов заменителя, которые встречаются во вводе пользователей.
+    '''
+
+    variants = []
+    for key, name in FAKE_CITY_NAMES.items():
+        if key == name.casefold():
+            variants += [name, key, name.upper(), f" {name}  ", key.capitalize()]
+        else:
+            variants += [key, key.title()]
+    return variants
+
+
+async def fill_users(storage, users: int, rng: random.Random) -> list:
+    names = spellings()
+    assigned = []
+    for user_id in range(users):
+        name = rng.choice(names)
+        await storage.set(user_id, UserProfile(weight=70, activity=30, water_goal=2000, city=name))
+        assigned.append(name)
+    return assigned
+
+
+async def run_cycle(fake: FakeOpenWeather, cache: WeatherCache, names: list, get) -> tuple:
+    fake.requests = 0
+    fake.group_requests = 0
+    start = time.perf_counter()
+    await get(cache, names)
+    return fake.requests, fake.group_requests, time.perf_counter() - start
+
+
+async def in_waves(names: list, get):
+    '''
+    Обращения пользователей волнами по UPSTREAM_CONCURRENCY одновременных запросов.
+    '''
+
+    for start in range(0, len(names), UPSTREAM_CONCURRENCY):
+        await asyncio.gather(*(get(name) for name in names[start:start + UPSTREAM_CONCURRENCY]))
+
+
+async def per_user(cache: WeatherCache, names: list):
+    async def get(name: str):
+        # Без кэша: каждое обращение - запрос к API.
+        cache.invalidate(name)
+        await cache.get_info(name)
+
+    await in_waves(names, get)
+
+
+async def by_text(cache: WeatherCache, names: list):
+    await in_waves(names, cache.get_info)
+
+
+def synthetic_list(path: str, count: int, rng: random.Random) -> list:
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5))).capitalize())
+    names = sorted(names)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump([{"id": 10_000_000 + i, "name": name, "country": "RU"} for i, name in enumerate(names)], file)
+    return names
+
+
+def typo(name: str, rng: random.Random) -> str:
+    index = rng.randrange(1, len(name))
+    return name[:index] + rng.choice("аеоиу") + name[index + 1:]
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def resolve_latency(lookup, queries: dict):
+    for kind, items in queries.items():
+        latencies, hits = [], 0
+        for query in items:
+            start = time.perf_counter()
+            hits += lookup(query) is not None
+            latencies.append(time.perf_counter() - start)
+        print(f"{kind:16} {percentile(latencies, 0.5) * 1e6:9.1f} {percentile(latencies, 0.99) * 1e6:9.1f} "
+              f"{hits / len(items) * 100:6.1f}")
+
+
+async def main(args):
+    rng = random.Random(1)
+    fake = FakeOpenWeather(args.latency)
+    await fake.start("127.0.0.1", FAKE_PORT)
+    await http_client.start()
+
+    storage = MemoryUserStorage()
+    names = await fill_users(storage, args.users, rng)
+    distinct_ids = {city_index.resolve(name).id for name in names}
+    print(f"users {args.users}, spellings {len(set(names))}, "
+          f"text keys {len({' '.join(name.split()).casefold() for name in names})}, cities {len(distinct_ids)}\n")
+
+    print(f"{'mode':12} {'api calls':>10} {'group calls':>12} {'seconds':>8}")
+    cycles = (
+        ("no cache", WeatherCache(index=None), per_user),
+        ("text cache", WeatherCache(index=None), by_text),
+    )
+    for mode, cache, get in cycles:
+        calls, group_calls, seconds = await run_cycle(fake, cache, names, get)
+        print(f"{mode:12} {calls:10d} {group_calls:12d} {seconds:8.2f}", flush=True)
+
+    cache = WeatherCache()
+    refresher = WeatherRefresher(storage, cache)
+
+    async def refreshed(cache: WeatherCache, names: list):
+        await refresher.run_once()
+        await by_text(cache, names)
+
+    calls, group_calls, seconds = await run_cycle(fake, cache, names, refreshed)
+    print(f"{'city ids':12} {calls:10d} {group_calls:12d} {seconds:8.2f}  (hits {cache.hits}, misses {cache.misses})")
+
+    await http_client.close()
+    await fake.stop()
+
+    print(f"\n{'resolve':16} {'p50 us':>9} {'p99 us':>9} {'hit %':>6}")
+    resolve_latency(city_index.resolve, {
+        "bundled exact": [rng.choice(spellings()) for _ in range(args.queries)],
+    })
+    resolve_latency(city_index.suggest, {
+        "bundled typo": [typo(rng.choice(list(FAKE_CITY_NAMES.values())), rng) for _ in range(args.queries)],
+    })
+
+    directory = tempfile.mkdtemp(prefix="city-index-bench-")
+    source = os.path.join(directory, "city.list.json")
+    synthetic = synthetic_list(source, args.cities, rng)
+    start = time.perf_counter()
+    build_index(source, os.path.join(directory, "index"))
+    build_seconds = time.perf_counter() - start
+    index = CityIndex(os.path.join(directory, "index"), source)
+    resolve_latency(index.resolve, {
+        f"{args.cities // 1000}k exact": [rng.choice(synthetic).lower() for _ in range(args.queries)],
+    })
+    resolve_latency(index.suggest, {
+        f"{args.cities // 1000}k typo": [typo(rng.choice(synthetic), rng) for _ in range(args.queries)],
+    })
+    print(f"\nindex of {args.cities} cities built in {build_seconds:.1f} s, "
+          f"{sum(os.path.getsize(os.path.join(directory, 'index', name)) for name in os.listdir(os.path.join(directory, 'index'))) / 2 ** 20:.1f} MB")
+    index.close()
+    print(f"interned city names: {len(cities)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа API, с")
+    parser.add_argument("--cities", type=int, default=200_000, help="городов в синтетическом списке")
+    parser.add_argument("--queries", type=int, default=2000, help="запросов распознавания каждого вида")
+    asyncio.run(main(parser.parse_args()))
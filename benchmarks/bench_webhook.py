@@ -0,0 +1,117 @@
+'''
+Пропускная способность (обновлений в секунду) в режимах long polling и webhook
+против локального заменителя Telegram Bot API. Перед замером проверяется, что
+webhook принимает и обрабатывает обновления без пользователя (опрос, буст
+канала, неизвестный тип).
+Запуск: python benchmarks/bench_webhook.py --updates 5000
+'''
+
+import argparse
+import asyncio
+import time
+
+import _common  # noqa: F401
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from fakes import FakeTelegram, make_message_update
+from handlers import router
+from webhook import WebhookServer
+
+SECRET = "benchmark-secret"
+
+
+async def bench_polling(dp: Dispatcher, fake: FakeTelegram, bot: Bot, updates: int, users: int) -> float:
+    fake.calls.clear()
+    for i in range(updates):
+        fake.push_update(make_message_update(i + 1, i % users + 1, "/start"))
+
+    start = time.perf_counter()
+    polling = asyncio.ensure_future(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await fake.wait_calls(updates)
+    elapsed = time.perf_counter() - start
+    await dp.stop_polling()
+    await polling
+    return updates / elapsed
+
+
+async def bench_webhook(dp: Dispatcher, fake: FakeTelegram, bot: Bot, updates: int, users: int, port: int,
+                        concurrency: int) -> float:
+    server = WebhookServer(dp, bot, "127.0.0.1", port, "/webhook", SECRET, queue_size=updates, workers=16)
+    await server.start()
+    fake.calls.clear()
+    url = f"http://127.0.0.1:{port}/webhook"
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as client:
+        async def post(i: int):
+            async with semaphore:
+                async with client.post(url, json=make_message_update(i + 1, i % users + 1, "/start")) as response:
+                    assert response.status == 200, response.status
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(updates)))
+        await fake.wait_calls(updates)
+        elapsed = time.perf_counter() - start
+
+    await server.stop()
+    return updates / elapsed
+
+
+# Обновления без отправителя: опрос, буст канала, тип, неизвестный aiogram, пустое обновление.
+UNTYPED_UPDATES = (
+    {"update_id": 1, "poll": {
+        "id": "1", "question": "?", "options": [], "total_voter_count": 0, "is_closed": False,
+        "is_anonymous": True, "type": "regular", "allows_multiple_answers": False
+    }},
+    {"update_id": 2, "chat_boost": {
+        "chat": {"id": -100, "type": "channel"},
+        "boost": {"boost_id": "1", "add_date": 0, "expiration_date": 0, "source": {"source": "gift_code",
+                  "user": {"id": 1, "is_bot": False, "first_name": "user"}}}
+    }},
+    {"update_id": 3, "future_update_type": {"id": 1}},
+    {"update_id": 4},
+)
+
+
+async def check_untyped(dp: Dispatcher, bot: Bot, port: int):
+    server = WebhookServer(dp, bot, "127.0.0.1", port, "/webhook", SECRET, queue_size=16, workers=2)
+    await server.start()
+    try:
+        async with aiohttp.ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as client:
+            for payload in UNTYPED_UPDATES:
+                async with client.post(f"http://127.0.0.1:{port}/webhook", json=payload) as response:
+                    assert response.status == 200, (payload, response.status)
+    finally:
+        await server.stop()
+    assert server.accepted == len(UNTYPED_UPDATES) and server._queued == 0, server.accepted
+
+
+async def main(args):
+    fake = FakeTelegram()
+    base_url = await fake.start("127.0.0.1", args.fake_port)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = Bot(token="42:BENCHMARK", session=session)
+    dp = Dispatcher()
+    dp.include_router(router)
+    try:
+        await check_untyped(dp, bot, args.webhook_port)
+        polling = await bench_polling(dp, fake, bot, args.updates, args.users)
+        webhook = await bench_webhook(dp, fake, bot, args.updates, args.users, args.webhook_port, args.concurrency)
+        print(f"polling  {polling:8.1f} updates/s")
+        print(f"webhook  {webhook:8.1f} updates/s")
+    finally:
+        await bot.session.close()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--fake-port", type=int, default=8091)
+    parser.add_argument("--webhook-port", type=int, default=8092)
+    asyncio.run(main(parser.parse_args()))
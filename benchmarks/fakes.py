@@ -0,0 +1,396 @@
+'''
+Локальные заменители внешних сервисов для бенчмарков.
+'''
+
+import asyncio
+import collections
+import itertools
+import json
+import math
+import random
+import time
+import zlib
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods.base import Response
+from aiohttp import web
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> dict:
+    '''
+    JSON обновления с текстовым сообщением пользователя в личном чате.
+    '''
+
+    update = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text
+        }
+    }
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0]
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return update
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> dict:
+    '''
+    JSON обновления с нажатием inline-кнопки.
+    '''
+
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "..."
+            }
+        }
+    }
+
+
+class FakeService:
+    '''
+    Основа локальных заменителей внешних API: настраиваемая задержка ответа
+    (latency секунд, разброс jitter в долях) и доля ответов с ошибкой 500.
+    '''
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, jitter: float = 0.5):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._runner = None
+
+    @web.middleware
+    async def track(self, request: web.Request, handler):
+        '''
+        Подсчет одновременно обрабатываемых запросов.
+        '''
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def should_fail(self) -> bool:
+        self.requests += 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    def app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def start(self, host: str, port: int) -> str:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class FakeTelegram(FakeService):
+    '''
+    Имитация Telegram Bot API: отдает обновления через getUpdates и
+    записывает исходящие вызовы (sendMessage, sendPhoto и другие).
+
+    Задержка и ошибки применяются только к исходящим вызовам бота, не к getUpdates.
+    При заданных chat_limit / global_limit отправки сверх этого числа за
+    последнюю секунду в чат / всего получают ответ 429 с retry_after, как
+    при превышении лимитов настоящего Bot API.
+    '''
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, chat_limit: int = 0, global_limit: int = 0):
+        super().__init__(latency, error_rate)
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.flood_errors = 0
+        self._sent_times = collections.deque()
+        self._chat_times = collections.defaultdict(collections.deque)
+        self.updates = []
+        self.calls = []
+        self.sent = asyncio.Event()
+        self.polling = asyncio.Event()
+        self._new_updates = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._replies = {}
+
+    def push_update(self, update: dict):
+        self.updates.append(update)
+        self._new_updates.set()
+
+    def replies(self, chat_id: int) -> asyncio.Queue:
+        '''
+        Очередь ответов бота в чат: (время получения, метод, текст).
+        '''
+
+        queue = self._replies.get(chat_id)
+        if queue is None:
+            queue = self._replies[chat_id] = asyncio.Queue()
+        return queue
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    async def get_updates(self, params: dict):
+        self.polling.set()
+        offset = int(params.get("offset", 0) or 0)
+        timeout = min(float(params.get("timeout", 0) or 0), 1.0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit", 100) or 100)
+        return self.updates[:limit]
+
+    def flood_wait(self, chat_id) -> int:
+        '''
+        Ожидание в секундах, если отправка превысит лимит, иначе 0 и отправка учитывается.
+        '''
+
+        now = time.perf_counter()
+        windows = [(self._sent_times, self.global_limit)]
+        if chat_id is not None:
+            windows.append((self._chat_times[str(chat_id)], self.chat_limit))
+        for times, limit in windows:
+            while times and now - times[0] >= 1:
+                times.popleft()
+        for times, limit in windows:
+            if limit and len(times) >= limit:
+                return max(1, math.ceil(times[0] + 1 - now))
+        for times, _ in windows:
+            times.append(now)
+        return 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+
+        if method == "getUpdates":
+            result = await self.get_updates(params)
+        else:
+            await self.delay()
+            if method != "getMe" and self.should_fail():
+                return web.json_response(
+                    {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+                )
+            retry_after = self.flood_wait(params.get("chat_id")) if method != "getMe" else 0
+            if retry_after:
+                self.flood_errors += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}
+                }, status=429)
+            result = fake_result(method, params, next(self._message_ids), len(self.calls))
+
+        if method not in ("getUpdates", "getMe"):
+            text = params.get("text") or params.get("caption")
+            self.calls.append((method, params.get("chat_id"), text))
+            self.sent.set()
+            chat_id = params.get("chat_id")
+            if chat_id is not None and int(chat_id) in self._replies:
+                self._replies[int(chat_id)].put_nowait((time.perf_counter(), method, text))
+        return web.json_response({"ok": True, "result": result}, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+    async def wait_calls(self, count: int, timeout: float = 60):
+        '''
+        Ожидание, пока бот совершит count исходящих вызовов.
+        '''
+
+        deadline = time.perf_counter() + timeout
+        while len(self.calls) < count:
+            self.sent.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError(f"Получено {len(self.calls)} вызовов из {count}.")
+            try:
+                await asyncio.wait_for(self.sent.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+# Часовые поясы городов заменителя OpenWeatherMap, смещение в секундах.
+FAKE_CITIES = {
+    "Москва": 3 * 3600, "Санкт-Петербург": 3 * 3600, "Новосибирск": 7 * 3600, "Екатеринбург": 5 * 3600,
+    "Казань": 3 * 3600, "Владивосток": 10 * 3600, "Калининград": 2 * 3600, "Лондон": 0,
+    "Берлин": 3600, "Нью-Йорк": -5 * 3600
+}
+# id OpenWeatherMap городов заменителя (как в bot/cities.tsv).
+FAKE_CITY_IDS = {
+    524901: "Москва", 498817: "Санкт-Петербург", 1496747: "Новосибирск", 1486209: "Екатеринбург",
+    551487: "Казань", 2013348: "Владивосток", 554234: "Калининград", 2643743: "Лондон",
+    2950159: "Берлин", 5128581: "Нью-Йорк"
+}
+# Английские названия городов: API, как и настоящий, принимает q в любом регистре и на английском.
+FAKE_CITY_NAMES = {name.casefold(): name for name in FAKE_CITIES}
+FAKE_CITY_NAMES.update({
+    "moscow": "Москва", "saint petersburg": "Санкт-Петербург", "novosibirsk": "Новосибирск",
+    "yekaterinburg": "Екатеринбург", "kazan": "Казань", "vladivostok": "Владивосток",
+    "kaliningrad": "Калининград", "london": "Лондон", "berlin": "Берлин", "new york": "Нью-Йорк"
+})
+
+
+class FakeOpenWeather(FakeService):
+    '''
+    Имитация OpenWeatherMap /data/2.5/weather (город по названию q или id) и
+    группового запроса /data/2.5/group (id через запятую): температура зависит
+    от города, для городов вне FAKE_CITIES возвращается 404.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.group_requests = 0
+
+    @staticmethod
+    def city(city: str, city_id: int = None) -> dict:
+        temperature = round(zlib.crc32(city.encode()) % 400 / 10 - 5, 1)
+        return {
+            "id": city_id, "name": city, "cod": 200, "timezone": FAKE_CITIES[city],
+            "main": {"temp": temperature, "humidity": 50}
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await self.delay()
+        if self.should_fail():
+            return web.json_response({"cod": 500, "message": "Internal error"}, status=500)
+        city_id = int(request.query["id"]) if request.query.get("id", "").isdigit() else None
+        if city_id is not None:
+            city = FAKE_CITY_IDS.get(city_id, "")
+        else:
+            city = FAKE_CITY_NAMES.get(" ".join(request.query.get("q", "").split()).casefold(), "")
+        if city not in FAKE_CITIES:
+            return web.json_response({"cod": "404", "message": "city not found"}, status=404)
+        return web.json_response(self.city(city, city_id))
+
+    async def handle_group(self, request: web.Request) -> web.Response:
+        await self.delay()
+        if self.should_fail():
+            return web.json_response({"cod": 500, "message": "Internal error"}, status=500)
+        self.group_requests += 1
+        found = []
+        for value in request.query.get("id", "").split(","):
+            city_id = int(value) if value.strip().isdigit() else None
+            if city_id in FAKE_CITY_IDS:
+                city = self.city(FAKE_CITY_IDS[city_id], city_id)
+                city["sys"] = {"timezone": city.pop("timezone")}
+                found.append(city)
+        return web.json_response({"cnt": len(found), "list": found})
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.track])
+        app.router.add_get("/data/2.5/weather", self.handle)
+        app.router.add_get("/data/2.5/group", self.handle_group)
+        return app
+
+
+# Продукты заменителя Open Food Facts, остальные запросы ничего не находят.
+FAKE_FOODS = {
+    "банан": 89, "яблоко": 52, "гречка": 343, "курица": 239, "творог": 121,
+    "хлеб": 265, "рис": 130, "овсянка": 352, "сыр": 356, "молоко": 52
+}
+
+
+class FakeOpenFoodFacts(FakeService):
+    '''
+    Имитация поиска Open Food Facts /cgi/search.pl по продуктам FAKE_FOODS.
+    '''
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await self.delay()
+        if self.should_fail():
+            return web.Response(status=500, text="Internal error")
+        term = request.query.get("search_terms", "").lower()
+        kcal = FAKE_FOODS.get(term)
+        products = [{"product_name": term, "nutriments": {"energy-kcal_100g": kcal}}] if kcal else []
+        return web.json_response({"count": len(products), "page": 1, "products": products})
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.track])
+        app.router.add_get("/cgi/search.pl", self.handle)
+        return app
+
+
+def fake_result(method_name: str, params: dict, message_id: int, call_number: int):
+    '''
+    Результат метода Bot API в формате JSON для заменителей Telegram.
+    '''
+
+    if method_name == "getMe":
+        return {"id": 42, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+    if method_name not in ("sendMessage", "sendPhoto"):
+        return True
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": int(params.get("chat_id") or 0), "type": "private"}
+    }
+    if method_name == "sendMessage":
+        message["text"] = params.get("text", "")
+    else:
+        photo = params.get("photo")
+        file_id = photo if isinstance(photo, str) and not photo.startswith("attach://") else f"file{call_number}"
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 500}]
+    return message
+
+
+class RecordingSession(BaseSession):
+    '''
+    Сессия aiogram без сети: записывает исходящие вызовы и возвращает правдоподобные ответы.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        photo = getattr(method, "photo", None)
+        params = {"chat_id": getattr(method, "chat_id", None), "text": getattr(method, "text", None),
+                  "photo": photo if isinstance(photo, str) else None}
+        self.calls.append((name, params["chat_id"], params["text"] or getattr(method, "caption", None)))
+        result = fake_result(name, params, next(self._message_ids), len(self.calls))
+        response = Response[method.__returning__].model_validate({"ok": True, "result": result},
+                                                                 context={"bot": bot})
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
@@ -0,0 +1,360 @@
+'''
+Сквозной нагрузочный тест: локальные заменители Telegram Bot API, OpenWeatherMap
+и Open Food Facts, неизмененный bot/bot.py в отдельном процессе и генератор
+пользовательских сессий.
+
+Каждый виртуальный пользователь проходит мастер /set_profile, затем до конца
+теста отправляет команды со случайными паузами. Задержка ответа считается от
+публикации обновления в getUpdates до первого ответа бота в чат. Отчет: p50/p99
+по командам, пропускная способность и память процесса бота во времени.
+
+Запуск:
+    python benchmarks/loadtest.py --users 2000 --ramp 30 --duration 120
+    python benchmarks/loadtest.py --owm-latency 0.3 --owm-error-rate 0.05 --output load.json
+    python benchmarks/loadtest.py --no-spawn   # бот запускается вручную с выведенными переменными
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from fakes import (
+    FAKE_CITIES, FAKE_FOODS, FakeOpenFoodFacts, FakeOpenWeather, FakeTelegram,
+    make_callback_update, make_message_update
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Доли команд в потоке пользователя после настройки профиля.
+ACTIONS = (
+    ("/log_water", 40), ("/log_food", 25), ("/log_workout", 15),
+    ("/check_progress", 12), ("/profile_info", 5), ("/new_day", 3)
+)
+# Ожидаемое число сообщений бота в чат на команду.
+EXPECTED_REPLIES = {"/check_progress": 3, "/new_day": 2}
+WORKOUTS = ("бег", "йога", "плавание", "силовая")
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_mb(pid: int):
+    '''
+    Резидентная память процесса и его потомков (воркеры шардов, пул отрисовки)
+    в МБ. Только Linux (/proc), иначе None.
+    '''
+
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        if total == 0:
+            return None
+    return total / 1024
+
+
+class LoadTest:
+    def __init__(self, args, telegram: FakeTelegram):
+        self.args = args
+        self.telegram = telegram
+        self.update_ids = iter(range(1, 2 ** 62))
+        self.deadline = None
+        self.active = 0
+        self.latencies = defaultdict(list)
+        self.interval_latencies = []
+        self.interval_updates = 0
+        self.updates = 0
+        self.timeouts = 0
+        self.timeline = []
+
+    async def send(self, user_id: int, command: str, text: str, callback: bool = False) -> list:
+        '''
+        Отправка обновления и ожидание ответов бота: список текстов ответов.
+        '''
+
+        replies = self.telegram.replies(user_id)
+        # Запоздавшие ответы на предыдущие шаги не относятся к этому обновлению.
+        while not replies.empty():
+            replies.get_nowait()
+
+        update_id = next(self.update_ids)
+        if callback:
+            update = make_callback_update(update_id, user_id, text)
+        else:
+            update = make_message_update(update_id, user_id, text)
+        sent_at = time.perf_counter()
+        self.telegram.push_update(update)
+        self.updates += 1
+        self.interval_updates += 1
+
+        texts = []
+        expected = EXPECTED_REPLIES.get(command, 1)
+        timeout = self.args.reply_timeout
+        while len(texts) < expected:
+            try:
+                received_at, _, reply_text = await asyncio.wait_for(replies.get(), timeout)
+            except asyncio.TimeoutError:
+                if not texts:
+                    self.timeouts += 1
+                break
+            if not texts:
+                latency = received_at - sent_at
+                self.latencies[command].append(latency)
+                self.interval_latencies.append(latency)
+                # Остальные сообщения того же ответа приходят сразу следом.
+                timeout = min(timeout, 5.0)
+            texts.append(reply_text or "")
+        return texts
+
+    async def think(self):
+        await asyncio.sleep(random.expovariate(1 / self.args.think) if self.args.think else 0)
+
+    async def set_profile(self, user_id: int, rng: random.Random):
+        steps = [
+            ("/set_profile", "/set_profile"),
+            ("weight", str(rng.randint(50, 110))),
+            ("height", str(rng.randint(150, 200))),
+            ("age", str(rng.randint(18, 70))),
+            ("gender", rng.choice("мж")),
+            ("activity", str(rng.choice((15, 20, 30, 45, 60, 90)))),
+        ]
+        for command, text in steps:
+            await self.send(user_id, command, text)
+            await self.think()
+        await self.send(user_id, "activity_type", "activity:" + rng.choice(("run", "yoga", "swimming", "strength")),
+                        callback=True)
+        await self.think()
+        # При ошибке погодного API бот просит повторить ввод города.
+        city = rng.choice(list(FAKE_CITIES))
+        for _ in range(3):
+            replies = await self.send(user_id, "city", city)
+            if not any("невалидный город" in reply for reply in replies):
+                break
+            await self.think()
+        await self.send(user_id, "calorie_goal", rng.choice(("-", "-", str(rng.randint(1500, 3000)))))
+
+    def action_text(self, command: str, rng: random.Random) -> str:
+        if command == "/log_water":
+            return f"/log_water {rng.choice((150, 200, 250, 330, 500))}"
+        if command == "/log_food":
+            return f"/log_food {rng.choice(list(FAKE_FOODS))}, {rng.randint(50, 300)}"
+        if command == "/log_workout":
+            return f"/log_workout {rng.choice(WORKOUTS)} {rng.randint(10, 90)}"
+        return command
+
+    async def user_session(self, user_id: int, start_delay: float):
+        await asyncio.sleep(start_delay)
+        rng = random.Random(user_id)
+        commands = [command for command, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        self.active += 1
+        try:
+            await self.set_profile(user_id, rng)
+            while time.perf_counter() < self.deadline:
+                await self.think()
+                command = rng.choices(commands, weights)[0]
+                await self.send(user_id, command, self.action_text(command, rng))
+        finally:
+            self.active -= 1
+
+    async def sample(self, bot_pid):
+        started = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.args.sample_interval)
+            interval, self.interval_latencies = self.interval_latencies, []
+            updates, self.interval_updates = self.interval_updates, 0
+            point = {
+                "t": round(time.perf_counter() - started, 1),
+                "active_users": self.active,
+                "updates_per_sec": updates / self.args.sample_interval,
+                "p50_ms": percentile(interval, 0.5) * 1000,
+                "p99_ms": percentile(interval, 0.99) * 1000,
+                "rss_mb": rss_mb(bot_pid) if bot_pid else None
+            }
+            self.timeline.append(point)
+            rss = f"{point['rss_mb']:8.1f}" if point["rss_mb"] is not None else "     n/a"
+            print(f"{point['t']:7.1f}s users={point['active_users']:6d} {point['updates_per_sec']:8.1f} upd/s "
+                  f"p50={point['p50_ms']:8.1f}ms p99={point['p99_ms']:8.1f}ms rss={rss}MB", flush=True)
+
+    async def run(self, bot_pid=None) -> float:
+        self.deadline = time.perf_counter() + self.args.ramp + self.args.duration
+        sampler = asyncio.ensure_future(self.sample(bot_pid))
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                self.user_session(self.args.first_user + i, self.args.ramp * i / self.args.users)
+                for i in range(self.args.users)
+            ))
+        finally:
+            sampler.cancel()
+            await asyncio.gather(sampler, return_exceptions=True)
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float, services: dict) -> dict:
+        everything = [value for values in self.latencies.values() for value in values]
+        result = {
+            "users": self.args.users,
+            "seconds": elapsed,
+            "updates": self.updates,
+            "replies": len(everything),
+            "timeouts": self.timeouts,
+            "throughput_updates_per_sec": self.updates / elapsed,
+            "p50_ms": percentile(everything, 0.5) * 1000,
+            "p99_ms": percentile(everything, 0.99) * 1000,
+            "commands": {
+                command: {
+                    "count": len(values),
+                    "p50_ms": percentile(values, 0.5) * 1000,
+                    "p99_ms": percentile(values, 0.99) * 1000
+                }
+                for command, values in sorted(self.latencies.items())
+            },
+            "services": {
+                name: {"requests": service.requests, "errors": service.errors}
+                for name, service in services.items()
+            },
+            "timeline": self.timeline
+        }
+        print(f"\nupdates={result['updates']} replies={result['replies']} timeouts={result['timeouts']} "
+              f"throughput={result['throughput_updates_per_sec']:.1f} upd/s "
+              f"p50={result['p50_ms']:.1f}ms p99={result['p99_ms']:.1f}ms")
+        print(f"{'command':16} {'count':>8} {'p50 ms':>10} {'p99 ms':>10}")
+        for command, stats in result["commands"].items():
+            print(f"{command:16} {stats['count']:8d} {stats['p50_ms']:10.1f} {stats['p99_ms']:10.1f}")
+        for name, stats in result["services"].items():
+            print(f"{name:16} requests={stats['requests']} errors={stats['errors']}")
+        rss = [point["rss_mb"] for point in self.timeline if point["rss_mb"] is not None]
+        if rss:
+            print(f"bot rss: start={rss[0]:.1f}MB peak={max(rss):.1f}MB end={rss[-1]:.1f}MB")
+        return result
+
+
+def bot_environment(args, urls: dict) -> dict:
+    data_dir = tempfile.mkdtemp(prefix="bot-load-")
+    return {
+        "BOT_TG_TOKEN": "42:LOADTEST",
+        "OW_API_KEY": "loadtest",
+        "TELEGRAM_API_URL": urls["telegram"],
+        "OPEN_WEATHER_URL": urls["weather"] + "/data/2.5/weather",
+        "OPEN_FOOD_FACT_URL": urls["food"] + "/cgi/search.pl",
+        "USER_STORAGE_PATH": os.path.join(data_dir, "users.sqlite3"),
+        "FOOD_CACHE_PATH": os.path.join(data_dir, "food_cache.sqlite3"),
+        "EVENT_LOG_DIR": os.path.join(data_dir, "events"),
+        "METRICS_PORT": str(args.metrics_port),
+    }
+
+
+async def start_services(args) -> tuple:
+    '''
+    Запуск заменителей внешних API: (словарь сервисов, их адреса).
+    '''
+
+    services = {
+        "telegram": FakeTelegram(args.tg_latency, args.tg_error_rate),
+        "weather": FakeOpenWeather(args.owm_latency, args.owm_error_rate),
+        "food": FakeOpenFoodFacts(args.off_latency, args.off_error_rate),
+    }
+    urls = {}
+    for offset, (name, service) in enumerate(services.items()):
+        urls[name] = await service.start(args.host, args.port + offset)
+    return services, urls
+
+
+def spawn_bot(environment: dict, log_file) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bot", "bot.py")], cwd=ROOT,
+        env={**os.environ, **environment}, stdout=log_file, stderr=subprocess.STDOUT
+    )
+
+
+def stop_bot(process: subprocess.Popen):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def main(args):
+    services, urls = await start_services(args)
+    environment = bot_environment(args, urls)
+    telegram = services["telegram"]
+    process = None
+    log_file = None
+    try:
+        if args.no_spawn:
+            print("Запустите бота с переменными окружения:")
+            for key, value in environment.items():
+                print(f"  {key}={value}")
+        else:
+            log_file = open(args.bot_log, "w")
+            process = spawn_bot(environment, log_file)
+            print(f"Бот запущен (pid {process.pid}), лог: {args.bot_log}")
+        await asyncio.wait_for(telegram.polling.wait(), args.start_timeout)
+
+        test = LoadTest(args, telegram)
+        elapsed = await test.run(process.pid if process else args.bot_pid)
+        result = test.report(elapsed, services)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    finally:
+        if process is not None:
+            stop_bot(process)
+        if log_file is not None:
+            log_file.close()
+        for service in services.values():
+            await service.stop()
+
+
+def build_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--first-user", type=int, default=100000)
+    parser.add_argument("--ramp", type=float, default=10, help="секунды на подключение всех пользователей")
+    parser.add_argument("--duration", type=float, default=60, help="секунды нагрузки после разгона")
+    parser.add_argument("--think", type=float, default=2.0, help="средняя пауза пользователя между сообщениями")
+    parser.add_argument("--reply-timeout", type=float, default=30)
+    parser.add_argument("--sample-interval", type=float, default=5)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081, help="Telegram; погода и продукты на следующих портах")
+    parser.add_argument("--tg-latency", type=float, default=0.03)
+    parser.add_argument("--tg-error-rate", type=float, default=0.0)
+    parser.add_argument("--owm-latency", type=float, default=0.15)
+    parser.add_argument("--owm-error-rate", type=float, default=0.0)
+    parser.add_argument("--off-latency", type=float, default=0.3)
+    parser.add_argument("--off-error-rate", type=float, default=0.0)
+    parser.add_argument("--metrics-port", type=int, default=0)
+    parser.add_argument("--no-spawn", action="store_true", help="не запускать бота, только заменители и нагрузку")
+    parser.add_argument("--bot-pid", type=int, help="pid вручную запущенного бота для замера памяти")
+    parser.add_argument("--bot-log", default=os.path.join(tempfile.gettempdir(), "bot-loadtest.log"))
+    parser.add_argument("--start-timeout", type=float, default=60)
+    parser.add_argument("--output", help="файл JSON с результатами и временным рядом")
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(main(build_parser(__doc__).parse_args()))
@@ -1,23 +1,150 @@
 import asyncio
+import signal
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, BOT_MODE, TELEGRAM_API_URL, ROLLOVER_ENABLED, WEATHER_REFRESH_ENABLED, OUTBOX_ENABLED, METRICS_PORT, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, SHARDS, logger
+)
 from handlers import router
+from http_client import http_client
+from weather_cache import weather_cache, WeatherRefresher
+from city_index import city_index
+from food_cache import food_cache
+from render import render_service
+from chart_cache import chart_cache
+from storage import users
+from events import event_log
+from webhook import WebhookServer
+from rollover import RolloverScheduler
+from metrics import MetricsServer
+from outbox import outbox
+from fsm_storage import create_fsm_storage
+from shards import ShardSupervisor
+from reshard import check_layout
 
 
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+if TELEGRAM_API_URL:
+    # Собственный сервер Bot API или локальный заменитель для нагрузочных тестов.
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+# Исходящие сообщения воркера или бота в одном процессе проходят через очередь с лимитами Telegram.
+if OUTBOX_ENABLED and (SHARDS == 1 or BOT_MODE == "worker"):
+    bot.session.middleware(outbox)
+# Состояния FSM в памяти процесса либо в Redis, общем для реплик (FSM_STORAGE).
+dp = Dispatcher(storage=create_fsm_storage())
 dp.include_router(router)
+# Автоматическая смена дня в локальную полночь пользователей.
+rollover = RolloverScheduler(users, weather_cache)
+# Фоновое обновление погоды городов пользователей групповыми запросами.
+weather_refresher = WeatherRefresher(users, weather_cache)
+metrics_server = MetricsServer()
+
+
+async def wait_for_signal():
+    '''
+    Ожидание SIGINT / SIGTERM.
+    '''
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def run_webhook():
+    '''
+    Работа в режиме webhook (или воркера шарда) до получения SIGINT / SIGTERM.
+    '''
+
+    server = WebhookServer(
+        dp, bot, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+        WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+    )
+    await server.start(WEBHOOK_BASE_URL + WEBHOOK_PATH if WEBHOOK_BASE_URL else None)
+    try:
+        await wait_for_signal()
+    finally:
+        print("Webhook-сервер останавливается...")
+        await server.stop()
+
+
+async def run_supervisor():
+    '''
+    Супервизор SHARDS процессов-воркеров: сам только получает обновления и
+    распределяет их по шардам.
+    '''
+
+    supervisor = ShardSupervisor(bot, SHARDS, dp.resolve_used_update_types())
+    webhook = None
+    if BOT_MODE == "webhook":
+        webhook = {
+            "host": WEBAPP_HOST, "port": WEBAPP_PORT, "path": WEBHOOK_PATH, "secret": WEBHOOK_SECRET,
+            "url": WEBHOOK_BASE_URL + WEBHOOK_PATH if WEBHOOK_BASE_URL else None
+        }
+    try:
+        if METRICS_PORT:
+            await metrics_server.start()
+        await supervisor.start(webhook)
+        await wait_for_signal()
+    finally:
+        print("Супервизор останавливается...")
+        await supervisor.stop()
+        await metrics_server.stop()
+        await bot.session.close()
 
 
 async def main():
+    if BOT_MODE != "worker":
+        # Данные на диске должны быть разложены по текущему числу шардов.
+        check_layout(SHARDS)
+    if SHARDS > 1 and BOT_MODE != "worker":
+        await run_supervisor()
+        return
     try:
         print("Бот стартует...")
-        await dp.start_polling(bot)
+        await users.start()
+        await event_log.start()
+        await event_log.compact()
+        # Общий HTTP-клиент внешних API, через него идут все запросы (см. http_client.HttpClient).
+        await http_client.start()
+        await food_cache.start()
+        city_index.open()
+        render_service.start()
+        if METRICS_PORT:
+            await metrics_server.start()
+        if ROLLOVER_ENABLED:
+            rollover.start(bot)
+        if WEATHER_REFRESH_ENABLED:
+            weather_refresher.start()
+        if BOT_MODE in ("webhook", "worker"):
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
     finally:
         print("Сессия закрывается...")
+        await rollover.stop()
+        await weather_refresher.stop()
+        await metrics_server.stop()
+        logger.info("Статистика кэша погоды: %s", weather_cache.stats())
+        logger.info("Статистика кэша продуктов: %s", food_cache.stats())
+        logger.info("Статистика кэша графиков: %s", chart_cache.stats())
+        logger.info("Статистика исходящих сообщений: %s", outbox.stats())
+        logger.info("Статистика хранилища пользователей: %s", users.stats())
+        await outbox.close()
+        await render_service.close()
+        await food_cache.close()
+        await http_client.close()
+        await users.close()
+        event_log.close()
+        city_index.close()
+        await dp.storage.close()
         await bot.session.close()
 
 
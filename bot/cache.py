@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Ограниченный по размеру словарь с вытеснением давно не используемых ключей.
+    '''
+
+    def __init__(self, maxsize: int, on_evict=None):
+        if maxsize <= 0:
+            raise ValueError("Размер кэша должен быть положительным числом.")
+        self.maxsize = maxsize
+        # Вызывается с ключом и значением каждого вытесненного элемента.
+        self.on_evict = on_evict
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        '''
+        Получение значения с отметкой о недавнем использовании.
+        '''
+
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key, value):
+        '''
+        Запись значения с вытеснением самого старого ключа при переполнении.
+        '''
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self.popitem()
+
+    def popitem(self) -> tuple:
+        '''
+        Вытеснение самого старого ключа, возвращает пару (ключ, значение).
+        '''
+
+        key, value = self._data.popitem(last=False)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return key, value
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,140 @@
+import asyncio
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+from cache import LRUCache
+from config import logger, CHART_CACHE_SIZE, CHART_CACHE_BYTES, CHART_CACHE_PRECISION
+from render import render_service
+
+
+class ChartEntry:
+    '''
+    Построенный график и file_id, присвоенный Telegram после первой отправки.
+    PNG хранится только до получения file_id.
+    '''
+
+    __slots__ = ("key", "plot_func", "png", "file_id")
+
+    def __init__(self, key: tuple, plot_func, png: bytes):
+        self.key = key
+        self.plot_func = plot_func
+        self.png = png
+        self.file_id = None
+
+
+class ChartCache:
+    '''
+    Кэш графиков по типу графика и округленным входным значениям.
+
+    Повторная отправка одинакового графика ссылается на file_id и не требует
+    ни рендеринга, ни загрузки PNG в Telegram. После получения file_id PNG
+    освобождается, а PNG еще не отправленных графиков занимают не больше
+    max_bytes: при превышении вытесняются давно не используемые графики.
+    '''
+
+    def __init__(self, maxsize: int = CHART_CACHE_SIZE, max_bytes: int = CHART_CACHE_BYTES,
+                 precision: int = CHART_CACHE_PRECISION):
+        self.precision = precision
+        self.max_bytes = max_bytes
+        self._entries = LRUCache(maxsize, on_evict=self._evicted)
+        # Суммарный размер PNG в кэше.
+        self.png_bytes = 0
+        # Графики, которые сейчас строятся: ключ -> задача рендеринга.
+        self._inflight = {}
+        self.file_id_hits = 0
+        self.png_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def make_key(self, plot_func, values) -> tuple:
+        return (plot_func.__name__,) + tuple(round(float(value), self.precision) for value in values)
+
+    async def prepare(self, plot_func, values) -> ChartEntry:
+        '''
+        График plot_func(*values) из кэша либо построенный. Одновременные
+        запросы одного графика ждут общего рендеринга.
+        '''
+
+        key = self.make_key(plot_func, values)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.file_id is None:
+                self.png_hits += 1
+            return entry
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._render(key, plot_func))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий рендеринг.
+        return await asyncio.shield(task)
+
+    async def _render(self, key: tuple, plot_func) -> ChartEntry:
+        entry = ChartEntry(key, plot_func, await render_service.render(plot_func, *key[1:]))
+        self._entries.set(key, entry)
+        self.png_bytes += len(entry.png)
+        while self.png_bytes > self.max_bytes and self._entries:
+            self._entries.popitem()
+        return entry
+
+    def _evicted(self, key: tuple, entry: ChartEntry):
+        # График, ожидающий отправки, держит PNG сам до отправки, кэш его больше не учитывает.
+        if entry.png is not None:
+            self.png_bytes -= len(entry.png)
+
+    async def send(self, message: types.Message, entry: ChartEntry, filename: str, caption: str):
+        '''
+        Отправка подготовленного графика в ответ на сообщение.
+        '''
+
+        if entry.file_id is not None:
+            try:
+                sent = await message.answer_photo(photo=entry.file_id, caption=caption)
+                self.file_id_hits += 1
+                return sent
+            except TelegramBadRequest as e:
+                # file_id стал недействительным - строим и загружаем PNG заново.
+                logger.warning("Кэш графиков: file_id отклонен Telegram: %s", e)
+                if self._entries.get(entry.key) is entry:
+                    self._entries.pop(entry.key)
+                return await self.send(message, await self.prepare(entry.plot_func, entry.key[1:]), filename, caption)
+
+        sent = await message.answer_photo(photo=BufferedInputFile(entry.png, filename=filename), caption=caption)
+        if sent.photo and entry.png is not None:
+            # Наибольший размер фото соответствует исходному изображению.
+            entry.file_id = sent.photo[-1].file_id
+            # Дальше график отправляется по file_id, PNG больше не нужен.
+            if self._entries.get(entry.key) is entry:
+                self.png_bytes -= len(entry.png)
+            entry.png = None
+        return sent
+
+    async def answer_photo(self, message: types.Message, plot_func, values, filename: str, caption: str):
+        '''
+        Отправка графика plot_func(*values) в ответ на сообщение.
+        '''
+
+        return await self.send(message, await self.prepare(plot_func, values), filename, caption)
+
+    def stats(self) -> dict:
+        requests = self.file_id_hits + self.png_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "png_bytes": self.png_bytes,
+            "file_id_hits": self.file_id_hits,
+            "png_hits": self.png_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self._entries.evictions,
+            "hit_ratio": round((self.file_id_hits + self.png_hits) / requests, 4) if requests else 0.0
+        }
+
+
+# Общий кэш графиков для /check_progress и /trends.
+chart_cache = ChartCache()
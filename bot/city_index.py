@@ -0,0 +1,328 @@
+'''
+Индекс городов: приведение введенного пользователем названия к городу
+OpenWeatherMap (id и название для профиля) с учетом других написаний и опечаток.
+
+Источник - список городов в TSV (cities.tsv рядом с модулем) либо city.list.json(.gz)
+OpenWeatherMap. Индекс собирается в каталог CITY_INDEX_PATH при первом запуске
+или изменении cities.tsv и отображается в память; полный список OpenWeatherMap
+собирается заранее: python bot/city_index.py city.list.json.gz --output data/city_index
+'''
+
+import argparse
+import bisect
+import gzip
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from collections import defaultdict, namedtuple
+from typing import Optional
+
+import numpy as np
+
+from config import logger, CITY_INDEX_PATH, CITY_LIST_PATH, CITY_MIN_SIMILARITY
+from food_db import trigrams
+
+# Версия формата файлов индекса.
+FORMAT_VERSION = 1
+
+# Город по возрастанию id: название для профиля в names.bin и код страны.
+CITY = np.dtype([("id", "<u4"), ("name_off", "<u4"), ("name_len", "<u2"), ("country", "S2")])
+# Написание города по возрастанию ключа city_key: ключ в names.bin и номер города в cities.bin.
+ENTRY = np.dtype([("key_off", "<u4"), ("key_len", "<u2"), ("city", "<u4")])
+# Триграмма ключа и список написаний с ней в gram_postings.bin.
+GRAM = np.dtype([("gram", "<U3"), ("post_off", "<u4"), ("count", "<u4")])
+
+# Число написаний с наибольшим числом общих триграмм, для которых считается точное сходство.
+FUZZY_CANDIDATES = 20
+
+CityMatch = namedtuple("CityMatch", ["id", "name", "country", "score"])
+
+_SEPARATORS_RE = re.compile(r"[\s\-.,'’_]+")
+
+
+def city_key(name: str) -> str:
+    '''
+    Ключ написания города: регистр, буква ё, дефисы и точки как пробелы.
+    '''
+
+    return _SEPARATORS_RE.sub(" ", name.casefold().replace("ё", "е")).strip()
+
+
+def key_similarity(first: str, second: str) -> float:
+    '''
+    Коэффициент Дайса по триграммам ключей целиком.
+    '''
+
+    first, second = trigrams(first), trigrams(second)
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+def read_cities(path: str):
+    '''
+    Города источника: (id, страна, название, [другие написания]).
+    '''
+
+    opener = gzip.open if path.endswith(".gz") else open
+    if ".json" in os.path.basename(path):
+        with opener(path, "rt", encoding="utf-8") as file:
+            for city in json.load(file):
+                yield int(city["id"]), city.get("country") or "", city["name"], []
+        return
+    with opener(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            aliases = [alias.strip() for alias in fields[3].split(",")] if len(fields) > 3 else []
+            yield int(fields[0]), fields[1], fields[2], [alias for alias in aliases if alias]
+
+
+def build_index(source: str = CITY_LIST_PATH, output: str = CITY_INDEX_PATH) -> dict:
+    '''
+    Сборка индекса из источника во временном каталоге и подмена старого индекса.
+    '''
+
+    cities = {}
+    for city_id, country, name, aliases in read_cities(source):
+        # Повтор id в источнике дополняет написания первого вхождения.
+        known = cities.setdefault(city_id, (country, name, []))
+        known[2].extend([name] + aliases)
+
+    names = bytearray()
+
+    def put(text: str) -> tuple:
+        encoded = text.encode("utf-8")
+        offset = len(names)
+        names.extend(encoded)
+        return offset, len(encoded)
+
+    ordered = sorted(cities.items())
+    table = np.zeros(len(ordered), dtype=CITY)
+    spellings = set()
+    for row, (city_id, (country, name, aliases)) in enumerate(ordered):
+        offset, length = put(name)
+        table[row] = (city_id, offset, length, country.encode("ascii", errors="ignore")[:2])
+        spellings.update((city_key(alias), row) for alias in aliases if city_key(alias))
+
+    # При одинаковом написании у нескольких городов первым идет город с меньшим id.
+    entries = np.zeros(len(spellings), dtype=ENTRY)
+    postings = defaultdict(list)
+    for index, (key, row) in enumerate(sorted(spellings)):
+        offset, length = put(key)
+        entries[index] = (offset, length, row)
+        for gram in trigrams(key):
+            postings[gram].append(index)
+
+    grams = np.zeros(len(postings), dtype=GRAM)
+    gram_postings = []
+    for index, gram in enumerate(sorted(postings)):
+        grams[index] = (gram, len(gram_postings), len(postings[gram]))
+        gram_postings.extend(postings[gram])
+
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    build = tempfile.mkdtemp(prefix=".city_index-", dir=parent)
+    os.chmod(build, 0o755)
+    meta = {
+        "version": FORMAT_VERSION, "source": os.path.abspath(source), "source_mtime": os.path.getmtime(source),
+        "cities": len(table), "spellings": len(entries)
+    }
+    try:
+        table.tofile(os.path.join(build, "cities.bin"))
+        entries.tofile(os.path.join(build, "entries.bin"))
+        grams.tofile(os.path.join(build, "grams.bin"))
+        np.array(gram_postings, dtype="<u4").tofile(os.path.join(build, "gram_postings.bin"))
+        with open(os.path.join(build, "names.bin"), "wb") as file:
+            file.write(names)
+        with open(os.path.join(build, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        previous = None
+        if os.path.exists(output):
+            previous = tempfile.mkdtemp(prefix=".city_index-old-", dir=parent)
+            os.rename(output, os.path.join(previous, "index"))
+        os.rename(build, output)
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+    except OSError:
+        shutil.rmtree(build, ignore_errors=True)
+        # Другой процесс бота мог собрать индекс одновременно: используется его результат.
+        if not os.path.exists(os.path.join(output, "meta.json")):
+            raise
+    return meta
+
+
+def _map(path: str):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Keys:
+    '''
+    Последовательность ключей написаний для bisect без загрузки в память.
+    '''
+
+    def __init__(self, entries: np.ndarray, names: bytes):
+        self.entries = entries
+        self.names = names
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, index: int) -> str:
+        entry = self.entries[index]
+        offset = int(entry["key_off"])
+        return self.names[offset:offset + int(entry["key_len"])].decode("utf-8")
+
+
+class CityIndex:
+    '''
+    Индекс городов, отображенный в память.
+
+    Точное написание (после city_key) находится двоичным поиском по
+    отсортированным ключам. Результат - CityMatch с id города OpenWeatherMap и
+    единым названием, которое сохраняется в профиле, поэтому "москва",
+    "Moscow" и "Москва " дают один город и один ключ кэша погоды.
+
+    Ближайшее по триграммам написание (сходство не ниже min_similarity) только
+    предлагается пользователю (suggest) и не подставляется молча: похожее
+    название может оказаться другим настоящим городом, которого нет в индексе
+    (Пинск и Минск, Кировск и Киров).
+    '''
+
+    def __init__(self, path: str = CITY_INDEX_PATH, source: str = CITY_LIST_PATH,
+                 min_similarity: float = CITY_MIN_SIMILARITY):
+        self.path = path
+        self.source = source
+        self.min_similarity = min_similarity
+        self._opened = False
+        self._maps = []
+        self.cities = None
+
+    def _stale(self) -> bool:
+        try:
+            with open(os.path.join(self.path, "meta.json"), encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return True
+        if meta.get("version") != FORMAT_VERSION:
+            return True
+        # Индекс, собранный из другого источника (полного списка OpenWeatherMap), не пересобирается.
+        if meta.get("source") != os.path.abspath(self.source):
+            return False
+        return os.path.exists(self.source) and meta.get("source_mtime") != os.path.getmtime(self.source)
+
+    def open(self) -> bool:
+        '''
+        Открытие индекса со сборкой из источника при необходимости; без
+        индекса города не распознаются и используются как введены.
+        '''
+
+        if self._opened:
+            return self.cities is not None
+        self._opened = True
+        try:
+            if self._stale():
+                meta = build_index(self.source, self.path)
+                logger.info("Индекс городов собран: %s городов, %s написаний.", meta['cities'], meta['spellings'])
+            files = {
+                name: _map(os.path.join(self.path, f"{name}.bin"))
+                for name in ("cities", "entries", "grams", "gram_postings", "names")
+            }
+        except (OSError, ValueError) as e:
+            logger.error("Индекс городов %s недоступен: %s", self.path, e)
+            return False
+
+        self._maps = [value for value in files.values() if isinstance(value, mmap.mmap)]
+        self.cities = np.frombuffer(files["cities"], dtype=CITY)
+        self.entries = np.frombuffer(files["entries"], dtype=ENTRY)
+        self.grams = np.frombuffer(files["grams"], dtype=GRAM)
+        self.gram_postings = np.frombuffer(files["gram_postings"], dtype="<u4")
+        self.names = files["names"]
+        self.keys = _Keys(self.entries, self.names)
+        return True
+
+    def close(self):
+        self.cities = self.entries = self.grams = self.gram_postings = self.names = self.keys = None
+        for file in self._maps:
+            file.close()
+        self._maps = []
+        self._opened = False
+
+    def _match(self, row: int, score: float) -> CityMatch:
+        city = self.cities[row]
+        offset = int(city["name_off"])
+        name = self.names[offset:offset + int(city["name_len"])].decode("utf-8")
+        return CityMatch(int(city["id"]), name, city["country"].decode("ascii"), score)
+
+    def _closest(self, key: str):
+        lists = []
+        for gram in trigrams(key):
+            index = np.searchsorted(self.grams["gram"], gram)
+            if index < len(self.grams) and self.grams[index]["gram"] == gram:
+                offset = int(self.grams[index]["post_off"])
+                lists.append(self.gram_postings[offset:offset + int(self.grams[index]["count"])])
+        if not lists:
+            return None, 0.0
+        candidates, shared = np.unique(np.concatenate(lists), return_counts=True)
+        best = candidates[np.argsort(-shared, kind="stable")[:FUZZY_CANDIDATES]]
+        similarity, index = max((key_similarity(key, self.keys[int(index)]), -int(index)) for index in best)
+        return -index, similarity
+
+    def resolve(self, text: str) -> Optional[CityMatch]:
+        '''
+        Город по названию или другому написанию из индекса либо None.
+        '''
+
+        if not self.open():
+            return None
+        key = city_key(text)
+        if not key:
+            return None
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self._match(int(self.entries[index]["city"]), 1.0)
+        return None
+
+    def suggest(self, text: str) -> Optional[CityMatch]:
+        '''
+        Похожий город для подсказки при опечатке либо None.
+        '''
+
+        if not self.open():
+            return None
+        key = city_key(text)
+        if not key:
+            return None
+        index, similarity = self._closest(key)
+        if index is None or similarity < self.min_similarity:
+            return None
+        return self._match(int(self.entries[index]["city"]), round(similarity, 4))
+
+    def city(self, city_id: int) -> Optional[CityMatch]:
+        '''
+        Город по id OpenWeatherMap.
+        '''
+
+        if not self.open():
+            return None
+        row = int(np.searchsorted(self.cities["id"], city_id))
+        if row < len(self.cities) and int(self.cities[row]["id"]) == city_id:
+            return self._match(row, 1.0)
+        return None
+
+
+# Общий индекс городов, открывается при первом обращении.
+city_index = CityIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="cities.tsv или city.list.json(.gz) OpenWeatherMap")
+    parser.add_argument("--output", default=CITY_INDEX_PATH, help="каталог индекса")
+    args = parser.parse_args()
+    logger.info("Индекс городов собран: %s", build_index(args.source, args.output))
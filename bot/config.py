@@ -1,23 +1,211 @@
+import atexit
 import os
+import secrets
 from dotenv import load_dotenv
 import logging
 
+from logs import setup_logging
 
-# Настройка логирования.
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-# Настройка логов aiogram.
-logging.getLogger("aiogram.event").setLevel(logging.WARNING)
-# Пользовательский логгер.
-logger = logging.getLogger("bot_logger")
-logger.setLevel(logging.INFO)
 
 # Загрузка переменных из .env файла
 load_dotenv()
 
+# Логирование: уровень, формат (json - запись одной строкой JSON, text - прежний текстовый), размер
+# очереди записей и доля записей INFO обработчиков команд, которые попадают в лог.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1))
+
+# Настройка логирования: вывод в фоновом потоке, event loop не ждет записи в stdout.
+log_pipeline = setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE)
+atexit.register(log_pipeline.stop)
+# Настройка логов aiogram.
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+# Пользовательский логгер, у воркеров шардирования - с номером шарда в имени.
+logger = logging.getLogger(
+    f"bot_logger.shard{os.getenv('SHARD_ID', 0)}" if os.getenv("BOT_MODE") == "worker" else "bot_logger"
+)
+logger.setLevel(LOG_LEVEL)
+
 BOT_TOKEN = os.getenv("BOT_TG_TOKEN")
 OPEN_WEATHER_KEY = os.getenv("OW_API_KEY")
-OPEN_WEATHER_URL = 'http://api.openweathermap.org/data/2.5/weather'
-OPEN_FOOD_FACT_URL = 'https://world.openfoodfacts.org/cgi/search.pl'
+# Адреса внешних API можно переопределить, например для нагрузочного тестирования с локальными заменителями.
+OPEN_WEATHER_URL = os.getenv("OPEN_WEATHER_URL", 'http://api.openweathermap.org/data/2.5/weather')
+OPEN_FOOD_FACT_URL = os.getenv("OPEN_FOOD_FACT_URL", 'https://world.openfoodfacts.org/cgi/search.pl')
+# Базовый адрес Telegram Bot API (пусто - официальный сервер api.telegram.org).
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Параметры общего HTTP-клиента внешних API.
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", 15))
+
+# Защита внешних API: таймаут попытки и всего вызова (с), число повторов, базовая и максимальная пауза
+# между повторами (с), число одновременных запросов и ожидание свободного слота (с).
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 3))
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", 8))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 2))
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", 0.2))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 2))
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", 10))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", 2))
+# Автоматический выключатель: число отказов подряд до размыкания и время до пробного запроса (с).
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", 30))
+
+# Групповой запрос погоды OpenWeatherMap по id городов и число городов в одном запросе (не больше 20).
+OPEN_WEATHER_GROUP_URL = os.getenv("OPEN_WEATHER_GROUP_URL", OPEN_WEATHER_URL.rsplit("/", 1)[0] + "/group")
+WEATHER_GROUP_SIZE = int(os.getenv("WEATHER_GROUP_SIZE", 20))
+# Фоновое обновление погоды городов пользователей групповыми запросами: включение и период (с).
+WEATHER_REFRESH_ENABLED = os.getenv("WEATHER_REFRESH_ENABLED", "1") == "1"
+WEATHER_REFRESH_INTERVAL = float(os.getenv("WEATHER_REFRESH_INTERVAL", 300))
+
+# Индекс городов: список городов из репозитория, каталог индекса и минимальное сходство при опечатке.
+CITY_LIST_PATH = os.getenv("CITY_LIST_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.tsv"))
+CITY_INDEX_PATH = os.getenv("CITY_INDEX_PATH", "data/city_index")
+CITY_MIN_SIMILARITY = float(os.getenv("CITY_MIN_SIMILARITY", 0.6))
+# Предел числа названий городов в реестре интернирования процесса.
+CITY_REGISTRY_SIZE = int(os.getenv("CITY_REGISTRY_SIZE", 10000))
+
+# Кэш погоды: время жизни значения, размер и срок выдачи устаревших значений при ошибках API.
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", 600))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", 1024))
+WEATHER_CACHE_STALE_TTL = float(os.getenv("WEATHER_CACHE_STALE_TTL", 3 * 3600))
+
+# Кэш калорийности продуктов: файл на диске, размер в памяти, сроки жизни найденных и ненайденных продуктов.
+FOOD_CACHE_PATH = os.getenv("FOOD_CACHE_PATH", "data/food_cache.sqlite3")
+FOOD_CACHE_SIZE = int(os.getenv("FOOD_CACHE_SIZE", 4096))
+FOOD_CACHE_TTL = float(os.getenv("FOOD_CACHE_TTL", 30 * 24 * 3600))
+FOOD_CACHE_NEGATIVE_TTL = float(os.getenv("FOOD_CACHE_NEGATIVE_TTL", 3600))
+# Офлайн-база продуктов из выгрузки Open Food Facts (food_import.py) и минимальное сходство названия для ответа из нее.
+FOOD_DB_PATH = os.getenv("FOOD_DB_PATH", "data/food_db")
+FOOD_DB_MIN_SCORE = float(os.getenv("FOOD_DB_MIN_SCORE", 0.75))
+# /log_food с несколькими продуктами: максимум продуктов в сообщении и одновременных запросов калорийности.
+FOOD_LOG_MAX_ITEMS = int(os.getenv("FOOD_LOG_MAX_ITEMS", 10))
+FOOD_LOOKUP_CONCURRENCY = int(os.getenv("FOOD_LOOKUP_CONCURRENCY", 4))
+
+# Рендеринг графиков: число процессов, размер очереди и время ожидания места в ней.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", max(1, min(4, (os.cpu_count() or 1) - 1))))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", 32))
+RENDER_QUEUE_TIMEOUT = float(os.getenv("RENDER_QUEUE_TIMEOUT", 10))
+
+# Кэш графиков: число графиков, объем PNG еще не отправленных графиков (байт)
+# и точность округления входных значений (знаков после запятой).
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", 2048))
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", 16 * 1024 * 1024))
+CHART_CACHE_PRECISION = int(os.getenv("CHART_CACHE_PRECISION", 0))
+
+# Хранилище пользователей: memory или sqlite, путь к базе и параметры пакетной записи.
+USER_STORAGE = os.getenv("USER_STORAGE", "sqlite")
+USER_STORAGE_PATH = os.getenv("USER_STORAGE_PATH", "data/users.sqlite3")
+USER_STORAGE_FLUSH_INTERVAL = float(os.getenv("USER_STORAGE_FLUSH_INTERVAL", 1.0))
+USER_STORAGE_FLUSH_BATCH = int(os.getenv("USER_STORAGE_FLUSH_BATCH", 1000))
+# Профили в памяти (sqlite): не больше USER_STORAGE_HOT_SIZE, вытесняются после USER_STORAGE_IDLE_TTL секунд без обращений (0 - без срока).
+USER_STORAGE_HOT_SIZE = int(os.getenv("USER_STORAGE_HOT_SIZE", 50000))
+USER_STORAGE_IDLE_TTL = float(os.getenv("USER_STORAGE_IDLE_TTL", 3600))
+
+# Хранилище состояний FSM: memory или redis, адрес Redis и время жизни брошенного мастера в секундах.
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_TTL = int(os.getenv("FSM_TTL", 24 * 3600))
+
+# Журнал событий активности: каталог сегментов, размер сегмента в байтах и срок хранения при уплотнении.
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "data/events")
+EVENT_SEGMENT_SIZE = int(os.getenv("EVENT_SEGMENT_SIZE", 4 * 1024 * 1024))
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", 365))
+# Глубина дневных агрегатов в памяти (дней) для /history и /trends и число точек на графике тренда.
+ROLLUP_DAYS = int(os.getenv("ROLLUP_DAYS", 90))
+TREND_MAX_POINTS = int(os.getenv("TREND_MAX_POINTS", 15))
+# Число пользователей, дневные агрегаты которых держатся в памяти; остальные строятся из журнала при обращении.
+ROLLUP_USERS = int(os.getenv("ROLLUP_USERS", 10000))
+
+# Автоматическая смена дня: включение, период обхода (с), размер пачки и отправка итогов дня.
+ROLLOVER_ENABLED = os.getenv("ROLLOVER_ENABLED", "1") == "1"
+ROLLOVER_INTERVAL = float(os.getenv("ROLLOVER_INTERVAL", 60))
+ROLLOVER_CHUNK = int(os.getenv("ROLLOVER_CHUNK", 500))
+ROLLOVER_NOTIFY = os.getenv("ROLLOVER_NOTIFY", "0") == "1"
+
+# Метрики: адрес HTTP-эндпоинта /metrics (по умолчанию порт 0 - сервер выключен; 9100 занят node_exporter),
+# период замера задержки event loop и ограничение числа различных меток одной метрики.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", 0.5))
+METRICS_MAX_LABELS = int(os.getenv("METRICS_MAX_LABELS", 64))
+
+# Очередь исходящих сообщений: включение, общий лимит бота (сообщений в секунду, у Telegram около 30), лимит и запас
+# на чат, число повторов после ответа 429 и число чатов, для которых хранится состояние лимита.
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 29))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", 3))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", 3))
+OUTBOX_MAX_CHATS = int(os.getenv("OUTBOX_MAX_CHATS", 10000))
+
+# Режим получения обновлений: polling (long polling) или webhook.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Webhook: публичный адрес бота, путь и секрет для проверки заголовка X-Telegram-Bot-Api-Secret-Token.
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Адрес локального сервера, предел принятых необработанных обновлений и число одновременно обрабатываемых.
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", 8080))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1024))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 16))
+
+# Шардирование: число процессов-воркеров (1 - обработка в одном процессе), порты воркеров на localhost,
+# период и порог проверок здоровья, пауза перед перезапуском, размер пачки и очереди обновлений воркера.
+SHARDS = int(os.getenv("SHARDS", 1))
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", 8200))
+SHARD_HEALTH_INTERVAL = float(os.getenv("SHARD_HEALTH_INTERVAL", 5))
+SHARD_HEALTH_FAILURES = int(os.getenv("SHARD_HEALTH_FAILURES", 3))
+SHARD_RESTART_DELAY = float(os.getenv("SHARD_RESTART_DELAY", 1))
+SHARD_BATCH = int(os.getenv("SHARD_BATCH", 100))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", 4096))
+# Номер шарда задается супервизором при запуске воркера (режим worker).
+SHARD_ID = int(os.getenv("SHARD_ID", 0))
+SHARD_SECRET = os.getenv("SHARD_SECRET", "")
+# Файл с числом шардов, по которым разложены данные на диске (рядом с базой пользователей).
+SHARD_LAYOUT_PATH = os.getenv(
+    "SHARD_LAYOUT_PATH", os.path.join(os.path.dirname(USER_STORAGE_PATH) or ".", "shards.json")
+)
+
+
+def shard_path(path: str, shard_id: int) -> str:
+    '''
+    Путь данных шарда: каталог shard-N рядом с общим путем path.
+    '''
+
+    return os.path.join(os.path.dirname(path), f"shard-{shard_id}", os.path.basename(path))
+
+
+if BOT_MODE == "worker":
+    # Воркер получает обновления только от супервизора и хранит данные своих
+    # пользователей отдельно от других шардов. Кэш калорийности продуктов не
+    # зависит от пользователя и остается общим файлом SQLite для всех воркеров.
+    WEBAPP_HOST = "127.0.0.1"
+    WEBAPP_PORT = SHARD_BASE_PORT + SHARD_ID
+    WEBHOOK_PATH = "/updates"
+    WEBHOOK_SECRET = SHARD_SECRET
+    WEBHOOK_BASE_URL = ""
+    # Общий лимит Telegram на бота делится между воркерами.
+    OUTBOX_GLOBAL_RATE = OUTBOX_GLOBAL_RATE / max(SHARDS, 1)
+    USER_STORAGE_PATH, EVENT_LOG_DIR = (shard_path(path, SHARD_ID) for path in (USER_STORAGE_PATH, EVENT_LOG_DIR))
 
 if not BOT_TOKEN or not OPEN_WEATHER_KEY:
-    raise NameError
\ No newline at end of file
+    raise NameError
+if BOT_MODE not in ("polling", "webhook", "worker"):
+    raise ValueError(f"Неизвестный режим работы бота: {BOT_MODE}")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    # Без секрета webhook принимал бы поддельные обновления от кого угодно.
+    # Если webhook регистрирует сам бот, секрет генерируется и передается в setWebhook.
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("Для режима webhook без WEBHOOK_BASE_URL нужно задать WEBHOOK_SECRET.")
+    WEBHOOK_SECRET = secrets.token_hex(32)
+if BOT_MODE == "worker" and not WEBHOOK_SECRET:
+    raise ValueError("Воркер шарда запускается только супервизором с SHARD_SECRET.")
\ No newline at end of file
@@ -0,0 +1,568 @@
+import asyncio
+import glob
+from array import array
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+from config import logger, EVENT_LOG_DIR, EVENT_SEGMENT_SIZE, EVENT_RETENTION_DAYS, ROLLUP_DAYS, ROLLUP_USERS
+
+
+# Типы событий активности.
+WATER = 1
+FOOD = 2
+WORKOUT = 3
+
+# Заголовок записи: user_id, время (с), смещение часового пояса (с), тип,
+# количество (мл / г / мин), ккал, длина подписи.
+_HEADER = struct.Struct("<qdiBffB")
+# Метка формата в начале каждого сегмента.
+_SEGMENT_MAGIC = b"EVT2"
+# Запись индекса закрытого сегмента: user_id, смещение события в сегменте.
+_INDEX = struct.Struct("<qQ")
+
+ActivityEvent = namedtuple("ActivityEvent", ["user_id", "ts", "kind", "amount", "kcal", "label", "tz_offset"],
+                           defaults=(0,))
+
+
+def encode_event(event: ActivityEvent) -> bytes:
+    '''
+    Компактное двоичное представление события.
+    '''
+
+    label = event.label.encode("utf-8")[:255]
+    return _HEADER.pack(
+        event.user_id, event.ts, event.tz_offset, event.kind, event.amount, event.kcal, len(label)
+    ) + label
+
+
+def _read_event(file):
+    header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    user_id, ts, tz_offset, kind, amount, kcal, label_size = _HEADER.unpack(header)
+    label = file.read(label_size)
+    if len(label) < label_size:
+        return None
+    return ActivityEvent(user_id, ts, kind, amount, kcal, label.decode("utf-8", errors="replace"), tz_offset)
+
+
+def iter_segment(path: str):
+    '''
+    Потоковое чтение событий сегмента вместе с их смещениями в файле.
+    Недописанный хвост файла пропускается.
+    '''
+
+    with open(path, "rb") as file:
+        file.read(len(_SEGMENT_MAGIC))
+        while True:
+            offset = file.tell()
+            event = _read_event(file)
+            if event is None:
+                return
+            yield offset, event
+
+
+def read_segment(path: str):
+    '''
+    Потоковое чтение событий сегмента.
+    '''
+
+    for _, event in iter_segment(path):
+        yield event
+
+
+def read_events(path: str, offsets: list) -> list:
+    '''
+    События сегмента по их смещениям.
+    '''
+
+    if not offsets:
+        return []
+    with open(path, "rb") as file:
+        events = []
+        for offset in offsets:
+            file.seek(offset)
+            events.append(_read_event(file))
+    return events
+
+
+def index_path(path: str) -> str:
+    return path[:-len(".seg")] + ".idx"
+
+
+def segment_offsets(path: str) -> dict:
+    '''
+    Смещения событий сегмента по пользователям: {user_id: [смещение]}.
+    '''
+
+    offsets = {}
+    for offset, event in iter_segment(path):
+        offsets.setdefault(event.user_id, []).append(offset)
+    return offsets
+
+
+def write_index(path: str, offsets: dict):
+    '''
+    Индекс закрытого сегмента: записи (user_id, смещение), упорядоченные по
+    пользователю. Файл появляется атомарно и только полностью записанным.
+    '''
+
+    temp_path = index_path(path) + ".tmp"
+    with open(temp_path, "wb") as file:
+        for user_id in sorted(offsets):
+            file.write(b"".join(_INDEX.pack(user_id, offset) for offset in offsets[user_id]))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, index_path(path))
+
+
+def read_index(path: str, user_id: int) -> list:
+    '''
+    Смещения событий пользователя в закрытом сегменте: двоичный поиск по
+    индексу без чтения его целиком.
+    '''
+
+    with open(index_path(path), "rb") as file:
+        count = os.fstat(file.fileno()).st_size // _INDEX.size
+        if not count:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                if _INDEX.unpack_from(data, middle * _INDEX.size)[0] < user_id:
+                    low = middle + 1
+                else:
+                    high = middle
+            offsets = []
+            while low < count:
+                record_user_id, offset = _INDEX.unpack_from(data, low * _INDEX.size)
+                if record_user_id != user_id:
+                    break
+                offsets.append(offset)
+                low += 1
+    return offsets
+
+
+def event_day(ts: float, tz_offset: int = 0) -> date:
+    '''
+    Календарный день события в часовом поясе пользователя на момент записи.
+    '''
+
+    return datetime.fromtimestamp(ts + (tz_offset or 0), tz=timezone.utc).date()
+
+
+# Число показателей дневного агрегата: вода мл, потреблено ккал, сожжено ккал, минуты тренировок.
+ROLLUP_COLUMNS = 4
+
+
+def event_totals(event: ActivityEvent) -> tuple:
+    '''
+    Вклад события в агрегат: пары (номер показателя, прибавка).
+    '''
+
+    if event.kind == WATER:
+        return ((0, event.amount),)
+    if event.kind == FOOD:
+        return ((1, event.kcal),)
+    if event.kind == WORKOUT:
+        return (2, event.kcal), (3, event.amount)
+    return ()
+
+
+class DailyRing:
+    '''
+    Кольцевой буфер дневных агрегатов пользователя на capacity последних дней.
+
+    День с порядковым номером ordinal хранится в ячейке ordinal % capacity:
+    ячейка хранит номер своего дня и ROLLUP_COLUMNS чисел float32 в плоском
+    массиве. Новый день занимает ячейку дня, который был capacity дней назад,
+    поэтому память на пользователя постоянна: около 20 байт на день плюс
+    заголовки двух массивов.
+    '''
+
+    __slots__ = ("days", "values")
+
+    def __init__(self, capacity: int):
+        self.days = array("i", bytes(4 * capacity))
+        self.values = array("f", bytes(4 * capacity * ROLLUP_COLUMNS))
+
+    @property
+    def capacity(self) -> int:
+        return len(self.days)
+
+    def add(self, ordinal: int, column: int, amount: float):
+        slot = ordinal % len(self.days)
+        if self.days[slot] != ordinal:
+            # Событие старше дня в ячейке уже вышло за глубину буфера.
+            if self.days[slot] > ordinal:
+                return
+            self.days[slot] = ordinal
+            base = slot * ROLLUP_COLUMNS
+            self.values[base:base + ROLLUP_COLUMNS] = array("f", bytes(4 * ROLLUP_COLUMNS))
+        self.values[slot * ROLLUP_COLUMNS + column] += amount
+
+    def get(self, ordinal: int):
+        slot = ordinal % len(self.days)
+        if self.days[slot] != ordinal:
+            return None
+        base = slot * ROLLUP_COLUMNS
+        return list(self.values[base:base + ROLLUP_COLUMNS])
+
+
+class Rollups:
+    '''
+    Дневные агрегаты по пользователям, обновляемые по мере поступления событий.
+
+    Агрегат - список [вода мл, потреблено ккал, сожжено ккал, минуты тренировок].
+    Дневные агрегаты хранятся в кольцевом буфере DailyRing на days дней, более
+    старые дни доступны только в журнале. Буферы держатся в памяти только для
+    max_users пользователей, к которым дольше всех обращались недавно: буфер
+    строится из событий пользователя при первом обращении (load) и вытесняется
+    при переполнении, поэтому память не растет с числом пользователей. add
+    обновляет только загруженные буферы. Дни считаются по местному времени
+    пользователя, как и сброс счетчиков в полночь; today в запросах - местный
+    день пользователя (по умолчанию UTC).
+    '''
+
+    def __init__(self, days: int = ROLLUP_DAYS, max_users: int = ROLLUP_USERS):
+        self.days = days
+        self.max_users = max_users
+        self.daily = OrderedDict()
+        self.evictions = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.daily
+
+    def __len__(self) -> int:
+        return len(self.daily)
+
+    @staticmethod
+    def _add(ring: DailyRing, event: ActivityEvent):
+        ordinal = event_day(event.ts, event.tz_offset).toordinal()
+        for column, amount in event_totals(event):
+            ring.add(ordinal, column, amount)
+
+    def load(self, user_id: int, events):
+        '''
+        Построение буфера пользователя из его событий в порядке записи.
+        '''
+
+        ring = DailyRing(self.days)
+        for event in events:
+            self._add(ring, event)
+        self.daily[user_id] = ring
+        self.daily.move_to_end(user_id)
+        while len(self.daily) > self.max_users:
+            self.daily.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, event: ActivityEvent):
+        ring = self.daily.get(event.user_id)
+        if ring is not None:
+            self.daily.move_to_end(event.user_id)
+            self._add(ring, event)
+
+    def day(self, user_id: int, day: date):
+        ring = self.daily.get(user_id)
+        return ring.get(day.toordinal()) if ring is not None else None
+
+    def last_days(self, user_id: int, days: int, today: date = None) -> list:
+        '''
+        Агрегаты за последние days дней: список (дата, агрегат или None), O(days).
+        '''
+
+        today = today or datetime.now(tz=timezone.utc).date()
+        return [(day, self.day(user_id, day)) for day in (today - timedelta(days=i) for i in range(days))]
+
+    def series(self, user_id: int, days: int, today: date = None) -> list:
+        '''
+        Агрегаты за последние days дней от старого дня к сегодняшнему, дни без
+        записей - нулями. Читает только days ячеек кольцевого буфера.
+        '''
+
+        today = today or datetime.now(tz=timezone.utc).date()
+        ring = self.daily.get(user_id)
+        empty = [0.0] * ROLLUP_COLUMNS
+        if ring is None:
+            return [empty] * days
+        last = today.toordinal()
+        return [ring.get(ordinal) or empty for ordinal in range(last - days + 1, last + 1)]
+
+
+class EventLog:
+    '''
+    Журнал событий активности из сегментов, доступных только для дозаписи.
+
+    Активный сегмент закрывается при достижении segment_size байт, закрытые
+    сегменты можно уплотнить в один, отбросив события старше retention_days.
+    Закрытый сегмент получает индекс смещений событий по пользователям, смещения
+    активного сегмента хранятся в памяти, поэтому дневные агрегаты пользователя
+    (rollups) строятся при первом обращении чтением только его событий, а не
+    всего журнала.
+    '''
+
+    def __init__(self, directory: str = EVENT_LOG_DIR, segment_size: int = EVENT_SEGMENT_SIZE,
+                 retention_days: int = EVENT_RETENTION_DAYS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.retention_days = retention_days
+        self.rollups = Rollups()
+        self._file = None
+        self._segment_id = 0
+        # Смещения событий активного сегмента по пользователям: {user_id: [смещение]}.
+        self._offsets = {}
+        # Построение агрегатов пользователей: user_id -> задача, и события,
+        # записанные, пока агрегаты пользователя строятся.
+        self._loading = {}
+        self._appended = {}
+        # Чтение и запись файлов журнала вне event loop выполняются в одном потоке.
+        self._executor = None
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"events-{segment_id:08d}.seg")
+
+    def segments(self) -> list:
+        return sorted(glob.glob(os.path.join(self.directory, "events-*.seg")))
+
+    @staticmethod
+    def _segment_number(path: str) -> int:
+        return int(os.path.basename(path)[7:15])
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-log")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def read(self):
+        '''
+        Потоковое чтение всех событий журнала в порядке записи.
+        '''
+
+        for path in self.segments():
+            yield from read_segment(path)
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover_compaction()
+        # Недописанные при сбое индексы.
+        for path in glob.glob(os.path.join(self.directory, "events-*.idx.tmp")):
+            os.remove(path)
+        segments = self.segments()
+        self._segment_id = self._segment_number(segments[-1]) if segments else 0
+        self._offsets = {}
+        if segments and os.path.getsize(segments[-1]) < self.segment_size:
+            # Дозапись продолжается в последний сегмент, если он не заполнен.
+            self._segment_id -= 1
+            self._offsets = segment_offsets(segments.pop())
+        for path in segments:
+            # Индекс закрытого сегмента мог не записаться из-за сбоя.
+            if not os.path.exists(index_path(path)):
+                write_index(path, segment_offsets(path))
+        self._rotate()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            write_index(self._segment_path(self._segment_id), self._offsets)
+            self._offsets = {}
+        self._segment_id += 1
+        self._file = open(self._segment_path(self._segment_id), "ab")
+        if self._file.tell() == 0:
+            self._file.write(_SEGMENT_MAGIC)
+
+    async def start(self):
+        '''
+        Открытие журнала. Агрегаты не восстанавливаются: они строятся для
+        каждого пользователя при первом обращении.
+        '''
+
+        if self._file is None:
+            await self._run(self._open)
+            logger.info("Журнал событий открыт: сегментов %s.", len(self.segments()))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def append(self, user_id: int, kind: int, amount: float, kcal: float = 0.0, label: str = "",
+               tz_offset: int = 0):
+        '''
+        Запись события и обновление дневного агрегата.
+        tz_offset - смещение часового пояса пользователя из профиля.
+        '''
+
+        event = ActivityEvent(user_id, time.time(), kind, amount, kcal, label, tz_offset or 0)
+        if self._file is None:
+            self._open()
+        self._write(event)
+        self.rollups.add(event)
+        appended = self._appended.get(user_id)
+        if appended is not None:
+            appended.append(event)
+        return event
+
+    def _write(self, event: ActivityEvent):
+        offset = self._file.tell()
+        self._file.write(encode_event(event))
+        self._file.flush()
+        self._offsets.setdefault(event.user_id, []).append(offset)
+        if self._file.tell() >= self.segment_size:
+            self._rotate()
+
+    def _read_user(self, user_id: int, active_id: int, active_offsets: list) -> list:
+        # Закрытые сегменты, последняя запись в которые была раньше глубины
+        # буфера (с запасом на часовой пояс), не содержат нужных дней.
+        threshold = time.time() - (self.rollups.days + 1) * 86400
+        events = []
+        for path in self.segments():
+            if self._segment_number(path) >= active_id or os.path.getmtime(path) < threshold:
+                continue
+            if not os.path.exists(index_path(path)):
+                write_index(path, segment_offsets(path))
+            events.extend(read_events(path, read_index(path, user_id)))
+        events.extend(read_events(self._segment_path(active_id), active_offsets))
+        return events
+
+    async def _load_rollups(self, user_id: int):
+        if self._file is None:
+            await self.start()
+        # Снимок активного сегмента: события, записанные после него, собираются
+        # в _appended и добавляются к прочитанным.
+        active_id, active_offsets = self._segment_id, list(self._offsets.get(user_id, ()))
+        self._appended[user_id] = appended = []
+        try:
+            events = await self._run(self._read_user, user_id, active_id, active_offsets)
+        finally:
+            del self._appended[user_id]
+        self.rollups.load(user_id, events + appended)
+
+    async def load_rollups(self, user_id: int):
+        '''
+        Дневные агрегаты пользователя в rollups: при отсутствии в памяти
+        строятся из его событий журнала. Одновременные запросы ждут общего чтения.
+        '''
+
+        if user_id in self.rollups:
+            return
+        task = self._loading.get(user_id)
+        if task is None:
+            task = self._loading[user_id] = asyncio.ensure_future(self._load_rollups(user_id))
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        # shield: отмена одного ожидающего не отменяет общее чтение.
+        await asyncio.shield(task)
+
+    @classmethod
+    def split(cls, sources: list, targets: list, segment_size: int = EVENT_SEGMENT_SIZE) -> int:
+        '''
+        Раскладка событий журналов sources по журналам targets: события
+        пользователя попадают в targets[user_id % len(targets)] в прежнем
+        порядке. Агрегаты не строятся. Возвращает число событий.
+        '''
+
+        logs = [cls(directory=path, segment_size=segment_size) for path in targets]
+        for log in logs:
+            os.makedirs(log.directory, exist_ok=True)
+            log._rotate()
+        copied = 0
+        try:
+            for source in sources:
+                for event in cls(directory=source).read():
+                    logs[event.user_id % len(logs)]._write(event)
+                    copied += 1
+        finally:
+            for log in logs:
+                log.close()
+        return copied
+
+    def _compaction_paths(self) -> tuple:
+        # Уплотненный сегмент до завершения и маркер с перечнем заменяемых сегментов.
+        return os.path.join(self.directory, "compacted.tmp"), os.path.join(self.directory, "compaction")
+
+    def _finish_compaction(self):
+        '''
+        Завершение уплотнения по маркеру: удаление заменяемых сегментов и
+        перенос уплотненного сегмента на место последнего из них. Повторный
+        вызов после сбоя на любом шаге приводит к тому же результату.
+        '''
+
+        merged_path, marker_path = self._compaction_paths()
+        with open(marker_path, encoding="utf-8") as file:
+            names = file.read().split()
+        # Индексы заменяемых сегментов устаревают; индекс уплотненного сегмента
+        # строится после снятия маркера.
+        for name in names:
+            path = index_path(os.path.join(self.directory, name))
+            if os.path.exists(path):
+                os.remove(path)
+        # Без уплотненного файла перенос уже выполнен: осталось снять маркер.
+        if os.path.exists(merged_path):
+            for name in names:
+                path = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            os.replace(merged_path, os.path.join(self.directory, names[-1]))
+        os.remove(marker_path)
+
+    def _recover_compaction(self):
+        '''
+        Доведение до конца уплотнения, прерванного сбоем. Уплотненный файл без
+        маркера не дописан: исходные сегменты целы, и он удаляется.
+        '''
+
+        merged_path, marker_path = self._compaction_paths()
+        if os.path.exists(marker_path):
+            logger.warning("Журнал событий: завершение прерванного уплотнения.")
+            self._finish_compaction()
+        for path in (merged_path, marker_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _compact(self) -> int:
+        sealed = [path for path in self.segments() if path != self._segment_path(self._segment_id)]
+        if len(sealed) < 2:
+            return 0
+        threshold = time.time() - self.retention_days * 86400
+        merged_path, marker_path = self._compaction_paths()
+        with open(merged_path, "wb") as file:
+            file.write(_SEGMENT_MAGIC)
+            for path in sealed:
+                for event in read_segment(path):
+                    if event.ts >= threshold:
+                        file.write(encode_event(event))
+            file.flush()
+            os.fsync(file.fileno())
+        # Маркер появляется атомарно и только после полной записи уплотненного
+        # сегмента: до него при сбое действуют исходные сегменты, после - новый.
+        # Уплотненный сегмент занимает номер последнего из объединяемых.
+        with open(marker_path + ".tmp", "w", encoding="utf-8") as file:
+            file.write("\n".join(os.path.basename(path) for path in sealed))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(marker_path + ".tmp", marker_path)
+        self._finish_compaction()
+        write_index(sealed[-1], segment_offsets(sealed[-1]))
+        return len(sealed)
+
+    async def compact(self) -> int:
+        '''
+        Объединение закрытых сегментов в один с удалением устаревших событий.
+        '''
+
+        merged = await self._run(self._compact)
+        if merged:
+            logger.info("Журнал событий: уплотнено сегментов %s.", merged)
+        return merged
+
+
+# Общий журнал событий, открывается и закрывается в bot.main().
+event_log = EventLog()
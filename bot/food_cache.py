@@ -0,0 +1,180 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import ClientError
+
+from cache import LRUCache
+from config import (
+    logger, FOOD_CACHE_PATH, FOOD_CACHE_SIZE, FOOD_CACHE_TTL, FOOD_CACHE_NEGATIVE_TTL, FOOD_LOOKUP_CONCURRENCY
+)
+from food_db import FoodDB, food_db
+from resilience import UpstreamUnavailable
+from utils import fetch_product_calories, scale_calories
+
+
+def normalize_product(product_name: str) -> str:
+    '''
+    Нормализация названия продукта для ключа кэша.
+    '''
+
+    return " ".join(product_name.split()).casefold()
+
+
+class FoodCache:
+    '''
+    Двухуровневый кэш калорийности продуктов (ккал на 100 г).
+
+    Первый уровень - LRU в памяти процесса, второй - SQLite-файл в режиме WAL,
+    который переживает перезапуск и может использоваться несколькими процессами
+    бота на одном хосте. Отсутствие данных о продукте кэшируется с отдельным,
+    более коротким сроком жизни. Перед SQLite и API продукт ищется в офлайн-базе
+    food_db, найденное значение кэшируется только в памяти.
+    '''
+
+    def __init__(self, path: str = FOOD_CACHE_PATH, maxsize: int = FOOD_CACHE_SIZE,
+                 ttl: float = FOOD_CACHE_TTL, negative_ttl: float = FOOD_CACHE_NEGATIVE_TTL,
+                 fetch=fetch_product_calories, db: FoodDB = food_db):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._fetch = fetch
+        self._food_db = db
+        self._memory = LRUCache(maxsize)
+        # Все операции с SQLite выполняются в одном потоке вне event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="food-cache")
+        self._db = None
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            "name TEXT PRIMARY KEY, kcal_100g REAL, expires_at REAL NOT NULL)"
+        )
+        return db
+
+    def _read(self, key: str):
+        return self._db.execute(
+            "SELECT kcal_100g, expires_at FROM products WHERE name = ?", (key,)
+        ).fetchone()
+
+    def _write(self, key: str, kcal_100g, expires_at: float):
+        self._db.execute(
+            "INSERT OR REPLACE INTO products (name, kcal_100g, expires_at) VALUES (?, ?, ?)",
+            (key, kcal_100g, expires_at)
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        if self._db is None:
+            self._db = await self._run(self._open)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        if self._food_db is not None:
+            await self._run(self._food_db.close)
+        self._executor.shutdown(wait=False)
+
+    async def get_calories_100(self, product_name: str):
+        '''
+        Калорийность продукта на 100 г: из памяти, с диска либо из API.
+        '''
+
+        key = normalize_product(product_name)
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None and entry[1] > now:
+            self.memory_hits += 1
+            return entry[0]
+
+        await self.start()
+        # Офлайн-база продуктов отвечает без обращения к API.
+        if self._food_db is not None:
+            kcal_100g = await self._run(self._food_db.lookup, key)
+            if kcal_100g is not None:
+                self.db_hits += 1
+                self._memory.set(key, (kcal_100g, now + self.ttl))
+                return kcal_100g
+
+        row = await self._run(self._read, key)
+        if row is not None and row[1] > now:
+            self.disk_hits += 1
+            self._memory.set(key, row)
+            return row[0]
+
+        self.misses += 1
+        try:
+            kcal_100g = await self._fetch(key)
+        except (ClientError, asyncio.TimeoutError, ValueError, UpstreamUnavailable) as e:
+            self.errors += 1
+            logger.warning("Кэш продуктов: ошибка запроса для %s: %s", key, e)
+            # Устаревшее значение лучше, чем нулевая калорийность; строку на диске
+            # мог обновить другой процесс, поэтому берется запись с более поздним сроком.
+            stale = max((item for item in (entry, row) if item is not None), key=lambda item: item[1], default=None)
+            if stale is not None:
+                return stale[0]
+            if isinstance(e, UpstreamUnavailable):
+                # Без данных обработчик сообщит о недоступности сервиса, а не запишет 0 ккал.
+                raise
+            return None
+
+        expires_at = now + (self.ttl if kcal_100g is not None else self.negative_ttl)
+        self._memory.set(key, (kcal_100g, expires_at))
+        await self._run(self._write, key, kcal_100g, expires_at)
+        return kcal_100g
+
+    async def get_calories_100_many(self, product_names, concurrency: int = FOOD_LOOKUP_CONCURRENCY) -> dict:
+        '''
+        Калорийность нескольких продуктов на 100 г: {нормализованное название: ккал}.
+        Повторяющиеся продукты запрашиваются один раз, запросы идут параллельно,
+        не более concurrency одновременно.
+        '''
+
+        slots = asyncio.Semaphore(concurrency)
+
+        async def lookup(key: str):
+            async with slots:
+                return key, await self.get_calories_100(key)
+
+        keys = {normalize_product(name) for name in product_names}
+        return dict(await asyncio.gather(*(lookup(key) for key in keys)))
+
+    async def get_calories(self, product_name: str, product_weight: float) -> float:
+        '''
+        Калорийность продукта заданного веса, пересчет выполняется локально.
+        '''
+
+        return scale_calories(await self.get_calories_100(product_name), product_weight)
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits + self.disk_hits
+        requests = hits + self.misses
+        return {
+            "memory_size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(hits / requests, 4) if requests else 0.0
+        }
+
+
+# Общий кэш продуктов для обработчиков.
+food_cache = FoodCache()
@@ -0,0 +1,278 @@
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+from collections import namedtuple
+from typing import Optional
+
+import numpy as np
+
+from config import logger, FOOD_DB_PATH, FOOD_DB_MIN_SCORE
+
+# Версия формата файлов базы, меняется при несовместимых изменениях.
+FORMAT_VERSION = 1
+
+# Запись продукта: смещение и длина названия в names.bin, число слов названия, ккал на 100 г.
+PRODUCT = np.dtype([("name_off", "<u8"), ("name_len", "<u2"), ("tokens", "u1"), ("kcal", "<f4")])
+# Слово словаря (по возрастанию текста): текст в vocab.bin и список продуктов в postings.bin.
+WORD = np.dtype([("text_off", "<u8"), ("text_len", "<u2"), ("post_off", "<u8"), ("df", "<u4")])
+# Триграмма слова (по возрастанию) и список слов с ней в gram_postings.bin.
+GRAM = np.dtype([("gram", "<U3"), ("post_off", "<u8"), ("count", "<u4")])
+
+# Максимум идентификаторов, читаемых из одного списка: ограничивает время поиска по частым словам.
+MAX_POSTINGS = 1 << 19
+# Минимальное сходство слова по триграммам для замены слова с опечаткой.
+MIN_WORD_SIMILARITY = 0.5
+# Штраф ранга за каждое лишнее слово в названии продукта.
+EXTRA_WORD_PENALTY = 0.02
+# Число лучших кандидатов, из которых берется итоговое значение.
+TOP_CANDIDATES = 20
+
+_WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+FoodMatch = namedtuple("FoodMatch", ["name", "kcal_100g", "score"])
+
+
+def normalize_name(name: str) -> str:
+    '''
+    Нормализация названия продукта: регистр, пробелы и буква ё.
+    '''
+
+    return " ".join(name.split()).casefold().replace("ё", "е")
+
+
+def tokenize(name: str) -> list:
+    '''
+    Различные слова нормализованного названия (буквенные, от двух символов) в порядке появления.
+    '''
+
+    return list(dict.fromkeys(_WORD_RE.findall(name)))
+
+
+def trigrams(word: str) -> set:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def word_similarity(first: str, second: str) -> float:
+    '''
+    Коэффициент Дайса по триграммам двух слов.
+    '''
+
+    first, second = trigrams(first), trigrams(second)
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+def name_score(query: str, name: str) -> float:
+    '''
+    Сходство названия с запросом без индекса: доля слов запроса в названии
+    за вычетом штрафа за лишние слова. Для выбора среди нескольких результатов.
+    '''
+
+    query_words = tokenize(normalize_name(query))
+    name_words = tokenize(normalize_name(name))
+    if not query_words or not name_words:
+        return 0.0
+    matched = sum(max(word_similarity(word, other) for other in name_words) for word in query_words)
+    extra = max(0, len(name_words) - len(query_words))
+    return matched / len(query_words) - EXTRA_WORD_PENALTY * min(extra, 10)
+
+
+def _map(path: str):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Vocabulary:
+    '''
+    Последовательность слов словаря для bisect без загрузки словаря в память.
+    '''
+
+    def __init__(self, words: np.ndarray, text: bytes):
+        self.words = words
+        self.text = text
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, index: int) -> str:
+        word = self.words[index]
+        offset = int(word["text_off"])
+        return self.text[offset:offset + int(word["text_len"])].decode("utf-8")
+
+
+class FoodDB:
+    '''
+    Офлайн-база калорийности продуктов, импортированная из выгрузки Open Food
+    Facts (food_import.py).
+
+    Все файлы базы отображаются в память (mmap) и не читаются целиком:
+    процесс держит только страницы, которых коснулся поиск, а несколько
+    процессов бота на одном хосте делят их через кэш страниц ОС.
+
+    Поиск: слова запроса находятся в отсортированном словаре двоичным поиском,
+    слово с опечаткой заменяется ближайшим словом словаря по триграммам.
+    Продукты со словами запроса ранжируются по доле совпавших слов с весом
+    IDF (редкие слова важнее частых) и штрафу за лишние слова в названии.
+    Калорийность - медиана среди лучших кандидатов с тем же названием, что
+    сглаживает ошибки в отдельных карточках продуктов.
+    '''
+
+    def __init__(self, path: str = FOOD_DB_PATH, min_score: float = FOOD_DB_MIN_SCORE):
+        self.path = path
+        self.min_score = min_score
+        self.rows = 0
+        self._opened = False
+        self._maps = []
+
+    @property
+    def available(self) -> bool:
+        return self.rows > 0
+
+    def open(self) -> bool:
+        '''
+        Открытие базы; без файлов базы поиск всегда возвращает промах.
+        '''
+
+        if self._opened:
+            return self.available
+        self._opened = True
+        try:
+            with open(os.path.join(self.path, "meta.json"), encoding="utf-8") as file:
+                meta = json.load(file)
+            if meta.get("version") != FORMAT_VERSION:
+                raise ValueError(f"неподдерживаемая версия формата {meta.get('version')}")
+            files = {
+                name: _map(os.path.join(self.path, f"{name}.bin"))
+                for name in ("products", "names", "words", "vocab", "postings", "grams", "gram_postings")
+            }
+        except FileNotFoundError:
+            logger.info("Офлайн-база продуктов %s не найдена, используется только API.", self.path)
+            return False
+        except (OSError, ValueError) as e:
+            logger.error("Офлайн-база продуктов %s не открыта: %s", self.path, e)
+            return False
+
+        self._maps = [value for value in files.values() if isinstance(value, mmap.mmap)]
+        self.products = np.frombuffer(files["products"], dtype=PRODUCT)
+        self.names = files["names"]
+        self.words = np.frombuffer(files["words"], dtype=WORD)
+        self.vocabulary = _Vocabulary(self.words, files["vocab"])
+        self.postings = np.frombuffer(files["postings"], dtype="<u4")
+        self.grams = np.frombuffer(files["grams"], dtype=GRAM)
+        self.gram_postings = np.frombuffer(files["gram_postings"], dtype="<u4")
+        self.rows = len(self.products)
+        logger.info("Офлайн-база продуктов: %s записей, %s слов.", self.rows, len(self.words))
+        return self.available
+
+    def close(self):
+        self.products = self.words = self.postings = self.grams = self.gram_postings = None
+        self.vocabulary = self.names = None
+        for file in self._maps:
+            file.close()
+        self._maps = []
+        self.rows = 0
+        self._opened = False
+
+    def _name(self, row: int) -> str:
+        product = self.products[row]
+        offset = int(product["name_off"])
+        return self.names[offset:offset + int(product["name_len"])].decode("utf-8")
+
+    def _word_id(self, word: str) -> Optional[int]:
+        index = bisect.bisect_left(self.vocabulary, word)
+        if index < len(self.vocabulary) and self.vocabulary[index] == word:
+            return index
+        return None
+
+    def _closest_word(self, word: str):
+        '''
+        Ближайшее по триграммам слово словаря: (идентификатор, сходство) либо None.
+        '''
+
+        lists = []
+        for gram in trigrams(word):
+            index = np.searchsorted(self.grams["gram"], gram)
+            if index < len(self.grams) and self.grams[index]["gram"] == gram:
+                entry = self.grams[index]
+                offset = int(entry["post_off"])
+                lists.append(self.gram_postings[offset:offset + min(int(entry["count"]), MAX_POSTINGS)])
+        if not lists:
+            return None
+        candidates, shared = np.unique(np.concatenate(lists), return_counts=True)
+        best = candidates[np.argsort(shared)[::-1][:TOP_CANDIDATES]]
+        scored = [(word_similarity(word, self.vocabulary[int(word_id)]), int(word_id)) for word_id in best]
+        similarity, word_id = max(scored)
+        return (word_id, similarity) if similarity >= MIN_WORD_SIMILARITY else None
+
+    def search(self, query: str, limit: int = 5) -> list:
+        '''
+        Лучшие совпадения с запросом: список FoodMatch по убыванию ранга.
+        '''
+
+        if not self.open():
+            return []
+        words = tokenize(normalize_name(query))
+        if not words:
+            return []
+
+        # Вес слова запроса - IDF; слово, которого нет в базе, считается самым редким.
+        total_weight = 0.0
+        lists, weights = [], []
+        for word in words:
+            word_id = self._word_id(word)
+            similarity = 1.0
+            if word_id is None:
+                closest = self._closest_word(word)
+                if closest is None:
+                    total_weight += math.log(1 + self.rows)
+                    continue
+                word_id, similarity = closest
+            entry = self.words[word_id]
+            df = int(entry["df"])
+            idf = math.log(1 + self.rows / df)
+            total_weight += idf
+            offset = int(entry["post_off"])
+            lists.append(self.postings[offset:offset + min(df, MAX_POSTINGS)])
+            weights.append(idf * similarity)
+        if not lists:
+            return []
+
+        rows = np.concatenate(lists)
+        row_weights = np.repeat(np.array(weights), [len(postings) for postings in lists])
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        coverage = np.bincount(inverse, weights=row_weights) / total_weight
+        matched = np.bincount(inverse)
+        extra = self.products["tokens"][candidates].astype(np.int64) - matched
+        rank = coverage - EXTRA_WORD_PENALTY * np.clip(extra, 0, 10)
+
+        top = np.argsort(rank)[::-1][:TOP_CANDIDATES]
+        groups = {}
+        for index in top:
+            name = self._name(int(candidates[index]))
+            group = groups.setdefault(name, [float(coverage[index]), float(rank[index]), []])
+            group[2].append(float(self.products[int(candidates[index])]["kcal"]))
+        matches = [
+            FoodMatch(name, round(float(np.median(kcal)), 2), round(group_coverage, 4))
+            for name, (group_coverage, _, kcal) in sorted(groups.items(), key=lambda item: -item[1][1])
+        ]
+        return matches[:limit]
+
+    def lookup(self, query: str) -> Optional[float]:
+        '''
+        Калорийность продукта на 100 г по лучшему совпадению либо None, если
+        совпадение хуже min_score или базы нет.
+        '''
+
+        matches = self.search(query, limit=1)
+        if not matches or matches[0].score < self.min_score:
+            return None
+        return matches[0].kcal_100g
+
+
+# Общая офлайн-база продуктов, открывается при первом поиске.
+food_db = FoodDB()
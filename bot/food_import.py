@@ -0,0 +1,276 @@
+'''
+Импорт выгрузки Open Food Facts в офлайн-базу продуктов (food_db.py).
+
+Поддерживаются CSV-выгрузка (en.openfoodfacts.org.products.csv, разделитель -
+табуляция) и JSONL-выгрузка (openfoodfacts-products.jsonl), в том числе
+сжатые gzip. Выгрузка читается потоково, а индекс слов и триграмм строится
+внешней сортировкой через временные файлы, поэтому память процесса не зависит
+от размера выгрузки.
+
+Запуск: python bot/food_import.py openfoodfacts-products.jsonl.gz --output data/food_db
+'''
+
+import argparse
+import csv
+import gzip
+import heapq
+import itertools
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+from config import logger, FOOD_DB_PATH
+from food_db import FORMAT_VERSION, normalize_name, tokenize, trigrams
+
+# Поля названия в порядке предпочтения: русское название, затем основное.
+NAME_FIELDS = ("product_name_ru", "product_name")
+# Предельная калорийность на 100 г (чистый жир): большие значения - ошибки ввода.
+MAX_KCAL_100G = 900
+
+_PRODUCT = struct.Struct("<QHBf")
+_WORD = struct.Struct("<QHQI")
+_GRAM = struct.Struct("<12sQI")
+# Число идентификаторов, после которого список записывается на диск.
+_FLUSH_POSTINGS = 1 << 16
+
+
+def open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, encoding="utf-8", errors="replace", newline="")
+
+
+def read_dump(path: str):
+    '''
+    Потоковое чтение записей выгрузки как словарей.
+    '''
+
+    with open_text(path) as file:
+        first = file.readline()
+        if first.lstrip().startswith("{"):
+            for line in itertools.chain([first], file):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+            return
+        csv.field_size_limit(2 ** 31 - 1)
+        delimiter = "\t" if "\t" in first else ","
+        header = next(csv.reader([first], delimiter=delimiter))
+        quoting = csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL
+        yield from csv.DictReader(file, fieldnames=header, delimiter=delimiter, quoting=quoting)
+
+
+def product_kcal(record: dict):
+    '''
+    Калорийность на 100 г из записи выгрузки; пересчет из кДж, если ккал не указаны.
+    '''
+
+    nutriments = record.get("nutriments")
+    source = nutriments if isinstance(nutriments, dict) else record
+    for field, factor in (("energy-kcal_100g", 1.0), ("energy_100g", 1 / 4.184)):
+        value = source.get(field)
+        if value in (None, ""):
+            continue
+        try:
+            kcal = float(value) * factor
+        except (TypeError, ValueError):
+            continue
+        if 0 <= kcal <= MAX_KCAL_100G:
+            return kcal
+        return None
+    return None
+
+
+def product_entries(record: dict):
+    '''
+    Пары (нормализованное название, ккал на 100 г) записи выгрузки.
+    '''
+
+    kcal = product_kcal(record)
+    if kcal is None:
+        return
+    seen = set()
+    for field in NAME_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str):
+            continue
+        name = normalize_name(value)
+        if name and name not in seen and tokenize(name):
+            seen.add(name)
+            yield name, kcal
+
+
+class ExternalSorter:
+    '''
+    Сортировка строк, не помещающихся в память: отсортированные порции по
+    chunk_size строк пишутся во временные файлы и затем сливаются.
+    '''
+
+    def __init__(self, directory: str, chunk_size: int):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self._lines = []
+        self._files = []
+
+    def add(self, line: str):
+        self._lines.append(line)
+        if len(self._lines) >= self.chunk_size:
+            self._spill()
+
+    def _spill(self):
+        if not self._lines:
+            return
+        self._lines.sort()
+        path = os.path.join(self.directory, f"chunk-{id(self)}-{len(self._files)}.txt")
+        with open(path, "w", encoding="utf-8") as file:
+            file.writelines(self._lines)
+        self._files.append(path)
+        self._lines = []
+
+    def sorted_lines(self):
+        self._spill()
+        files = [open(path, encoding="utf-8") for path in self._files]
+        try:
+            yield from heapq.merge(*files)
+        finally:
+            for file in files:
+                file.close()
+            for path in self._files:
+                os.remove(path)
+            self._files = []
+
+
+def write_index(sorter: ExternalSorter, table, postings, on_key=None) -> int:
+    '''
+    Запись индекса из отсортированных строк "<ключ>\\t<идентификатор>": для
+    каждого ключа - запись таблицы через on_key и список идентификаторов.
+    Возвращает число ключей.
+    '''
+
+    keys = 0
+    current, start, count = None, 0, 0
+    buffer = array("I")
+    position = 0
+    for line in sorter.sorted_lines():
+        key, _, number = line.rstrip("\n").rpartition("\t")
+        if key != current:
+            if current is not None:
+                buffer.tofile(postings)
+                buffer = array("I")
+                table.write(on_key(current, keys, start, count))
+                keys += 1
+            current, start, count = key, position, 0
+        buffer.append(int(number))
+        count += 1
+        position += 1
+        if len(buffer) >= _FLUSH_POSTINGS:
+            buffer.tofile(postings)
+            buffer = array("I")
+    if current is not None:
+        buffer.tofile(postings)
+        table.write(on_key(current, keys, start, count))
+        keys += 1
+    return keys
+
+
+def import_dump(source: str, output: str = FOOD_DB_PATH, chunk_size: int = 1_000_000, limit: int = None) -> dict:
+    '''
+    Импорт выгрузки source в каталог базы output. База собирается во
+    временном каталоге рядом и подменяет старую переименованием, поэтому
+    работающий бот не видит недостроенных файлов.
+    '''
+
+    if sys.byteorder != "little":
+        raise RuntimeError("Формат базы рассчитан на little-endian.")
+    started = time.perf_counter()
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    build = tempfile.mkdtemp(prefix=".food_db-", dir=parent)
+    os.chmod(build, 0o755)
+    records = rows = 0
+    try:
+        words = ExternalSorter(build, chunk_size)
+        with open(os.path.join(build, "products.bin"), "wb") as products, \
+                open(os.path.join(build, "names.bin"), "wb") as names:
+            name_offset = 0
+            for record in read_dump(source):
+                records += 1
+                for name, kcal in product_entries(record):
+                    encoded = name[:1000].encode("utf-8")
+                    tokens = tokenize(name)
+                    names.write(encoded)
+                    products.write(_PRODUCT.pack(name_offset, len(encoded), min(len(tokens), 255), kcal))
+                    name_offset += len(encoded)
+                    for token in tokens:
+                        words.add(f"{token}\t{rows:010d}\n")
+                    rows += 1
+                if limit and records >= limit:
+                    break
+                if records % 1_000_000 == 0:
+                    logger.info("Импорт продуктов: прочитано %s записей, %s продуктов.", records, rows)
+
+        grams = ExternalSorter(build, chunk_size)
+        with open(os.path.join(build, "words.bin"), "wb") as table, \
+                open(os.path.join(build, "vocab.bin"), "wb") as vocab, \
+                open(os.path.join(build, "postings.bin"), "wb") as postings:
+            text_offset = 0
+
+            def on_word(word: str, word_id: int, start: int, count: int) -> bytes:
+                nonlocal text_offset
+                encoded = word.encode("utf-8")
+                vocab.write(encoded)
+                for gram in trigrams(word):
+                    grams.add(f"{gram}\t{word_id:010d}\n")
+                record = _WORD.pack(text_offset, len(encoded), start, count)
+                text_offset += len(encoded)
+                return record
+
+            vocabulary = write_index(words, table, postings, on_word)
+
+        with open(os.path.join(build, "grams.bin"), "wb") as table, \
+                open(os.path.join(build, "gram_postings.bin"), "wb") as postings:
+            gram_count = write_index(
+                grams, table, postings,
+                lambda gram, _, start, count: _GRAM.pack(gram.encode("utf-32-le"), start, count)
+            )
+
+        meta = {
+            "version": FORMAT_VERSION, "source": os.path.basename(source), "records": records,
+            "rows": rows, "words": vocabulary, "grams": gram_count, "created": int(time.time())
+        }
+        with open(os.path.join(build, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+
+        # Подмена базы: открытые ботом файлы старой базы остаются доступны до закрытия.
+        previous = None
+        if os.path.exists(output):
+            previous = tempfile.mkdtemp(prefix=".food_db-old-", dir=parent)
+            os.rename(output, os.path.join(previous, "db"))
+        os.rename(build, output)
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(build, ignore_errors=True)
+        raise
+    meta["seconds"] = round(time.perf_counter() - started, 1)
+    return meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="CSV или JSONL выгрузка Open Food Facts, можно .gz")
+    parser.add_argument("--output", default=FOOD_DB_PATH, help="каталог базы")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="строк индекса в памяти при сортировке")
+    parser.add_argument("--limit", type=int, help="импортировать не больше записей")
+    args = parser.parse_args()
+    result = import_dump(args.source, args.output, args.chunk_size, args.limit)
+    logger.info("Импорт продуктов завершен: %s", result)
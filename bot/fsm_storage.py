@@ -0,0 +1,126 @@
+import json
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+
+from config import FSM_STORAGE, REDIS_URL, FSM_TTL
+
+# Данные FSM, прочитанные вместе с состоянием в начале обработки обновления: (ключ, JSON данных).
+_prefetched = ContextVar("fsm_prefetched", default=None)
+
+
+class RedisFSMStorage(BaseStorage):
+    '''
+    Хранилище состояний FSM в Redis (или совместимом хранилище), общее для
+    всех реплик бота и переживающее перезапуск.
+
+    Состояние и данные пользователя лежат в одном хэше: get_state, который
+    FSM-middleware вызывает в начале каждого обновления, одним запросом HMGET
+    читает и данные, поэтому get_data внутри обработчика не ходит в Redis
+    повторно. update_data не полагается на прочитанные заранее данные: поля
+    объединяются с текущими данными в транзакции WATCH / MULTI, и обновления
+    одного пользователя, обработанные одновременно (в том числе разными
+    репликами), не теряют поля друг друга. Каждая запись - один конвейер из
+    HSET / HDEL и EXPIRE: ключ брошенного мастера /set_profile удаляется через
+    ttl секунд после последнего шага, а после state.clear() хэш пустеет и
+    исчезает сразу.
+    '''
+
+    def __init__(self, redis: Redis, ttl: int = FSM_TTL, key_builder: KeyBuilder = None):
+        self.redis = redis
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.round_trips = 0
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisFSMStorage":
+        return cls(Redis.from_url(url), **kwargs)
+
+    async def _write(self, redis_key: str, field: str, value: Optional[str]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if value is None:
+                pipe.hdel(redis_key, field)
+            else:
+                pipe.hset(redis_key, field, value)
+                if self.ttl:
+                    pipe.expire(redis_key, self.ttl)
+            self.round_trips += 1
+            await pipe.execute()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._write(self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        redis_key = self.key_builder.build(key)
+        self.round_trips += 1
+        state, data = await self.redis.hmget(redis_key, ("state", "data"))
+        _prefetched.set((redis_key, data))
+        return state.decode() if isinstance(state, bytes) else state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        redis_key = self.key_builder.build(key)
+        value = json.dumps(data, ensure_ascii=False) if data else None
+        await self._write(redis_key, "data", value)
+        prefetched = _prefetched.get()
+        if prefetched is not None and prefetched[0] == redis_key:
+            _prefetched.set((redis_key, value))
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        redis_key = self.key_builder.build(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(redis_key)
+                    current = await pipe.hget(redis_key, "data")
+                    self.round_trips += 2
+                    merged = json.loads(current) if current else {}
+                    merged.update(data)
+                    value = json.dumps(merged, ensure_ascii=False) if merged else None
+                    pipe.multi()
+                    if value is None:
+                        pipe.hdel(redis_key, "data")
+                    else:
+                        pipe.hset(redis_key, "data", value)
+                        if self.ttl:
+                            pipe.expire(redis_key, self.ttl)
+                    self.round_trips += 1
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    # Данные изменились между чтением и записью: повтор с новыми данными.
+                    continue
+        prefetched = _prefetched.get()
+        if prefetched is not None and prefetched[0] == redis_key:
+            _prefetched.set((redis_key, value))
+        return merged.copy()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        redis_key = self.key_builder.build(key)
+        prefetched = _prefetched.get()
+        if prefetched is not None and prefetched[0] == redis_key:
+            value = prefetched[1]
+        else:
+            self.round_trips += 1
+            value = await self.redis.hget(redis_key, "data")
+        return json.loads(value) if value else {}
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def create_fsm_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    '''
+    Создание хранилища FSM по типу из конфигурации: memory или redis.
+    '''
+
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "redis":
+        return RedisFSMStorage.from_url()
+    raise ValueError(f"Неизвестный тип хранилища FSM: {kind}")
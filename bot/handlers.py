@@ -1,19 +1,34 @@
+import asyncio
+from datetime import date
+
 from aiogram import Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from states import Profile
 from aiogram.filters.state import StateFilter
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
-
-from config import logger
-from utils import calc_water_intake, open_weather_api, open_food_fact_api, calc_calories_intake, calc_workout, plot_water_chart, plot_calories_chart
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import logger, FOOD_LOG_MAX_ITEMS, ROLLUP_DAYS, TREND_MAX_POINTS
+from metrics import MetricsMiddleware
+from storage import users, new_profile
+from models import Gender, ActivityType, UserProfile
+from weather_cache import weather_cache
+from city_index import city_index
+from food_cache import food_cache, normalize_product
+from chart_cache import chart_cache
+from events import event_log, WATER, FOOD, WORKOUT
+from resilience import UpstreamUnavailable
+from utils import (
+    calc_water_intake, day_summary, local_day, calc_calories_intake, calc_workout, plot_water_chart,
+    plot_calories_chart, plot_trends_chart, scale_calories, downsample
+)
 
 
 # Роутер обработчиков воды, еды и калорий.
 router = Router()
-
-# Хранилища данных пользователей
-users = {}
+# Метрики числа обновлений, ошибок и задержек по командам.
+router.message.outer_middleware(MetricsMiddleware())
+router.callback_query.outer_middleware(MetricsMiddleware())
 
 
 # Клавиатура для выбора типа активности.
@@ -32,7 +47,7 @@ activity_keyboard = InlineKeyboardMarkup(
 async def send_welcome(message: types.Message):
     """Приветственное сообщение."""
 
-    logger.info(f"/start: пользователь {message.from_user.id} запустил бота.")
+    logger.info("/start: пользователь %s запустил бота.", message.from_user.id)
     await message.reply(
         "\U0001F44B Привет! Я бот, помогающий отслеживать ваш профиль.\n"
         "Используйте /set_profile для настройки профиля.\n"
@@ -44,10 +59,13 @@ async def send_welcome(message: types.Message):
 async def show_help(message: types.Message):
     """Вспомогательная команда."""
 
-    logger.info(f"/help: пользователь {message.from_user.id} вызвал помощь.")
+    logger.info("/help: пользователь %s вызвал помощь.", message.from_user.id)
     await message.reply(
         "\U0001F441 Бот предоставляет следующие команды:\n\n"
-        "1) */set_profile* - настройка профиля, без параметров.\n"
+        "1) */set_profile* - настройка профиля по шагам, без параметров.\n"
+        "Профиль можно заполнить и одним сообщением: */set_profile 70 175 30 м 45 бег Москва -* - "
+        "вес, рост, возраст, пол, минуты активности, тип активности, город и цель калорий "
+        "('-' или без цели - автоматический расчет). Если указаны не все поля, недостающие бот спросит по шагам.\n"
         "Числовые характеристики должны быть положительными, возраст и минуты активности - целыми.\n"
         "Для выбора пола нужно отправить 'м' (мужской) или 'ж' (женский).\n"
         "Команда также подходит для изменения профиля.\n\n"
@@ -57,7 +75,9 @@ async def show_help(message: types.Message):
         "3) */log_food <product_name>, <product_g>* - логирование потребленных калорий.\n" 
         "Указывать продукт product\\_name обязательно, указывать граммовку product\\_g не обязательно.\n"
         "В случае указания граммовки укажите положительное число через запятую.\n"
-        "В случае пропуска параметра граммовки вес будет считаться как 100 г.\n\n"
+        "В случае пропуска параметра граммовки вес будет считаться как 100 г.\n"
+        f"Несколько продуктов (до {FOOD_LOG_MAX_ITEMS}) перечисляются через точку с запятой: "
+        "*/log_food гречка, 150; курица, 200; огурец*.\n\n"
         "4) */log_workout <type> <time>* - логирование тренировки.\n" 
         "Оба параметра обязательно и разделяются пробелом.\n"
         "Доступные типы тренировок type: бег, йога, плавание, силовая (любой регистр).\n"
@@ -70,6 +90,10 @@ async def show_help(message: types.Message):
         "Отсчет по воде и калориям начинается заново, происходит перерасчет нормы воды.\n\n"
         "7) */profile_info* - информация профиля, без параметров.\n" 
         "Команда выводит текущие данные профиля.\n\n"
+        "8) */history <days>* - история активности по дням.\n"
+        f"Количество дней days указывать не обязательно (по умолчанию 7, не более {ROLLUP_DAYS}).\n\n"
+        "9) */trends <week|month>* - графики воды и калорий за неделю или месяц.\n"
+        "Период указывать не обязательно (по умолчанию week).\n\n"
         "\U0001F6D1 ВАЖНО:\n"
         "- разделителем для чисел с плавающей точкой является точка '.';\n"
         "- перед выполнением команд логирования / прогресса заполните профиль!",
@@ -77,48 +101,249 @@ async def show_help(message: types.Message):
     )
 
 
+def parse_weight(text: str) -> float:
+    weight = float(text)
+    if weight <= 0:
+        raise ValueError("Вес должен быть положительным числом.")
+    return weight
+
+
+def parse_height(text: str) -> float:
+    height = float(text)
+    if height <= 0:
+        raise ValueError("Рост должен быть положительным числом.")
+    return height
+
+
+def parse_age(text: str) -> int:
+    age = int(text)
+    if age < 14 or age > 100:
+        raise ValueError("Количество лет невалидно.")
+    return age
+
+
+def parse_gender(text: str) -> str:
+    gender = text.lower()
+    if gender not in ['м', 'ж']:
+        raise ValueError("Введено невалидное значение для пола.")
+    return gender
+
+
+def parse_activity(text: str) -> int:
+    activity_minutes = int(text)
+    if activity_minutes <= 0 or activity_minutes > 1440:
+        raise ValueError("Количество минут невалидно.")
+    return activity_minutes
+
+
+def parse_activity_type(text: str) -> str:
+    try:
+        return str(ActivityType.from_text(text))
+    except KeyError:
+        raise ValueError("Введен невалидный тип активности.") from None
+
+
+def parse_calorie_goal(text: str):
+    """Цель калорий либо None для '-' (автоматический расчет)."""
+
+    if text == '-':
+        return None
+    calorie_goal = float(text)
+    if calorie_goal < 0:
+        raise ValueError("Количесвто калорий не может быть отрицательным числом.")
+    return calorie_goal
+
+
+def resolve_city(text: str) -> str:
+    """Название города из ввода пользователя."""
+
+    city = text.strip()
+    if city == '+':
+        city = 'Москва'
+    # Разные написания одного города сохраняются под единым названием из индекса городов.
+    match = city_index.resolve(city)
+    return match.name if match is not None else city.title()
+
+
+def city_hint(city: str) -> str:
+    """Подсказка похожего города из индекса для города, который не удалось найти."""
+
+    # Похожий город только предлагается: подставлять его молча нельзя, это может быть другой город.
+    match = city_index.suggest(city)
+    return f"\nВозможно, Вы имели в виду город {match.name}?" if match is not None else ""
+
+
+def split_city_goal(words: list) -> tuple:
+    """Город и цель калорий из конца сообщения: цель - последнее слово, если это '-' или число."""
+
+    if len(words) > 1:
+        goal = words[-1]
+        try:
+            if goal != '-':
+                float(goal)
+            return " ".join(words[:-1]), goal
+        except ValueError:
+            pass
+    return " ".join(words), '-'
+
+
+def profile_summary(weight, height, age, gender, activity, activity_type, city, water_goal, calorie_goal) -> str:
+    return (
+        f"\U0001F4CE Ваш профиль:\n"
+        f"Вес: {weight} кг\n"
+        f"Рост: {height} см\n"
+        f"Возраст: {age} лет\n"
+        f"Пол: {'женский' if gender == 'ж' else 'мужской'},\n"
+        f"Уровень активности: {activity} минут в день,\n"
+        f"Предпочтительный тип активности: {activity_type},\n"
+        f"Город: {city},\n"
+        f"Норма воды: {water_goal},\n"
+        f"Цель калорий: {calorie_goal} ккал."
+    )
+
+
+# Поля профиля в начале сообщения /set_profile: поле, шаг мастера, разбор значения и вопрос шага.
+PROFILE_STEPS = (
+    ("weight", Profile.weight, parse_weight, "Введите ваш вес в килограммах:"),
+    ("height", Profile.height, parse_height, "Введите ваш рост в см:"),
+    ("age", Profile.age, parse_age, "Введите ваш возраст в годах:"),
+    ("gender", Profile.gender, parse_gender, "Укажите Ваш пол - мужской (м) или женский (ж):"),
+    ("activity", Profile.activity, parse_activity, "Введите Ваш уровень активности в минутах в день:"),
+    ("activity_type", Profile.activity_type, parse_activity_type, "Выберите наиболее подходящий тип активности:")
+)
+
+
 @router.message(Command('set_profile'))
-async def set_profile(message: types.Message, state: FSMContext):
-    """Начало настройки профиля."""
+async def set_profile(message: types.Message, state: FSMContext, command: CommandObject):
+    """Начало настройки профиля либо профиль из одного сообщения."""
+
+    if command.args:
+        await set_profile_inline(message, state, command.args.split())
+        return
 
     user_id = message.from_user.id
-    logger.info(f"/set_profile: пользователь {user_id} начал настройку профиля.")
-    users[user_id] = {
-        "weight": None,
-        "height": None,
-        "age": None,
-        "gender": None,
-        "activity": None,
-        "activity_type": None,
-        "city": None,
-        "water_goal": None,
-        "calorie_goal": None,
-        "logged_water": 0,
-        "logged_calories": 0,
-        "burned_calories": 0
-    }
+    logger.info("/set_profile: пользователь %s начал настройку профиля.", user_id)
+    await users.set(user_id, new_profile())
 
     await state.set_state(Profile.weight)
     await message.reply("Введите ваш вес в килограммах:")
 
 
+async def set_profile_inline(message: types.Message, state: FSMContext, words: list):
+    """
+    Профиль одним сообщением: /set_profile 70 175 30 м 45 бег Москва -.
+
+    Погода запрашивается одновременно с расчетом цели калорий, профиль
+    записывается один раз. Если поля указаны не все или с ошибкой, верные
+    поля сохраняются и настройка продолжается мастером.
+    """
+
+    user_id = message.from_user.id
+    logger.info("/set_profile: пользователь %s заполняет профиль одним сообщением.", user_id)
+    data = {}
+    for position, (field, _, parse, _) in enumerate(PROFILE_STEPS):
+        if position >= len(words):
+            await continue_profile_wizard(message, state, data)
+            return
+        try:
+            data[field] = parse(words[position])
+        except ValueError as e:
+            logger.error("/set_profile, ошибка ввода поля %s: %s", field, e)
+            await continue_profile_wizard(message, state, data, f"Значение '{words[position]}' не подходит.")
+            return
+
+    city, goal = split_city_goal(words[len(PROFILE_STEPS):])
+    if not city:
+        await continue_profile_wizard(message, state, data)
+        return
+    try:
+        calorie_goal = parse_calorie_goal(goal)
+    except ValueError as e:
+        logger.error("/set_profile, ошибка ввода цели по калориям: %s", e)
+        await continue_profile_wizard(message, state, data, "Введено невалидное значение для калорий.")
+        return
+
+    city = resolve_city(city)
+    # Погода запрашивается, пока считается цель калорий.
+    weather_task = asyncio.ensure_future(weather_cache.get_info(city))
+    if calorie_goal is None:
+        calorie_goal = calc_calories_intake(
+            data['weight'], data['height'], data['gender'], data['age'], data['activity'], data['activity_type']
+        )
+    try:
+        weather = await weather_task
+    except UpstreamUnavailable as e:
+        logger.error("/set_profile, сервис погоды недоступен: %s", e)
+        await continue_profile_wizard(
+            message, state, data, "\U000026A0 Сервис погоды временно недоступен, отправьте город еще раз через минуту."
+        )
+        return
+    except ValueError as e:
+        logger.error("/set_profile, ошибка ввода города: %s", e)
+        await continue_profile_wizard(
+            message, state, data,
+            "Введен невалидный город, попробуйте снова. Отправьте '+', чтобы выбрать город по умолчанию - Москва."
+            + city_hint(city)
+        )
+        return
+
+    water_goal = calc_water_intake(data['weight'], data['activity'], weather.temp)
+    await users.set(user_id, UserProfile(
+        data['weight'], data['height'], data['age'], Gender.from_text(data['gender']), data['activity'],
+        ActivityType.from_text(data['activity_type']), city, water_goal, calorie_goal,
+        tz_offset=weather.tz_offset, day=local_day(weather.tz_offset)
+    ))
+    # Сброс незавершенного мастера, если он был начат раньше.
+    await state.clear()
+    logger.info("/set_profile: пользователь %s заполнил профиль одним сообщением.", user_id)
+    await message.reply(
+        f"На текущий момент в городе {city} {weather.temp} градусов Цельсия.\n\n" + profile_summary(
+            data['weight'], data['height'], data['age'], data['gender'], data['activity'], data['activity_type'],
+            city, water_goal, calorie_goal
+        )
+    )
+
+
+async def continue_profile_wizard(message: types.Message, state: FSMContext, data: dict, error: str = None):
+    """Продолжение настройки мастером с первого незаполненного поля, заполненные поля сохраняются."""
+
+    user_id = message.from_user.id
+    profile = new_profile()
+    for field, value in data.items():
+        if field == 'gender':
+            value = Gender.from_text(value)
+        elif field == 'activity_type':
+            value = ActivityType.from_text(value)
+        setattr(profile, field, value)
+    await users.set(user_id, profile)
+    await state.set_data(data)
+
+    step, prompt, keyboard = Profile.city, "Введите ваш город для получения температуры:", None
+    for field, field_step, _, field_prompt in PROFILE_STEPS:
+        if field not in data:
+            step, prompt = field_step, field_prompt
+            keyboard = activity_keyboard if field == 'activity_type' else None
+            break
+    await state.set_state(step)
+    logger.info("/set_profile: пользователь %s продолжает настройку с шага %s.", user_id, step.state)
+    await message.reply(f"{error}\n{prompt}" if error else prompt, reply_markup=keyboard)
+
+
 @router.message(Profile.weight)
 async def process_weight(message: types.Message, state: FSMContext):
     """Обработка введенного веса."""
 
     try:
-        weight = float(message.text)
-        if weight <= 0:
-            raise ValueError("Вес должен быть положительным числом.")
+        weight = parse_weight(message.text)
         user_id = message.from_user.id
-        users[user_id]['weight'] = weight
+        await users.update(user_id, weight=weight)
 
         await state.update_data(weight=weight)
-        logger.info(f"/set_profile: пользователь {user_id} ввел вес.")
+        logger.info("/set_profile: пользователь %s ввел вес.", user_id)
         await state.set_state(Profile.height)
         await message.reply("Введите ваш рост в см:")
     except ValueError as e:
-        logger.error(f"/set_profile, ошибка ввода веса: {e}")
+        logger.error("/set_profile, ошибка ввода веса: %s", e)
         await message.reply("Пожалуйста, введите положительное число.")
 
 
@@ -127,18 +352,16 @@ async def process_height(message: types.Message, state: FSMContext):
     """Обработка введенного роста."""
 
     try:
-        height = float(message.text)
-        if height <= 0:
-            raise ValueError("Рост должен быть положительным числом.")
+        height = parse_height(message.text)
         user_id = message.from_user.id
-        users[user_id]['height'] = height
+        await users.update(user_id, height=height)
 
         await state.update_data(height=height)
-        logger.info(f"/set_profile: пользователь {user_id} ввел рост.")
+        logger.info("/set_profile: пользователь %s ввел рост.", user_id)
         await state.set_state(Profile.age)
         await message.reply("Введите ваш возраст в годах:")
     except ValueError as e:
-        logger.error(f"/set_profile, ошибка ввода роста: {e}")
+        logger.error("/set_profile, ошибка ввода роста: %s", e)
         await message.reply("Пожалуйста, введите положительное число.")
 
 
@@ -147,18 +370,16 @@ async def process_age(message: types.Message, state: FSMContext):
     """Обработка введенного возраста."""
 
     try:
-        age = int(message.text)
-        if age < 14 or age > 100:
-            raise ValueError("Количество лет невалидно.")
+        age = parse_age(message.text)
         user_id = message.from_user.id
-        users[user_id]['age'] = age
+        await users.update(user_id, age=age)
 
         await state.update_data(age=age)
-        logger.info(f"/set_profile: пользователь {user_id} ввел возраст.")
+        logger.info("/set_profile: пользователь %s ввел возраст.", user_id)
         await state.set_state(Profile.gender)
         await message.reply("Укажите Ваш пол - мужской (м) или женский (ж):")
     except ValueError as e:
-        logger.error(f"/set_profile, ошибка ввода возраста: {e}")
+        logger.error("/set_profile, ошибка ввода возраста: %s", e)
         await message.reply("Пожалуйста, введите полное количество лет (от 14 до 100).")
 
 
@@ -167,18 +388,16 @@ async def process_gender(message: types.Message, state: FSMContext):
     """Обработка введенного пола."""
 
     try:
-        gender = message.text.lower()
-        if gender not in ['м', 'ж']:
-            raise ValueError("Введено невалидное значение для пола.")
+        gender = parse_gender(message.text)
         user_id = message.from_user.id
-        users[user_id]['gender'] = gender
+        await users.update(user_id, gender=Gender.from_text(gender))
 
         await state.update_data(gender=gender)
-        logger.info(f"/set_profile: пользователь {user_id} ввел пол.")
+        logger.info("/set_profile: пользователь %s ввел пол.", user_id)
         await state.set_state(Profile.activity)
         await message.reply("Введите Ваш уровень активности в минутах в день:")
     except ValueError as e:
-        logger.error(f"/set_profile, ошибка ввода пола: {e}")
+        logger.error("/set_profile, ошибка ввода пола: %s", e)
         await message.reply("Пожалуйста, введите пол в формате 'м' или 'ж'.")
 
 
@@ -187,18 +406,15 @@ async def process_activity(message: types.Message, state: FSMContext):
     """Обработка введенного уровня активности в минутах."""
 
     try:
-        activity_minutes = int(message.text)
-        if activity_minutes <= 0 or activity_minutes > 1440:
-            raise ValueError("Количество минут невалидно.")
+        activity_minutes = parse_activity(message.text)
         user_id = message.from_user.id
-        users[user_id]['activity'] = activity_minutes
-
+        await users.update(user_id, activity=activity_minutes)
         await state.update_data(activity=activity_minutes)
-        logger.info(f"/set_profile: пользователь {user_id} ввел дневную активность.")
+        logger.info("/set_profile: пользователь %s ввел дневную активность.", user_id)
         await state.set_state(Profile.activity_type)
         await message.reply(f"Выберите наиболее подходящий тип активности:", reply_markup=activity_keyboard)
     except ValueError as e:
-        logger.error(f"/set_profile, ошибка ввода активности: {e}")
+        logger.error("/set_profile, ошибка ввода активности: %s", e)
         await message.reply("Пожалуйста, введите целое валидное значение минут в день (от 1 до 1440).")
 
 
@@ -217,15 +433,15 @@ async def process_activity_type(callback_query: types.CallbackQuery, state: FSMC
         activity_type = activity_type_mapping.get(callback_query.data)
         
         if not activity_type:
-            logger.error(f"/set_profile, ошибка выбора типа активности.")
+            logger.error("/set_profile, ошибка выбора типа активности.")
             await callback_query.answer("Неверный выбор, попробуйте снова:", show_alert=True)
             return
         
         user_id = callback_query.from_user.id
-        users[user_id]['activity_type'] = activity_type
+        await users.update(user_id, activity_type=ActivityType.from_text(activity_type))
 
         await state.update_data(activity_type=activity_type)
-        logger.info(f"/set_profile: пользователь {user_id} выбрал тип активности.")
+        logger.info("/set_profile: пользователь %s выбрал тип активности.", user_id)
         await state.set_state(Profile.city)
         await callback_query.message.answer(
             f"Вы выбрали {activity_type}.\n"
@@ -233,7 +449,7 @@ async def process_activity_type(callback_query: types.CallbackQuery, state: FSMC
         )
         await callback_query.answer()
     except Exception as e:
-        logger.error(f"/set_profile, ошибка выбора типа активности: {e}")
+        logger.error("/set_profile, ошибка выбора типа активности: %s", e)
         await callback_query.message.answer("Возникли проблемы в работе бота, попробуйте позже.")
 
 
@@ -242,11 +458,9 @@ async def process_city(message: types.Message, state: FSMContext):
     """Обработка введенного города."""
     
     try:
-        city = message.text.title()
-        if city == '+':
-            city = 'Москва'
+        city = resolve_city(message.text)
         user_id = message.from_user.id
-        users[user_id]['city'] = city
+        await users.update(user_id, city=city)
 
         await state.update_data(city=city)
 
@@ -255,22 +469,33 @@ async def process_city(message: types.Message, state: FSMContext):
         weight = data.get('weight')
         activity = data.get('activity')
         # Расчет температуры и нормы воды.
-        temperature =  await open_weather_api(city) if city else 20
+        weather = await weather_cache.get_info(city)
+        temperature = weather.temp
         water_goal = calc_water_intake(weight, activity, temperature)
-        users[user_id]['water_goal'] = water_goal
-        logger.info(f"/set_profile: пользователь {user_id} ввел город. Рассчитана дневная норма воды.")
+        # Часовой пояс города нужен для автоматической смены дня в полночь.
+        await users.update(
+            user_id, water_goal=water_goal, tz_offset=weather.tz_offset,
+            day=local_day(weather.tz_offset)
+        )
+        logger.info("/set_profile: пользователь %s ввел город. Рассчитана дневная норма воды.", user_id)
 
         await state.set_state(Profile.calorie_goal)
         await message.reply(
             f"На текущий момент в городе {city} {temperature} градусов Цельсия.\n"
             "Введите вашу дневную цель калорий (или отправьте '-' для автоматического расчета):"
         )
+    except UpstreamUnavailable as e:
+        logger.error("/set_profile, сервис погоды недоступен: %s", e)
+        await message.reply(
+            "\U000026A0 Сервис погоды временно недоступен, рассчитать норму воды сейчас не получится.\n"
+            "Отправьте город еще раз через минуту."
+        )
     except ValueError as e:
-        logger.error(f"/set_profile, ошибка ввода города: {e}")
+        logger.error("/set_profile, ошибка ввода города: %s", e)
         await message.reply(
             "Введен невалидный город, попробуйте снова.\n"
             "Если Вы уверены, что верно ввели название города - отправьте '+'. "
-            "В таком случае будет присвоен город по умолчанию - Москва."
+            "В таком случае будет присвоен город по умолчанию - Москва." + city_hint(message.text)
         )
 
 
@@ -278,7 +503,6 @@ async def process_city(message: types.Message, state: FSMContext):
 async def process_calorie_goal(message: types.Message, state: FSMContext):
     """Обработка цели калорий."""
 
-    calorie_goal_str = message.text.strip()
     data = await state.get_data()
     weight = data['weight']
     height = data['height']
@@ -287,42 +511,28 @@ async def process_calorie_goal(message: types.Message, state: FSMContext):
     activity = data['activity']
     activity_type = data['activity_type']
 
+    try:
+        calorie_goal = parse_calorie_goal(message.text.strip())
+    except ValueError as e:
+        logger.error("/set_profile, ошибка ввода цели по калориям: %s", e)
+        await message.reply("Введено невалидное значение для калорий, пожалуйста, повторите.")
+        return
     # Автоматический расчет нормы калорий.
-    if calorie_goal_str == '-':
+    if calorie_goal is None:
         calorie_goal = calc_calories_intake(weight, height, gender, age, activity, activity_type)
-    # Введенная пользователем цель.
-    else:
-        try:
-            calorie_goal = float(calorie_goal_str)
-            if calorie_goal < 0:
-                raise ValueError("Количесвто калорий не может быть отрицательным числом.")
-        except ValueError as e:
-            logger.error(f"/set_profile, ошибка ввода цели по калориям: {e}")
-            await message.reply("Введено невалидное значение для калорий, пожалуйста, повторите.")
-            return
 
     user_id = message.from_user.id
-    users[user_id]['calorie_goal'] = calorie_goal
+    await users.update(user_id, calorie_goal=calorie_goal)
     await state.update_data(calorie_goal=calorie_goal)
-    logger.info(f"/set_profile: пользователь {user_id} ввел цель по калориям.")
+    logger.info("/set_profile: пользователь %s ввел цель по калориям.", user_id)
 
     city = data['city']
-    water_goal = users[user_id]['water_goal']
+    water_goal = (await users.get(user_id)).water_goal
 
     # Ответ с заполненным профилем пользователя
-    summary = (
-        f"\U0001F4CE Ваш профиль:\n"
-        f"Вес: {weight} кг\n"
-        f"Рост: {height} см\n"
-        f"Возраст: {age} лет\n"
-        f"Пол: {'женский' if gender == 'ж' else 'мужской'},\n"
-        f"Уровень активности: {activity} минут в день,\n"
-        f"Предпочтительный тип активности: {activity_type},\n"
-        f"Город: {city},\n"
-        f"Норма воды: {water_goal},\n"
-        f"Цель калорий: {calorie_goal} ккал."
-    )
-    await message.reply(summary)
+    await message.reply(profile_summary(
+        weight, height, age, gender, activity, activity_type, city, water_goal, calorie_goal
+    ))
     await state.clear()
 
 
@@ -331,15 +541,16 @@ async def log_water(message: types.Message):
     """Обработка команды логирования воды."""
 
     user_id = message.from_user.id
-    logger.info(f"/log_water: пользователь {user_id} вызвал логирование воды.")
-    if user_id not in users:
-        logger.warning(f"/log_water: пользователь {user_id} еще не настроил профиль.")
+    logger.info("/log_water: пользователь %s вызвал логирование воды.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/log_water: пользователь %s еще не настроил профиль.", user_id)
         await message.answer("Пожалуйста, настройте профиль с помощью команды /set_profile.")
         return
     
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        logger.warning(f"/log_water: пользователь {user_id} не указал параметры.")
+        logger.warning("/log_water: пользователь %s не указал параметры.", user_id)
         await message.reply("Пожалуйста, укажите кол-во воды в мл. Например: /log_water 200")
         return
     
@@ -349,63 +560,112 @@ async def log_water(message: types.Message):
             raise ValueError("Количество должно быть положительным числом.")
 
         # Обновление логов воды
-        users[user_id]['logged_water'] += amount
+        logged_water = await users.incr(user_id, 'logged_water', amount)
+        event_log.append(user_id, WATER, amount, tz_offset=user_data.tz_offset)
         # Остаток до дневной нормы
-        remains = max(0, users[user_id]['water_goal'] - users[user_id]['logged_water'])
+        remains = max(0, user_data.water_goal - logged_water)
 
         await message.reply(
             f"\U0001F4A7 Вы выпили {amount} мл воды;\n"
-            f"Всего за день выпито: {users[user_id]['logged_water']} мл;\n"
+            f"Всего за день выпито: {logged_water} мл;\n"
             f"Осталось до выполнения дневной нормы: {remains:.2f} мл."
         )
     except ValueError as e:
-        logger.error(f"/log_water, ошибка логирования воды: {e}")
+        logger.error("/log_water, ошибка логирования воды: %s", e)
         await message.reply("Пожалуйста, укажите количество воды в виде одного положительного числа.")
 
 
+def parse_food_items(text: str) -> list:
+    """Разбор продуктов команды /log_food: '<продукт>, <г>; <продукт>; ...' -> [(продукт, г)]."""
+
+    items = []
+    for item in text.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        product_data = item.rsplit(sep=', ', maxsplit=1)
+        product_name = product_data[0].strip().lower()
+        if not product_name:
+            raise ValueError("Не указано название продукта.")
+
+        # Указана ли граммовка
+        if len(product_data) == 1:
+            product_weight = 100.0
+        else:
+            product_weight = float(product_data[1])
+            if product_weight <= 0:
+                raise ValueError("Граммовка должна быть положительным числом.")
+        items.append((product_name, product_weight))
+
+    if not items:
+        raise ValueError("Не указано ни одного продукта.")
+    if len(items) > FOOD_LOG_MAX_ITEMS:
+        raise ValueError(f"Продуктов больше {FOOD_LOG_MAX_ITEMS}.")
+    return items
+
+
 @router.message(Command('log_food'))
-async def log_water(message: types.Message):
+async def log_food(message: types.Message):
     """Обработка команды логирования еды."""
 
     user_id = message.from_user.id
-    logger.info(f"/log_food: пользователь {user_id} вызвал логирование еды.")
-    if user_id not in users:
-        logger.warning(f"/log_food: пользователь {user_id} еще не настроил профиль.")
+    logger.info("/log_food: пользователь %s вызвал логирование еды.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/log_food: пользователь %s еще не настроил профиль.", user_id)
         await message.answer("Пожалуйста, настройте профиль с помощью команды /set_profile.")
         return
     
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        logger.warning(f"/log_food: пользователь {user_id} не указал параметры.")
+        logger.warning("/log_food: пользователь %s не указал параметры.", user_id)
         await message.reply(
             "Пожалуйста, укажите продукт и граммовку через запятую при необходимости. "
-            "Например: /log_food банан, 120"
+            "Например: /log_food банан, 120\n"
+            "Несколько продуктов разделяются точкой с запятой: /log_food гречка, 150; курица, 200"
         )
         return
     
     try:
-        product_data = args[1].rsplit(sep=', ', maxsplit=1)
-        product_name = product_data[0].lower()
-
-        # Указана ли граммовка
-        if len(product_data) == 1:
-            product_weight = 100.0
+        # Все продукты проверяются до запросов: при ошибке в одном не записывается ни один.
+        items = parse_food_items(args[1])
+
+        # Калорийность на 100 г через кэш продуктов и API, повторы запрашиваются один раз.
+        calories_100 = await food_cache.get_calories_100_many(name for name, _ in items)
+        calories = [
+            scale_calories(calories_100[normalize_product(name)], weight) for name, weight in items
+        ]
+
+        # Запись одним увеличением счетчика: продукты сообщения попадают в дневной итог вместе.
+        logged_calories = await users.incr(user_id, 'logged_calories', round(sum(calories), 2))
+        for (product_name, product_weight), product_calories in zip(items, calories):
+            event_log.append(user_id, FOOD, product_weight, product_calories, product_name, user_data.tz_offset)
+
+        if len(items) == 1:
+            (product_name, product_weight), product_calories = items[0], calories[0]
+            await message.reply(
+                f"\U0001F355 Продукт: {product_name}, вес: {product_weight} г, калорий: {product_calories:.2f};\n"
+                f"Всего потреблено за день: {logged_calories:.2f} ккал."
+            )
         else:
-            product_weight = float(product_data[1])
-            if product_weight <= 0:
-                raise ValueError("Граммовка должна быть положительным числом.")
-        
-        # Количество калорий через API.
-        calories = await open_food_fact_api(product_name, product_weight)
-        users[user_id]['logged_calories'] += calories
-
+            lines = [
+                f"{number}) {product_name}, вес: {product_weight} г, калорий: {product_calories:.2f};"
+                for number, ((product_name, product_weight), product_calories) in enumerate(zip(items, calories), 1)
+            ]
+            await message.reply(
+                "\U0001F355 Продукты:\n" + "\n".join(lines) + "\n"
+                f"Итого за прием: {sum(calories):.2f} ккал;\n"
+                f"Всего потреблено за день: {logged_calories:.2f} ккал."
+            )
+
+    except UpstreamUnavailable as e:
+        logger.error("/log_food, сервис продуктов недоступен: %s", e)
         await message.reply(
-            f"\U0001F355 Продукт: {product_name}, вес: {product_weight} г, калорий: {calories:.2f};\n"
-            f"Всего потреблено за день: {users[user_id]['logged_calories']:.2f} ккал."
+            "\U000026A0 Сервис Open Food Facts временно недоступен, калории не записаны.\n"
+            "Попробуйте повторить команду позже."
         )
-
     except (IndexError, ValueError) as e:
-        logger.error(f"/log_food, ошибка логирования еды: {e}")
+        logger.error("/log_food, ошибка логирования еды: %s", e)
         await message.reply("Указаны невалидные параметры для команды, обратитесь к помощи /help.")
 
 
@@ -414,15 +674,16 @@ async def log_workout(message: types.Message):
     """Обработка команды логирования тренировки."""
 
     user_id = message.from_user.id
-    logger.info(f"/log_workout: пользователь {user_id} вызвал логирование тренировки.")
-    if user_id not in users:
-        logger.warning(f"/log_workout: пользователь {user_id} еще не настроил профиль.")
+    logger.info("/log_workout: пользователь %s вызвал логирование тренировки.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/log_workout: пользователь %s еще не настроил профиль.", user_id)
         await message.answer("Пожалуйста, настройте профиль с помощью команды /set_profile.")
         return
     
     args = message.text.split(maxsplit=2)
     if len(args) < 3:
-        logger.warning(f"/log_workout: пользователь {user_id} не указал параметры.")
+        logger.warning("/log_workout: пользователь %s не указал параметры.", user_id)
         await message.reply("Пожалуйста, укажите тип тренировки и время (в минутах). Например: /log_workout бег 30")
         return
 
@@ -434,7 +695,7 @@ async def log_workout(message: types.Message):
             raise ValueError("Время должно быть положительным целым числом минут.")
         
         if workout_type not in ['бег', 'йога', 'плавание', 'силовая']:
-            logger.warning(f"/log_workout: пользователь {user_id} указал невалидный тип активности.")
+            logger.warning("/log_workout: пользователь %s указал невалидный тип активности.", user_id)
             await message.reply("Неизвестный тип тренировки. Доступные варианты: бег, йога, плавание, силовая.")
             return
 
@@ -442,17 +703,18 @@ async def log_workout(message: types.Message):
         calories, water_opt = calc_workout(workout_type, workout_time)
 
         # Логируем данные о сожженных калориях. 
-        users[user_id]['burned_calories'] += calories
-        users[user_id]['water_goal'] += water_opt
+        await users.incr(user_id, 'burned_calories', calories)
+        water_goal = await users.incr(user_id, 'water_goal', water_opt)
+        event_log.append(user_id, WORKOUT, workout_time, calories, workout_type, user_data.tz_offset)
 
         await message.reply(
             f"\U0001F3CB {workout_type.capitalize()} {workout_time} минут — сожжено {calories} ккал.\n"
-            f"Дневная норма воды с учетом тренировки: {users[user_id]['water_goal']},\n"
+            f"Дневная норма воды с учетом тренировки: {water_goal},\n"
             f"Дополнительно выпейте {water_opt} мл воды."
         )
 
     except (IndexError, ValueError) as e:
-        logger.error(f"/log_workout, ошибка логирования тренировки: {e}")
+        logger.error("/log_workout, ошибка логирования тренировки: %s", e)
         await message.reply("Указаны невалидные параметры для команды, обратитесь к помощи /help.")
 
 
@@ -461,30 +723,30 @@ async def check_progress(message: types.Message):
     """Обработка команды вывода прогресса."""
 
     user_id = message.from_user.id
-    logger.info(f"/check_progress: пользователь {user_id} просматривает прогресс.")
-    if user_id not in users:
-        logger.warning(f"/check_progress: пользователь {user_id} еще не настроил профиль.")
+    logger.info("/check_progress: пользователь %s просматривает прогресс.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/check_progress: пользователь %s еще не настроил профиль.", user_id)
         await message.reply("Пожалуйста, сначала настройте профиль через команду /set_profile.")
         return 
     
-    user_data = users[user_id]
-    
     try:
         # Данные по воде.
-        water_log = user_data['logged_water']
-        water_goal = user_data['water_goal']
+        water_log = user_data.logged_water
+        water_goal = user_data.water_goal
         water_remain = max(0, water_goal - water_log)
-        water_chart = plot_water_chart(water_log, water_remain)
-        water_file = BufferedInputFile(water_chart.getvalue(), filename="water_progress.png")
 
         # Данные по калориям.
-        calorie_goal = user_data['calorie_goal']
-        calorie_log = user_data['logged_calories']
-        calorie_burned = user_data['burned_calories']
+        calorie_goal = user_data.calorie_goal
+        calorie_log = user_data.logged_calories
+        calorie_burned = user_data.burned_calories
         calorie_balance = calorie_log - calorie_burned
-        calorie_chart = plot_calories_chart(calorie_goal, calorie_log, calorie_burned)
-        calorie_file = BufferedInputFile(calorie_chart.getvalue(), filename="calorie_progress.png")
 
+        # Графики строятся до ответа, чтобы ошибка рендеринга не оставила ответ без графиков.
+        water_chart, calories_chart = await asyncio.gather(
+            chart_cache.prepare(plot_water_chart, (water_log, water_remain)),
+            chart_cache.prepare(plot_calories_chart, (calorie_goal, calorie_log, calorie_burned))
+        )
         await message.reply(
             f"\U0001F4CA Ваш текущий прогресс:\n"
             f"\U0001F4A7 Вода:\n"
@@ -496,10 +758,11 @@ async def check_progress(message: types.Message):
             f"- Баланс: {calorie_balance}."
         )
 
-        await message.answer_photo(photo=water_file, caption="Прогресс потребления воды")
-        await message.answer_photo(photo=calorie_file, caption="Прогресс по калориям")
+        # Графики из кэша: повторно отправляется file_id без рендеринга и загрузки.
+        await chart_cache.send(message, water_chart, filename="water_progress.png", caption="Прогресс потребления воды")
+        await chart_cache.send(message, calories_chart, filename="calorie_progress.png", caption="Прогресс по калориям")
     except Exception as e:
-        logger.error(f"/check_progress, ошибка просмотра прогресса: {e}")
+        logger.error("/check_progress, ошибка просмотра прогресса: %s", e)
         await message.reply("Возникли проблемы в работе бота, попробуйте позже.")
 
 
@@ -508,56 +771,38 @@ async def fix_new_day(message: types.Message):
     """Обработка команды фиксирования нового дня."""
     
     user_id = message.from_user.id
-    logger.info(f"/new_day: пользователь {user_id} вызвал обнуление текущего дня.")
-    if user_id not in users:
-        logger.warning(f"/new_day: пользователь {user_id} еще не настроил профиль.")
+    logger.info("/new_day: пользователь %s вызвал обнуление текущего дня.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/new_day: пользователь %s еще не настроил профиль.", user_id)
         await message.reply("Пожалуйста, сначала настройте профиль через команду /set_profile.")
         return
     
     try:
-        # Предыдущие значения.
-        user_data = users[user_id]
-        
-        water_log = user_data['logged_water']
-        water_goal = user_data['water_goal']
-        water_remain = max(0, water_goal - water_log)
-        if water_remain == 0:
-            water_str = f"Дневная норма воды в {water_goal} мл выполнена,\n"
-        else:
-            water_str = f"Дневная норма воды не выполнена, недобор в {water_remain} мл,\n"
-
-        calorie_log = user_data['logged_calories']
-        calorie_burned = user_data['burned_calories']
-        calorie_balance = calorie_log - calorie_burned
-        if calorie_balance > 0:
-            cal_str = f"Баланс калорий положительный ({calorie_balance} ккал), ожидаем набор веса."
-        elif calorie_balance < 0:
-            cal_str = f"Баланс калорий отрицательный ({calorie_balance} ккал), ожидаема потеря веса."
-        else:
-            cal_str = f"Нейтральный баланс калорий, ожидаем стабильный вес."
-
-        prev_day_stat = f"\U0001F519 Статистика за предыдущий день:\n" + water_str + cal_str
-        
-        await message.reply(prev_day_stat)
-
-        # Обнуление логов по воде и калориям.
-        users[user_id]['logged_water'] = 0
-        users[user_id]['logged_calories'] = 0
-        users[user_id]['burned_calories'] = 0
+        # Обнуление логов по воде и калориям до запроса погоды: сброс не зависит
+        # от ее доступности, а итоги берутся из профиля в момент сброса.
+        previous = await users.reset_day(user_id, local_day(user_data.tz_offset))
+        await message.reply(day_summary(previous or user_data))
 
         # Пересчет нормы воды.
-        city = users[user_id]['city']
-        weight = users[user_id]['weight']
-        activity = users[user_id]['activity']
-        temperature =  await open_weather_api(city) if city else 20
+        city = user_data.city
+        weight = user_data.weight
+        activity = user_data.activity
+        try:
+            temperature = await weather_cache.get(city) if city else 20
+        except (UpstreamUnavailable, ValueError) as e:
+            # Без погоды норма считается для 20 градусов, как при автоматической смене дня.
+            logger.warning("/new_day: нет погоды для города %s, используется 20 градусов: %s", city, e)
+            temperature = 20
         water_goal = calc_water_intake(weight, activity, temperature)
+        await users.update(user_id, water_goal=water_goal)
 
         await message.answer(
             f"\U0001F51C Прогресс на новый день успешно сброшен!\n"
             f"Текущая норма воды для города {city} ({temperature}) - {water_goal} мл в день.\n"
         )
     except Exception as e:
-        logger.error(f"/new_day, ошибка сброса предыдущего дня: {e}")
+        logger.error("/new_day, ошибка сброса предыдущего дня: %s", e)
         await message.reply("Возникли проблемы в работе бота, попробуйте позже.")
 
 
@@ -566,22 +811,117 @@ async def get_profile_info(message: types.Message):
     """Обработка запроса получения информации о профиле."""
 
     user_id = message.from_user.id
-    logger.info(f"/profile_info: пользователь {user_id} просматривает профиль.")
-    if user_id not in users:
-        logger.warning(f"/profile_info: пользователь {user_id} еще не настроил профиль.")
+    logger.info("/profile_info: пользователь %s просматривает профиль.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/profile_info: пользователь %s еще не настроил профиль.", user_id)
         await message.reply("Пожалуйста, сначала настройте профиль через команду /set_profile.")
         return
  
-    user_data = users[user_id]
     await message.reply(
         f"\U0001F4CC Текущая информация в Вашем профиле:\n"
-        f"Вес: {user_data['weight']} кг,\n"
-        f"Рост: {user_data['height']} см,\n"
-        f"Возраст: {user_data['age']} лет,\n"
-        f"Пол: {'женский' if user_data['gender'] == 'ж' else 'мужской'},\n"
-        f"Активность: {user_data['activity']} минут в день,\n"
-        f"Тип активности: {user_data['activity_type']},\n"
-        f"Город: {user_data['city']},\n"
-        f"Норма воды: {user_data['water_goal']} мл в день,\n"
-        f"Цель калорий: {user_data['calorie_goal']} ккал в день."
+        f"Вес: {user_data.weight} кг,\n"
+        f"Рост: {user_data.height} см,\n"
+        f"Возраст: {user_data.age} лет,\n"
+        f"Пол: {'женский' if user_data.gender is Gender.FEMALE else 'мужской'},\n"
+        f"Активность: {user_data.activity} минут в день,\n"
+        f"Тип активности: {user_data.activity_type},\n"
+        f"Город: {user_data.city},\n"
+        f"Норма воды: {user_data.water_goal} мл в день,\n"
+        f"Цель калорий: {user_data.calorie_goal} ккал в день."
+    )
+
+
+@router.message(Command("history"))
+async def show_history(message: types.Message):
+    """Обработка команды просмотра истории активности."""
+
+    user_id = message.from_user.id
+    logger.info("/history: пользователь %s просматривает историю.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/history: пользователь %s еще не настроил профиль.", user_id)
+        await message.reply("Пожалуйста, сначала настройте профиль через команду /set_profile.")
+        return
+
+    args = message.text.split(maxsplit=1)
+    try:
+        days = int(args[1]) if len(args) > 1 else 7
+        if days <= 0 or days > ROLLUP_DAYS:
+            raise ValueError(f"Количество дней должно быть от 1 до {ROLLUP_DAYS}.")
+    except ValueError as e:
+        logger.error("/history, ошибка ввода количества дней: %s", e)
+        await message.reply(f"Пожалуйста, укажите целое количество дней от 1 до {ROLLUP_DAYS}. Например: /history 7")
+        return
+
+    lines = []
+    totals = [0.0, 0.0, 0.0]
+    # Дневные агрегаты ведутся по мере логирования, история строится за O(days).
+    # Дни считаются по местному времени пользователя, как и сброс счетчиков.
+    today = date.fromordinal(local_day(user_data.tz_offset))
+    await event_log.load_rollups(user_id)
+    for day, day_totals in event_log.rollups.last_days(user_id, days, today):
+        if day_totals is None:
+            lines.append(f"{day:%d.%m}: нет записей")
+            continue
+        water, consumed, burned, _ = day_totals
+        totals[0] += water
+        totals[1] += consumed
+        totals[2] += burned
+        lines.append(f"{day:%d.%m}: вода {water:.0f} мл, потреблено {consumed:.0f} ккал, сожжено {burned:.0f} ккал")
+
+    await message.reply(
+        f"\U0001F4C5 История за {days} дн.:\n" + "\n".join(lines) + "\n\n"
+        f"Итого: вода {totals[0]:.0f} мл, потреблено {totals[1]:.0f} ккал, "
+        f"сожжено {totals[2]:.0f} ккал, баланс {totals[1] - totals[2]:.0f} ккал."
     )
+
+
+# Периоды команды /trends в днях.
+TREND_PERIODS = {"week": 7, "неделя": 7, "month": 30, "месяц": 30}
+
+
+@router.message(Command("trends"))
+async def show_trends(message: types.Message):
+    """Обработка команды просмотра трендов за неделю или месяц."""
+
+    user_id = message.from_user.id
+    logger.info("/trends: пользователь %s просматривает тренды.", user_id)
+    user_data = await users.get(user_id)
+    if user_data is None:
+        logger.warning("/trends: пользователь %s еще не настроил профиль.", user_id)
+        await message.reply("Пожалуйста, сначала настройте профиль через команду /set_profile.")
+        return
+
+    args = message.text.split(maxsplit=1)
+    period = args[1].strip().lower() if len(args) > 1 else "week"
+    days = TREND_PERIODS.get(period)
+    if days is None:
+        logger.warning("/trends: пользователь %s указал неизвестный период %s.", user_id, period)
+        await message.reply("Пожалуйста, укажите период week или month. Например: /trends month")
+        return
+
+    try:
+        # Ряды из кольцевого буфера дневных агрегатов за O(days), без чтения журнала.
+        today = date.fromordinal(local_day(user_data.tz_offset))
+        await event_log.load_rollups(user_id)
+        rows = event_log.rollups.series(user_id, days, today)
+        if not any(any(row) for row in rows):
+            await message.reply(f"\U0001F4C8 За последние {days} дн. нет записей.")
+            return
+        water, consumed, burned = (sum(row[column] for row in rows) / days for column in range(3))
+        # Длинные периоды усредняются по группам дней, чтобы график оставался читаемым.
+        bucket, points = downsample([row[:3] for row in rows], TREND_MAX_POINTS)
+        # График строится до ответа, чтобы ошибка рендеринга не оставила ответ без графика.
+        chart = await chart_cache.prepare(plot_trends_chart, (today.toordinal() - days + 1, bucket, *points.T.ravel()))
+        await message.reply(
+            f"\U0001F4C8 Тренды за {days} дн., в среднем за день:\n"
+            f"- вода: {water:.0f} мл,\n"
+            f"- потреблено: {consumed:.0f} ккал,\n"
+            f"- сожжено: {burned:.0f} ккал,\n"
+            f"- баланс: {consumed - burned:.0f} ккал."
+        )
+        await chart_cache.send(message, chart, filename="trends.png", caption=f"Тренды за {days} дн.")
+    except Exception as e:
+        logger.error("/trends, ошибка построения трендов: %s", e)
+        await message.reply("Возникли проблемы в работе бота, попробуйте позже.")
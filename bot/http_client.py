@@ -0,0 +1,68 @@
+import aiohttp
+
+from config import (
+    HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_TOTAL_TIMEOUT
+)
+
+
+class HttpClient:
+    '''
+    Общий HTTP-клиент для внешних API с пулом соединений.
+
+    Создается один раз на жизненный цикл бота: соединения переиспользуются
+    (keep-alive), DNS-ответы кэшируются, число соединений к одному хосту ограничено.
+
+    Единственный путь к клиенту - общий экземпляр http_client модуля и его
+    get_session(). Запросы к API выполняют функции utils, которые вызываются не
+    только из обработчиков, но и из кэшей погоды и продуктов, смены дня, фонового
+    обновления погоды и супервизора шардов, то есть вне контекста диспетчера,
+    поэтому клиент не передается обработчикам через Dispatcher.
+    '''
+
+    def __init__(self):
+        self._session = None
+
+    async def start(self):
+        '''
+        Создание сессии и коннектора.
+        '''
+
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TOTAL_TIMEOUT,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        '''
+        Закрытие сессии и всех открытых соединений.
+        '''
+
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        '''
+        Получение активной сессии. Вне жизненного цикла бота (скрипты, бенчмарки)
+        клиент запускается лениво при первом обращении.
+        '''
+
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+
+# Общий клиент, запускается и закрывается в bot.main().
+http_client = HttpClient()
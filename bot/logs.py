@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import queue
+import random
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+# Формат текстовых логов.
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Поля контекста обновления, которые попадают в записи логов.
+CONTEXT_FIELDS = ("user_id", "command")
+
+# Пользователь и команда обрабатываемого обновления: (user_id, command) либо None.
+log_context = ContextVar("log_context", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Запись лога одной строкой JSON: время, уровень, логгер, сообщение, поля
+    контекста обновления (user_id, command) и трассировка исключения.
+    '''
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    '''
+    Обработчик логов без ввода-вывода в потоке вызова: запись с
+    неотформатированным сообщением кладется в ограниченную очередь, а
+    форматирование и вывод выполняет фоновый поток (LogPipeline).
+
+    Записи уровня INFO и ниже с командой обновления (события обработчиков)
+    проходят с вероятностью sample_rate; предупреждения и ошибки не
+    прореживаются. При переполненной очереди запись отбрасывается и
+    учитывается в dropped, поток вызова не ждет вывода.
+    '''
+
+    def __init__(self, maxsize: int, sample_rate: float = 1.0):
+        super().__init__(queue.Queue(maxsize))
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение собирается из msg и args в фоновом потоке; трассировка - здесь, пока жив стек.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        context = log_context.get()
+        if context is not None:
+            for field, value in zip(CONTEXT_FIELDS, context):
+                if getattr(record, field, None) is None:
+                    setattr(record, field, value)
+        if (self.sample_rate < 1 and record.levelno <= logging.INFO and getattr(record, "command", None)
+                and random.random() >= self.sample_rate):
+            self.sampled_out += 1
+            return
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class LogPipeline:
+    '''
+    Логирование через очередь: AsyncQueueHandler в корневом логгере и поток
+    QueueListener, который пишет записи в output. После fork (пул процессов
+    рендеринга) в дочернем процессе создаются новые очередь и поток.
+    '''
+
+    def __init__(self, output: logging.Handler, maxsize: int, sample_rate: float = 1.0):
+        self.handler = AsyncQueueHandler(maxsize, sample_rate)
+        self.output = output
+        self.listener = None
+
+    def start(self):
+        if self.listener is None:
+            self.listener = QueueListener(self.handler.queue, self.output, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self):
+        '''
+        Остановка с выводом записей, оставшихся в очереди.
+        '''
+
+        if self.listener is not None:
+            try:
+                self.listener.stop()
+            except queue.Full:
+                # Поток-демон допишет очередь, сколько успеет до выхода процесса.
+                pass
+            self.listener = None
+        self.output.flush()
+
+    def _after_fork(self):
+        self.handler.queue = queue.Queue(self.handler.queue.maxsize)
+        self.listener = None
+        self.start()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled_out": self.handler.sampled_out
+        }
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", maxsize: int = 10000,
+                  sample_rate: float = 1.0) -> LogPipeline:
+    '''
+    Замена обработчиков корневого логгера конвейером через очередь.
+    '''
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    pipeline = LogPipeline(output, maxsize, sample_rate)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(pipeline.handler)
+    root.setLevel(level)
+    pipeline.start()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=pipeline._after_fork)
+    return pipeline
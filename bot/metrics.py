@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import re
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+from aiohttp import web
+
+from config import logger, log_pipeline, METRICS_HOST, METRICS_PORT, METRICS_LOOP_LAG_INTERVAL, METRICS_MAX_LABELS
+from logs import log_context
+
+
+# Границы корзин гистограмм задержек в секундах.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    '''
+    Гистограмма с фиксированными корзинами и оценкой квантилей по ним.
+    '''
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        '''
+        Оценка квантиля линейной интерполяцией внутри корзины.
+        '''
+
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    '''
+    Счетчики и гистограммы бота в памяти процесса.
+    '''
+
+    def __init__(self, max_labels: int = METRICS_MAX_LABELS):
+        self.max_labels = max_labels
+        self.counters = {}
+        self.histograms = {}
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        self._labels = {}
+
+    def _label(self, name: str, label: str) -> str:
+        # Число различных меток ограничено, чтобы произвольные команды не раздували метрики.
+        labels = self._labels.setdefault(name, set())
+        if label not in labels:
+            if len(labels) >= self.max_labels:
+                return "other"
+            labels.add(label)
+        return label
+
+    def inc(self, name: str, label: str, amount: int = 1):
+        key = (name, self._label(name, label))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, label: str, value: float):
+        key = (name, self._label(name, label))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def render(self) -> str:
+        '''
+        Метрики в текстовом формате Prometheus.
+        '''
+
+        lines = [
+            "# TYPE bot_updates_in_flight gauge",
+            f"bot_updates_in_flight {self.in_flight}",
+            "# TYPE bot_event_loop_lag_last_seconds gauge",
+            f"bot_event_loop_lag_last_seconds {self.loop_lag:.6f}"
+        ]
+        # Конвейер логов: записи в очереди, отброшенные при переполнении и прореженные.
+        log_stats = log_pipeline.stats()
+        lines += [
+            "# TYPE bot_log_queue_size gauge",
+            f"bot_log_queue_size {log_stats['queued']}",
+            "# TYPE bot_log_records_dropped_total counter",
+            f"bot_log_records_dropped_total {log_stats['dropped']}",
+            "# TYPE bot_log_records_sampled_out_total counter",
+            f"bot_log_records_sampled_out_total {log_stats['sampled_out']}"
+        ]
+        for name in sorted({key[0] for key in self.counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, label), value in sorted(self.counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{{{_label_name(name)}=\"{label}\"}} {value}")
+
+        for name in sorted({key[0] for key in self.histograms}):
+            label_name = _label_name(name)
+            series = sorted((label, h) for (metric, label), h in self.histograms.items() if metric == name)
+            lines.append(f"# TYPE {name} histogram")
+            for label, histogram in series:
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{{{label_name}=\"{label}\",le=\"{bound}\"}} {cumulative}")
+                lines.append(f"{name}_sum{{{label_name}=\"{label}\"}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{label_name}=\"{label}\"}} {histogram.count}")
+            # Квантили p50/p95/p99, оцененные по корзинам гистограммы.
+            lines.append(f"# TYPE {name}_quantile gauge")
+            for label, histogram in series:
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(
+                        f"{name}_quantile{{{label_name}=\"{label}\",quantile=\"{q}\"}} {histogram.quantile(q):.6f}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def _label_name(metric: str) -> str:
+    if metric.startswith("bot_update"):
+        return "command"
+    if metric.startswith("bot_render"):
+        return "chart"
+    if metric.startswith("bot_external"):
+        return "call"
+    if metric.startswith("bot_upstream"):
+        return "upstream"
+    if metric.startswith("bot_outbound"):
+        return "method"
+    return "name"
+
+
+_COMMAND_RE = re.compile(r"/[a-z_]{1,32}")
+
+# Общий реестр метрик процесса.
+metrics = Metrics()
+
+
+def command_name(event) -> str:
+    '''
+    Метка обновления: команда, шаг FSM или тип callback.
+    '''
+
+    if isinstance(event, Message):
+        text = event.text or ""
+        if text.startswith("/"):
+            command = text.split(maxsplit=1)[0].split("@", 1)[0]
+            return command if _COMMAND_RE.fullmatch(command) else "/other"
+        return "message"
+    if isinstance(event, CallbackQuery):
+        prefix = (event.data or "").split(":", 1)[0]
+        return "callback:" + (prefix if _COMMAND_RE.fullmatch("/" + prefix) else "other")
+    return type(event).__name__.lower()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    '''
+    Внешний middleware роутера: число обновлений, ошибок и задержка по командам.
+    '''
+
+    async def __call__(self, handler, event, data):
+        command = command_name(event)
+        if command == "message":
+            # Шаги мастера /set_profile различаются по состоянию FSM.
+            command = data.get("raw_state") or command
+        metrics.in_flight += 1
+        # Пользователь и команда добавляются во все записи логов обработчика.
+        user = getattr(event, "from_user", None)
+        token = log_context.set((user.id if user is not None else None, command))
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc("bot_update_errors_total", command)
+            raise
+        finally:
+            log_context.reset(token)
+            metrics.in_flight -= 1
+            metrics.inc("bot_updates_total", command)
+            metrics.observe("bot_update_latency_seconds", command, time.perf_counter() - start)
+
+
+def timed(metric: str, label: str):
+    '''
+    Декоратор корутины: задержка в гистограмму metric, исключения - в счетчик ошибок.
+    '''
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                metrics.inc(metric.replace("_latency_seconds", "_errors_total"), label)
+                raise
+            finally:
+                metrics.observe(metric, label, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    '''
+    HTTP-эндпоинт /metrics и замер задержки event loop.
+    '''
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT,
+                 lag_interval: float = METRICS_LOOP_LAG_INTERVAL):
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self._runner = None
+        self._lag_task = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def _measure_loop_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - start - self.lag_interval)
+            metrics.loop_lag = lag
+            metrics.observe("bot_event_loop_lag_seconds", "loop", lag)
+
+    async def start(self):
+        self._lag_task = asyncio.ensure_future(self._measure_loop_lag())
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Метрики доступны на http://%s:%s/metrics.", self.host, self.port)
+
+    async def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,171 @@
+from enum import IntEnum
+
+from config import CITY_REGISTRY_SIZE
+
+
+class Gender(IntEnum):
+    '''
+    Пол пользователя.
+    '''
+
+    MALE = 0
+    FEMALE = 1
+
+    @classmethod
+    def from_text(cls, text: str) -> "Gender":
+        return cls.FEMALE if text == 'ж' else cls.MALE
+
+    def __str__(self):
+        return 'ж' if self is Gender.FEMALE else 'м'
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+class ActivityType(IntEnum):
+    '''
+    Тип активности. Код используется как индекс в таблицах коэффициентов.
+    '''
+
+    RUN = 0
+    YOGA = 1
+    SWIMMING = 2
+    STRENGTH = 3
+
+    @classmethod
+    def from_text(cls, text: str) -> "ActivityType":
+        return _ACTIVITY_BY_TEXT[text.lower()]
+
+    @property
+    def key(self) -> str:
+        return _ACTIVITY_KEYS[self]
+
+    def __str__(self):
+        return _ACTIVITY_KEYS[self].capitalize()
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+# Названия типов активности в порядке кодов ActivityType.
+_ACTIVITY_KEYS = ("бег", "йога", "плавание", "силовая")
+_ACTIVITY_BY_TEXT = {key: ActivityType(code) for code, key in enumerate(_ACTIVITY_KEYS)}
+
+
+class CityRegistry:
+    '''
+    Интернирование названий городов: каждое название хранится один раз,
+    профили ссылаются на него целочисленным идентификатором.
+
+    Реестр не растет больше max_size названий: город свободного ввода может
+    оказаться любой строкой, и без предела реестр рос бы с каждым новым
+    написанием. Названия сверх предела не интернируются - профиль хранит
+    саму строку, а name() возвращает ее без изменений.
+    '''
+
+    def __init__(self, max_size: int = CITY_REGISTRY_SIZE):
+        self.max_size = max_size
+        self._ids = {}
+        self._names = []
+
+    def intern(self, name: str):
+        city_id = self._ids.get(name)
+        if city_id is None:
+            if len(self._names) >= self.max_size:
+                return name
+            city_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return city_id
+
+    def name(self, city_id) -> str:
+        return city_id if isinstance(city_id, str) else self._names[city_id]
+
+    def __len__(self):
+        return len(self._names)
+
+
+# Общий реестр городов процесса.
+cities = CityRegistry()
+
+
+class UserProfile:
+    '''
+    Профиль пользователя и дневные счетчики.
+
+    Запись со __slots__ без словаря атрибутов: пол и тип активности хранятся
+    как малые перечисления, город - как идентификатор в реестре cities (строкой, если реестр заполнен).
+    tz_offset - смещение часового пояса города в секундах, day - номер
+    текущего дня трекинга.
+    '''
+
+    __slots__ = (
+        "weight", "height", "age", "gender", "activity", "activity_type", "city_id",
+        "water_goal", "calorie_goal", "logged_water", "logged_calories", "burned_calories",
+        "tz_offset", "day"
+    )
+
+    def __init__(self, weight=None, height=None, age=None, gender=None, activity=None, activity_type=None,
+                 city=None, water_goal=None, calorie_goal=None, logged_water=0, logged_calories=0,
+                 burned_calories=0, tz_offset=0, day=None):
+        self.weight = weight
+        self.height = height
+        self.age = age
+        self.gender = gender
+        self.activity = activity
+        self.activity_type = activity_type
+        self.city_id = None
+        self.city = city
+        self.water_goal = water_goal
+        self.calorie_goal = calorie_goal
+        self.logged_water = logged_water
+        self.logged_calories = logged_calories
+        self.burned_calories = burned_calories
+        self.tz_offset = tz_offset
+        self.day = day
+
+    @property
+    def city(self):
+        return cities.name(self.city_id) if self.city_id is not None else None
+
+    @city.setter
+    def city(self, name):
+        self.city_id = cities.intern(name) if name is not None else None
+
+    def copy(self) -> "UserProfile":
+        profile = UserProfile.__new__(UserProfile)
+        for field in UserProfile.__slots__:
+            setattr(profile, field, getattr(self, field))
+        return profile
+
+    def to_row(self) -> tuple:
+        '''
+        Значения полей PROFILE_FIELDS для записи в базу: перечисления и город - строками.
+        '''
+
+        return (
+            self.weight, self.height, self.age,
+            str(self.gender) if self.gender is not None else None,
+            self.activity,
+            str(self.activity_type) if self.activity_type is not None else None,
+            self.city, self.water_goal, self.calorie_goal, self.logged_water,
+            self.logged_calories, self.burned_calories, self.tz_offset, self.day
+        )
+
+    @classmethod
+    def from_row(cls, row) -> "UserProfile":
+        weight, height, age, gender, activity, activity_type, city, *rest = row
+        return cls(
+            weight, height, age,
+            Gender.from_text(gender) if gender is not None else None,
+            activity,
+            ActivityType.from_text(activity_type) if activity_type is not None else None,
+            city, *rest
+        )
+
+
+# Поля профиля в порядке столбцов базы (совпадает с UserProfile.to_row).
+PROFILE_FIELDS = (
+    "weight", "height", "age", "gender", "activity", "activity_type", "city",
+    "water_goal", "calorie_goal", "logged_water", "logged_calories", "burned_calories",
+    "tz_offset", "day"
+)
@@ -0,0 +1,302 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from cache import LRUCache
+from config import (
+    logger, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_MAX_RETRIES, OUTBOX_MAX_CHATS
+)
+from metrics import metrics
+
+# Приоритеты исходящих сообщений: ответы пользователям и массовые рассылки.
+INTERACTIVE = 0
+BULK = 1
+# Приоритет отправок текущей задачи, меняется через bulk_sends().
+send_priority = ContextVar("send_priority", default=INTERACTIVE)
+
+# Методы с chat_id, которые не считаются отправкой сообщения.
+UNLIMITED_METHODS = frozenset({"sendChatAction"})
+# Предельная длина текста сообщения Telegram и разделитель объединенных текстов.
+MAX_TEXT_LENGTH = 4096
+MERGE_SEPARATOR = "\n\n"
+# Параметры, которые могут различаться у объединяемых сообщений: берутся у первого.
+_MERGE_EXCLUDE = {"text", "reply_parameters", "reply_to_message_id"}
+
+
+@contextmanager
+def bulk_sends():
+    '''
+    Отправки внутри блока идут с низким приоритетом (рассылки, итоги дня).
+    '''
+
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    '''
+    Маркерная корзина: rate маркеров в секунду, не больше burst в запасе.
+    '''
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        '''
+        Взятие маркера: 0, если маркер взят, иначе время до следующего маркера в секундах.
+        '''
+
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        '''
+        Опустошение корзины так, чтобы следующий маркер появился не раньше чем через seconds секунд.
+        '''
+
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class PriorityLimiter:
+    '''
+    Общий лимит отправок с очередями по приоритету: при нехватке маркеров
+    они достаются сначала ожидающим из очереди с меньшим номером, внутри
+    очереди - по порядку.
+    '''
+
+    def __init__(self, rate: float, burst: float, lanes: int = 2):
+        self.bucket = TokenBucket(rate, burst)
+        self._lanes = [deque() for _ in range(lanes)]
+        self._pump = None
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        if not any(self._lanes) and self.bucket.delay() == 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(future)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.ensure_future(self._run())
+        await future
+
+    async def _run(self):
+        while True:
+            for lane in self._lanes:
+                # Отмененные ожидания не получают маркер.
+                while lane and lane[0].done():
+                    lane.popleft()
+            lane = next((lane for lane in self._lanes if lane), None)
+            if lane is None:
+                return
+            delay = self.bucket.delay()
+            if delay:
+                await asyncio.sleep(delay)
+            else:
+                lane.popleft().set_result(None)
+
+    async def close(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
+            self._pump = None
+
+
+class _Pending:
+    __slots__ = ("method", "future")
+
+    def __init__(self, method, future):
+        self.method = method
+        self.future = future
+
+
+class _Chat:
+    __slots__ = ("bucket", "lock", "pending")
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = asyncio.Lock()
+        self.pending = deque()
+
+
+def _mergeable(head, follower) -> bool:
+    '''
+    Можно ли дописать текст follower к сообщению head: оба - простой текст
+    с одинаковыми параметрами, follower не отвечает на другое сообщение.
+    '''
+
+    if type(head) is not SendMessage or type(follower) is not SendMessage:
+        return False
+    if head.entities is not None or follower.entities is not None:
+        return False
+    for field in ("reply_parameters", "reply_to_message_id"):
+        value = getattr(follower, field)
+        if value is not None and value != getattr(head, field):
+            return False
+    return head.model_dump(exclude=_MERGE_EXCLUDE) == follower.model_dump(exclude=_MERGE_EXCLUDE)
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    '''
+    Очередь исходящих сообщений с учетом лимитов Telegram, подключается как
+    middleware запросов сессии aiogram (bot.session.middleware), поэтому
+    обработчики по-прежнему вызывают message.reply и answer_photo.
+
+    Отправки в чат (методы send*, copyMessage, forwardMessage) выполняются по
+    порядку и берут маркер из корзины чата (chat_rate в секунду, запас
+    chat_burst), затем из общей корзины бота (global_rate в секунду). Общие
+    маркеры при нехватке достаются сначала ответам пользователям, затем
+    рассылкам (bulk_sends). Текстовые сообщения, ожидающие отправки в один
+    чат, объединяются с предыдущим, если у них одинаковые параметры. Ответ
+    429 приостанавливает чат на retry_after секунд, после чего отправка
+    повторяется, не больше max_retries раз.
+    '''
+
+    def __init__(self, global_rate: float = OUTBOX_GLOBAL_RATE, chat_rate: float = OUTBOX_CHAT_RATE,
+                 chat_burst: int = OUTBOX_CHAT_BURST, max_retries: int = OUTBOX_MAX_RETRIES,
+                 max_chats: int = OUTBOX_MAX_CHATS):
+        # Общий лимит без запаса: отправки равномерно, не пачкой в начале каждой секунды.
+        self.global_limit = PriorityLimiter(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats = LRUCache(max_chats)
+        self.sent = 0
+        self.merged = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    def _chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = _Chat(self.chat_rate, self.chat_burst)
+            self._chats.set(chat_id, chat)
+        return chat
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        name = method.__api_method__
+        if chat_id is None or name in UNLIMITED_METHODS or not (
+                name.startswith("send") or name in ("copyMessage", "forwardMessage")):
+            return await make_request(bot, method)
+
+        chat = self._chat(chat_id)
+        pending = _Pending(method, asyncio.get_running_loop().create_future())
+        chat.pending.append(pending)
+        try:
+            async with chat.lock:
+                # Текст уже отправлен в составе предыдущего сообщения.
+                if pending.future.done():
+                    return pending.future.result()
+                chat.pending.remove(pending)
+                return await self._send(make_request, bot, chat, pending)
+        finally:
+            if pending in chat.pending:
+                chat.pending.remove(pending)
+            elif pending.future.done() and not pending.future.cancelled():
+                # Ошибка объединенной отправки уже получена ее владельцем.
+                pending.future.exception()
+
+    async def _send(self, make_request, bot, chat: _Chat, pending: _Pending):
+        priority = send_priority.get()
+        while True:
+            delay = chat.bucket.delay()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        await self.global_limit.acquire(priority)
+
+        # Пока отправка ждала маркеры, в чат могли встать следующие тексты.
+        batch = [pending]
+        method = pending.method
+        length = len(method.text) if type(method) is SendMessage else MAX_TEXT_LENGTH
+        while chat.pending and _mergeable(method, chat.pending[0].method):
+            follower = chat.pending[0]
+            if length + len(MERGE_SEPARATOR) + len(follower.method.text) > MAX_TEXT_LENGTH:
+                break
+            length += len(MERGE_SEPARATOR) + len(follower.method.text)
+            batch.append(chat.pending.popleft())
+        if len(batch) > 1:
+            method = method.model_copy(update={"text": MERGE_SEPARATOR.join(item.method.text for item in batch)})
+            self.merged += len(batch) - 1
+            metrics.inc("bot_outbound_merged_total", method.__api_method__, len(batch) - 1)
+
+        try:
+            result = await self._request(make_request, bot, chat, method, priority)
+        except asyncio.CancelledError:
+            # Объединенные тексты отправит следующий владелец чата.
+            chat.pending.extendleft(reversed(batch[1:]))
+            raise
+        except Exception as e:
+            for item in batch[1:]:
+                item.future.set_exception(e)
+            raise
+        for item in batch[1:]:
+            item.future.set_result(result)
+        return result
+
+    async def _request(self, make_request, bot, chat: _Chat, method, priority: int):
+        attempt = 0
+        while True:
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                metrics.inc("bot_outbound_retry_after_total", method.__api_method__)
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                attempt += 1
+                logger.warning("Отправка в чат %s: лимит Telegram, повтор через %s с.", method.chat_id, e.retry_after)
+                chat.bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                await self.global_limit.acquire(priority)
+                continue
+            except Exception:
+                self.failed += 1
+                raise
+            self.sent += 1
+            metrics.inc("bot_outbound_messages_total", method.__api_method__)
+            return result
+
+    async def close(self):
+        await self.global_limit.close()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "waiting": self.global_limit.waiting,
+            "chats": len(self._chats)
+        }
+
+
+# Общая очередь исходящих сообщений бота.
+outbox = OutboundQueue()
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import logger, RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_QUEUE_TIMEOUT
+from metrics import metrics
+from utils import render_chart
+
+
+class RenderBusyError(Exception):
+    '''
+    Очередь рендеринга переполнена дольше допустимого времени ожидания.
+    '''
+
+
+class RenderService:
+    '''
+    Построение графиков в пуле процессов вне event loop.
+
+    Число принятых задач (выполняемых и ожидающих) ограничено queue_size:
+    новые запросы ждут свободного места не дольше queue_timeout секунд,
+    после чего получают RenderBusyError.
+    '''
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE,
+                 queue_timeout: float = RENDER_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._pool = None
+        self._slots = None
+        self.pending = 0
+        self.rendered = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._slots = asyncio.Semaphore(self.queue_size)
+            logger.info("Сервис рендеринга запущен: процессов %s, очередь %s.", self.workers, self.queue_size)
+
+    async def close(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            # Ожидание завершения процессов - в отдельном потоке, а не в event loop.
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        # Пул с погибшим процессом больше не принимает задачи; заменяется один раз на все ожидающие запросы.
+        if self._pool is broken:
+            logger.warning("Сервис рендеринга: процесс пула завершился аварийно, пул пересоздается.")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    async def render(self, plot_func, *args) -> bytes:
+        '''
+        Построение графика plot_func(*args) в байтах PNG.
+        '''
+
+        self.start()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RenderBusyError("Очередь построения графиков переполнена.")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._pool
+            try:
+                png = await loop.run_in_executor(pool, render_chart, plot_func, *args)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                if self._pool is None:
+                    raise
+                png = await loop.run_in_executor(self._pool, render_chart, plot_func, *args)
+            self.rendered += 1
+            return png
+        finally:
+            self.pending -= 1
+            self._slots.release()
+            metrics.observe("bot_render_latency_seconds", plot_func.__name__, time.perf_counter() - start)
+
+
+# Общий сервис рендеринга, запускается и закрывается в bot.main().
+render_service = RenderService()
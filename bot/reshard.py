@@ -0,0 +1,179 @@
+'''
+Раскладка данных по шардам на диске и ее смена при изменении SHARDS.
+
+Профили и журнал событий воркера шарда N лежат в каталогах shard-N рядом с общими путями
+(config.shard_path), данные одного процесса (SHARDS=1) - по самим общим путям.
+Число шардов, по которым разложены данные, записывается в SHARD_LAYOUT_PATH:
+бот не запускается, если оно не совпадает с SHARDS, иначе пользователи попали
+бы к воркерам без своих профилей и журналов.
+
+Смена числа шардов: python bot/reshard.py (число шардов берется из SHARDS либо
+--shards) при остановленном боте. Профили и события раскладываются по
+user_id % shards в промежуточный каталог reshard, затем старые данные
+удаляются и новые переносятся на их место. Этап переключения записывается в
+файл раскладки, поэтому прерванная смена завершается повторным запуском.
+'''
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+from typing import Optional
+
+from config import (
+    logger, SHARDS, SHARD_LAYOUT_PATH, USER_STORAGE, USER_STORAGE_PATH, EVENT_LOG_DIR, shard_path
+)
+from events import EventLog
+from storage import split_user_db
+
+# Общие пути данных пользователей, которые раскладываются по шардам. Кэш
+# калорийности продуктов общий для всех воркеров и не раскладывается.
+DATA_PATHS = (USER_STORAGE_PATH, EVENT_LOG_DIR)
+
+
+def layout_paths(path: str, shards: int) -> list:
+    '''
+    Пути данных path каждого из shards шардов.
+    '''
+
+    return [path] if shards == 1 else [shard_path(path, shard_id) for shard_id in range(shards)]
+
+
+def _staging_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(path), "reshard")
+
+
+def _staging_path(path: str, shard_id: int) -> str:
+    return shard_path(os.path.join(_staging_dir(path), os.path.basename(path)), shard_id)
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    # База SQLite в режиме WAL хранится в трех файлах.
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.isfile(path + suffix):
+            os.remove(path + suffix)
+
+
+def read_layout() -> Optional[dict]:
+    if not os.path.exists(SHARD_LAYOUT_PATH):
+        return None
+    with open(SHARD_LAYOUT_PATH, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_layout(layout: dict):
+    directory = os.path.dirname(SHARD_LAYOUT_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = SHARD_LAYOUT_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(layout, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, SHARD_LAYOUT_PATH)
+
+
+def detect_shards() -> Optional[int]:
+    '''
+    Число шардов данных, записанных до появления файла раскладки; None - данных нет.
+    '''
+
+    shard_ids = set()
+    for path in DATA_PATHS:
+        for directory in glob.glob(os.path.join(os.path.dirname(path), "shard-*")):
+            match = re.fullmatch(r"shard-(\d+)", os.path.basename(directory))
+            if match and os.path.exists(os.path.join(directory, os.path.basename(path))):
+                shard_ids.add(int(match.group(1)))
+    if shard_ids:
+        return max(shard_ids) + 1
+    return 1 if any(os.path.exists(path) for path in DATA_PATHS) else None
+
+
+def check_layout(shards: int = SHARDS):
+    '''
+    Проверка при запуске: данные на диске разложены по shards шардам.
+    '''
+
+    layout = read_layout()
+    if layout is None:
+        current = detect_shards()
+        layout = {"shards": shards if current is None else current}
+        write_layout(layout)
+    if "target" in layout:
+        raise RuntimeError("Смена числа шардов не завершена: повторите python bot/reshard.py.")
+    if layout["shards"] != shards:
+        raise RuntimeError(
+            f"Данные разложены по {layout['shards']} шардам, а SHARDS={shards}: "
+            f"выполните python bot/reshard.py при остановленном боте."
+        )
+
+
+def _build(current: int, shards: int):
+    for path in DATA_PATHS:
+        _remove(_staging_dir(path))
+    users = 0
+    if USER_STORAGE == "sqlite":
+        users = split_user_db(
+            [path for path in layout_paths(USER_STORAGE_PATH, current) if os.path.exists(path)],
+            [_staging_path(USER_STORAGE_PATH, shard_id) for shard_id in range(shards)]
+        )
+    events = EventLog.split(
+        [path for path in layout_paths(EVENT_LOG_DIR, current) if os.path.isdir(path)],
+        [_staging_path(EVENT_LOG_DIR, shard_id) for shard_id in range(shards)]
+    )
+    logger.info("Смена числа шардов %s -> %s: профилей %s, событий %s.", current, shards, users, events)
+
+
+def _switch(layout: dict):
+    if layout["phase"] == "delete":
+        for path in DATA_PATHS:
+            for old_path in layout_paths(path, layout["shards"]):
+                _remove(old_path)
+                directory = os.path.dirname(old_path)
+                if os.path.basename(directory).startswith("shard-") and not os.listdir(directory):
+                    os.rmdir(directory)
+        layout = dict(layout, phase="move")
+        write_layout(layout)
+    # Перенос повторяем только для еще не перенесенных путей.
+    for path in DATA_PATHS:
+        for shard_id, new_path in enumerate(layout_paths(path, layout["target"])):
+            staged = _staging_path(path, shard_id)
+            if os.path.exists(staged):
+                os.makedirs(os.path.dirname(new_path) or ".", exist_ok=True)
+                os.replace(staged, new_path)
+    for path in DATA_PATHS:
+        _remove(_staging_dir(path))
+    write_layout({"shards": layout["target"]})
+
+
+def reshard(shards: int = SHARDS) -> dict:
+    '''
+    Раскладка данных по shards шардам либо завершение прерванной смены.
+    '''
+
+    if shards < 1:
+        raise ValueError("Число шардов должно быть положительным.")
+    layout = read_layout()
+    if layout is None:
+        layout = {"shards": detect_shards() or shards}
+    if "target" not in layout:
+        if layout["shards"] == shards:
+            write_layout(layout)
+            return layout
+        # До записи этапа delete старые данные не тронуты, промежуточный каталог собирается заново.
+        _build(layout["shards"], shards)
+        layout = {"shards": layout["shards"], "target": shards, "phase": "delete"}
+        write_layout(layout)
+    _switch(layout)
+    return read_layout()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, default=SHARDS, help="новое число шардов")
+    args = parser.parse_args()
+    logger.info("Данные разложены по шардам: %s", reshard(args.shards))
@@ -0,0 +1,187 @@
+import asyncio
+import functools
+import random
+import time
+
+from aiohttp import ClientError
+
+from config import (
+    logger, UPSTREAM_TIMEOUT, UPSTREAM_DEADLINE, UPSTREAM_RETRIES, UPSTREAM_BACKOFF, UPSTREAM_BACKOFF_MAX,
+    UPSTREAM_CONCURRENCY, UPSTREAM_QUEUE_TIMEOUT, BREAKER_FAILURES, BREAKER_RESET
+)
+from metrics import metrics
+
+
+class UpstreamError(Exception):
+    '''
+    Временная ошибка внешнего API (5xx, 429): запрос можно повторить.
+    '''
+
+    def __init__(self, status: int):
+        super().__init__(f"внешний API ответил {status}")
+        self.status = status
+
+
+class UpstreamUnavailable(Exception):
+    '''
+    Внешний API недоступен: открыт автомат, нет свободного слота или исчерпаны попытки.
+    '''
+
+    def __init__(self, upstream: str, reason: str):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+# Ошибки, после которых запрос повторяется и засчитывается автомату как отказ.
+RETRYABLE_ERRORS = (ClientError, asyncio.TimeoutError, UpstreamError)
+
+
+class CircuitBreaker:
+    '''
+    Автоматический выключатель: после failures отказов подряд запросы
+    отклоняются сразу в течение reset секунд, затем пропускается один
+    пробный запрос. Успех пробного запроса замыкает цепь, отказ - снова
+    размыкает на reset секунд.
+    '''
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def cancel_probe(self):
+        '''
+        Пробный запрос завершился без ответа API (отмена, нет слота): следующий вызов станет пробным.
+        '''
+
+        self._probing = False
+
+    def record_success(self):
+        self._consecutive = 0
+        self._probing = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self._consecutive += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class Upstream:
+    '''
+    Защита обращений к одному внешнему API.
+
+    Каждая попытка ограничена timeout секунд, весь вызов с повторами - deadline
+    секунд. Повторы (не более retries) выполняются только для временных ошибок,
+    пауза между ними растет экспоненциально со случайным разбросом (full jitter).
+    Одновременно к API идет не больше concurrency запросов, ожидание слота
+    ограничено queue_timeout. Пока автомат разомкнут, вызовы сразу завершаются
+    UpstreamUnavailable, и обработчик отвечает пользователю без ожидания.
+    '''
+
+    def __init__(self, name: str, timeout: float = UPSTREAM_TIMEOUT, deadline: float = UPSTREAM_DEADLINE,
+                 retries: int = UPSTREAM_RETRIES, backoff: float = UPSTREAM_BACKOFF,
+                 backoff_max: float = UPSTREAM_BACKOFF_MAX, concurrency: int = UPSTREAM_CONCURRENCY,
+                 queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT, breaker: CircuitBreaker = None):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.concurrency = concurrency
+        self.in_flight = 0
+        # Семафор создается в работающем event loop при первом вызове.
+        self._slots = None
+
+    def _reject(self, reason: str):
+        metrics.inc("bot_upstream_rejected_total", self.name)
+        raise UpstreamUnavailable(self.name, reason)
+
+    async def call(self, func, *args, **kwargs):
+        if not self.breaker.allow():
+            self._reject("автомат разомкнут")
+        probe = self.breaker.state == CircuitBreaker.HALF_OPEN
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("нет свободного слота")
+            self.in_flight += 1
+            try:
+                return await self._attempts(func, *args, **kwargs)
+            finally:
+                self.in_flight -= 1
+                self._slots.release()
+        finally:
+            if probe:
+                self.breaker.cancel_probe()
+
+    async def _attempts(self, func, *args, **kwargs):
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), min(self.timeout, remaining))
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                metrics.inc("bot_upstream_failures_total", self.name)
+                delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+                if (attempt >= self.retries or self.breaker.state != CircuitBreaker.CLOSED
+                        or time.monotonic() + delay >= deadline):
+                    logger.warning("%s: запрос не выполнен после %s попыток: %r", self.name, attempt + 1, e)
+                    raise UpstreamUnavailable(self.name, "исчерпаны попытки") from e
+                attempt += 1
+                metrics.inc("bot_upstream_retries_total", self.name)
+                await asyncio.sleep(delay)
+            except Exception:
+                # Ответ получен (например, 404), API работает.
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stats(self) -> dict:
+        return {"state": self.breaker.state, "in_flight": self.in_flight}
+
+
+def resilient(upstream: Upstream):
+    '''
+    Декоратор корутины запроса к внешнему API: вызов через upstream.call.
+    '''
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await upstream.call(func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Защита внешних API бота.
+open_weather = Upstream("open_weather_api")
+open_food_facts = Upstream("open_food_fact_api")
@@ -0,0 +1,176 @@
+import asyncio
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from config import logger, ROLLOVER_INTERVAL, ROLLOVER_CHUNK, ROLLOVER_NOTIFY
+from models import UserProfile, cities
+from outbox import bulk_sends
+from storage import UserStorage
+from utils import calc_water_intake_batch, day_summary, local_day
+from weather_cache import WeatherCache
+
+# Границы смещений часовых поясов в секундах (от UTC-12 до UTC+14).
+TZ_MIN = -12 * 3600
+TZ_MAX = 14 * 3600
+
+
+class RolloverScheduler:
+    '''
+    Автоматическая смена дня трекинга для всех пользователей в их локальную полночь.
+
+    Раз в interval секунд определяются часовые пояса, в которых с прошлого
+    обхода наступила полночь, и из хранилища выбираются только пользователи
+    этих поясов, у которых локальная дата ушла вперед относительно поля day;
+    если полночь нигде не наступила, хранилище не читается. Пользователи
+    группируются по часовому поясу и городу. Погода запрашивается групповыми
+    запросами по городам, норма воды пересчитывается для всей группы одним
+    векторным расчетом. Номер дня хранится в профиле: первый обход после
+    запуска (и после неудачного обхода - за все время с последнего удачного)
+    выбирает пользователей всех часовых поясов, поэтому пропущенная смена дня
+    выполняется.
+    '''
+
+    def __init__(self, storage: UserStorage, weather: WeatherCache, interval: float = ROLLOVER_INTERVAL,
+                 chunk: int = ROLLOVER_CHUNK, notify: bool = ROLLOVER_NOTIFY):
+        self.storage = storage
+        self.weather = weather
+        self.interval = interval
+        self.chunk = chunk
+        self.notify = notify
+        self.bot = None
+        self._task = None
+        # Время последнего удачного обхода.
+        self._checked = None
+        # Фоновые рассылки итогов дня.
+        self._senders = set()
+        self.rolled_over = 0
+
+    def start(self, bot: Bot = None):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._senders):
+            task.cancel()
+        await asyncio.gather(*self._senders, return_exceptions=True)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Смена дня: ошибка обхода пользователей: %s", e)
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    def _midnight_ranges(since: float, now: float) -> list:
+        '''
+        Диапазоны смещений [от, до), в которых между since и now наступила
+        местная полночь; без since (или за сутки и больше) - все смещения.
+        '''
+
+        if since is None or now - since >= 86400:
+            return [(TZ_MIN, TZ_MAX + 1)]
+        ranges = []
+        # Полночь дня k наступает в поясе tz в момент k * 86400 - tz: since < k * 86400 - tz <= now.
+        for k in range(math.floor((since + TZ_MIN) / 86400) + 1, math.floor((now + TZ_MAX) / 86400) + 1):
+            tz_from = max(math.ceil(k * 86400 - now), TZ_MIN)
+            tz_to = min(math.ceil(k * 86400 - since), TZ_MAX + 1)
+            if tz_from < tz_to:
+                ranges.append((tz_from, tz_to))
+        return ranges
+
+    async def _collect_due(self, now: float) -> dict:
+        '''
+        Пользователи, у которых наступил новый день: {tz_offset: {city_id: [(user_id, профиль)]}}.
+        '''
+
+        due = defaultdict(lambda: defaultdict(list))
+        for tz_from, tz_to in self._midnight_ranges(self._checked, now):
+            async for batch in self.storage.iter_due(now, tz_from, tz_to, self.chunk):
+                for user_id, profile in batch:
+                    due[profile.tz_offset or 0][profile.city_id].append((user_id, profile))
+                # Разбор большой выборки не должен задерживать обработку сообщений.
+                await asyncio.sleep(0)
+        return due
+
+    async def _temperature(self, city: str) -> float:
+        if not city:
+            return 20
+        try:
+            return await self.weather.get(city)
+        except Exception as e:
+            logger.warning("Смена дня: нет погоды для %s, используется 20 градусов: %s", city, e)
+            return 20
+
+    async def run_once(self, now: float = None) -> int:
+        '''
+        Один обход: смена дня у всех пользователей, для которых она наступила.
+        '''
+
+        now = time.time() if now is None else now
+        due = await self._collect_due(now)
+        # Погода всех городов группы одним набором групповых запросов вместо запроса на город.
+        await self.weather.prefetch(
+            {cities.name(city_id) for by_city in due.values() for city_id in by_city if city_id is not None},
+            self.weather.ttl
+        )
+        rolled = 0
+        summaries = []
+        for tz_offset, by_city in due.items():
+            today = local_day(tz_offset, now)
+            for city_id, group in by_city.items():
+                temperature = await self._temperature(cities.name(city_id) if city_id is not None else None)
+                # Норма воды всей группы одним векторным расчетом.
+                water_goals = calc_water_intake_batch(
+                    np.fromiter((profile.weight for _, profile in group), dtype=np.float64, count=len(group)),
+                    np.fromiter((profile.activity for _, profile in group), dtype=np.int64, count=len(group)),
+                    temperature
+                ).tolist()
+                for position, ((user_id, _), water_goal) in enumerate(zip(group, water_goals), 1):
+                    # Сброс по текущему профилю, а не по снимку обхода: логи, записанные
+                    # после обхода, попадают в итоги, а уже сменивший день профиль
+                    # (например, через /new_day) пропускается.
+                    previous = await self.storage.reset_day(user_id, today, water_goal, if_before=True)
+                    if previous is not None:
+                        rolled += 1
+                        if self.notify and self.bot is not None:
+                            summaries.append((user_id, previous))
+                    if position % self.chunk == 0:
+                        await asyncio.sleep(0)
+        if summaries:
+            # Итоги рассылаются после всех сбросов в фоне: ожидание очереди исходящих
+            # сообщений не растягивает смену дня и окно между обходом и сбросом.
+            task = asyncio.ensure_future(self._send_summaries(summaries))
+            self._senders.add(task)
+            task.add_done_callback(self._senders.discard)
+        if rolled:
+            self.rolled_over += rolled
+            logger.info("Смена дня: обновлено пользователей %s, часовых поясов %s.", rolled, len(due))
+        self._checked = now
+        return rolled
+
+    async def _send_summaries(self, summaries: list):
+        for start in range(0, len(summaries), self.chunk):
+            # Итоги пачки отправляются одновременно, темп задает очередь исходящих сообщений.
+            await asyncio.gather(*(
+                self._send_summary(user_id, profile) for user_id, profile in summaries[start:start + self.chunk]
+            ))
+
+    async def _send_summary(self, user_id: int, profile: UserProfile):
+        try:
+            # Рассылка итогов не задерживает ответы пользователям.
+            with bulk_sends():
+                await self.bot.send_message(user_id, day_summary(profile))
+        except TelegramAPIError as e:
+            logger.warning("Смена дня: не удалось отправить итоги пользователю %s: %s", user_id, e)
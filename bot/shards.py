@@ -0,0 +1,297 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import signal
+import sys
+from typing import Optional
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+from config import (
+    logger, SHARD_BASE_PORT, SHARD_HEALTH_INTERVAL, SHARD_HEALTH_FAILURES, SHARD_RESTART_DELAY,
+    SHARD_BATCH, SHARD_QUEUE_SIZE, METRICS_PORT
+)
+from http_client import http_client
+from metrics import metrics
+
+# Длительность long polling запроса getUpdates в секундах.
+POLLING_TIMEOUT = 25
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    '''
+    Идентификатор пользователя из JSON обновления без разбора в модели aiogram.
+    '''
+
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict):
+            return user.get("id")
+    return None
+
+
+class Shard:
+    '''
+    Процесс-воркер шарда и очередь пересылаемых ему обновлений.
+    '''
+
+    def __init__(self, shard_id: int, queue_size: int):
+        self.shard_id = shard_id
+        self.port = SHARD_BASE_PORT + shard_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.process = None
+        self.failures = 0
+        self.restarts = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+
+class ShardSupervisor:
+    '''
+    Супервизор шардов: запускает shards процессов бота в режиме worker и
+    распределяет между ними обновления по user_id % shards.
+
+    Все обновления одного пользователя обрабатывает один воркер, поэтому
+    состояние FSM и порядок шагов остаются локальными для процесса, а разные
+    пользователи обрабатываются на разных ядрах. Супервизор разбирает только
+    JSON обновления и пересылает воркеру пачки по HTTP на localhost. Данные
+    воркеров разделены (каталог shard-N), общего состояния нет; смена числа
+    шардов выполняется переразбиением данных (reshard.py).
+
+    Воркеры проверяются раз в health_interval секунд: завершившийся процесс
+    или health_failures неудачных проверок подряд приводят к перезапуску.
+    Неотправленные обновления остаются в очереди шарда и пересылаются после
+    перезапуска; обновления, уже принятые упавшим воркером, теряются.
+    '''
+
+    def __init__(self, bot: Bot, shards: int, allowed_updates: list = None,
+                 health_interval: float = SHARD_HEALTH_INTERVAL, health_failures: int = SHARD_HEALTH_FAILURES,
+                 restart_delay: float = SHARD_RESTART_DELAY, batch: int = SHARD_BATCH,
+                 queue_size: int = SHARD_QUEUE_SIZE):
+        self.bot = bot
+        self.allowed_updates = allowed_updates
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.restart_delay = restart_delay
+        self.batch = batch
+        self.secret = secrets.token_hex(16)
+        self.shards = [Shard(shard_id, queue_size) for shard_id in range(shards)]
+        self._tasks = []
+        self.webhook_secret = ""
+        self._runner = None
+
+    def _environment(self, shard: Shard) -> dict:
+        environment = dict(os.environ)
+        environment.update({
+            "BOT_MODE": "worker",
+            "SHARD_ID": str(shard.shard_id),
+            "SHARD_SECRET": self.secret,
+            # Метрики каждого воркера на своем порту после порта супервизора.
+            "METRICS_PORT": str(METRICS_PORT + 1 + shard.shard_id if METRICS_PORT else 0)
+        })
+        return environment
+
+    async def _spawn(self, shard: Shard):
+        shard.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py"),
+            env=self._environment(shard)
+        )
+        shard.failures = 0
+        logger.info("Шард %s: воркер запущен, pid %s.", shard.shard_id, shard.process.pid)
+
+    async def _healthy(self, shard: Shard) -> bool:
+        session = await http_client.get_session()
+        try:
+            async with session.get(shard.url + "/health", timeout=aiohttp.ClientTimeout(total=2)) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _wait_ready(self, shard: Shard, timeout: float = 60):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not await self._healthy(shard):
+            if shard.process.returncode is not None:
+                raise RuntimeError(f"Шард {shard.shard_id}: воркер завершился при запуске.")
+            if asyncio.get_running_loop().time() > deadline:
+                raise TimeoutError(f"Шард {shard.shard_id}: воркер не ответил за {timeout} с.")
+            await asyncio.sleep(0.2)
+
+    async def _restart(self, shard: Shard):
+        if shard.process.returncode is None:
+            shard.process.kill()
+            await shard.process.wait()
+        logger.error("Шард %s: воркер остановлен (код %s), перезапуск.", shard.shard_id, shard.process.returncode)
+        shard.restarts += 1
+        metrics.inc("bot_shard_restarts_total", str(shard.shard_id))
+        await asyncio.sleep(self.restart_delay)
+        await self._spawn(shard)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for shard in self.shards:
+                if shard.process.returncode is not None:
+                    await self._restart(shard)
+                elif await self._healthy(shard):
+                    shard.failures = 0
+                else:
+                    shard.failures += 1
+                    logger.warning("Шард %s: проверка здоровья не пройдена (%s).", shard.shard_id, shard.failures)
+                    if shard.failures >= self.health_failures:
+                        await self._restart(shard)
+
+    async def _forward(self, shard: Shard):
+        '''
+        Пересылка обновлений воркеру пачками с сохранением порядка.
+        '''
+
+        session = await http_client.get_session()
+        headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret}
+        while True:
+            batch = [await shard.queue.get()]
+            while len(batch) < self.batch and not shard.queue.empty():
+                batch.append(shard.queue.get_nowait())
+            body = json.dumps(batch, ensure_ascii=False)
+            # Пачка повторяется, пока воркер ее не примет: порядок обновлений пользователя не нарушается.
+            while True:
+                try:
+                    # Воркер отвечает, когда пачка помещается в его очереди, ожидание не ограничено.
+                    async with session.post(shard.url + "/updates", data=body, headers=headers,
+                                            timeout=aiohttp.ClientTimeout(total=None, sock_connect=2)) as response:
+                        if response.status == 200:
+                            break
+                        logger.warning("Шард %s: воркер ответил %s.", shard.shard_id, response.status)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("Шард %s: воркер недоступен: %s", shard.shard_id, e)
+                await asyncio.sleep(self.restart_delay)
+            metrics.inc("bot_shard_forwarded_total", str(shard.shard_id), len(batch))
+            for _ in batch:
+                shard.queue.task_done()
+
+    def _route(self, update: dict) -> Shard:
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update.get("update_id", 0)
+        return self.shards[key % len(self.shards)]
+
+    async def _poll(self):
+        '''
+        Long polling getUpdates без разбора обновлений в модели aiogram.
+        '''
+
+        session = await http_client.get_session()
+        url = self.bot.session.api.api_url(self.bot.token, "getUpdates")
+        offset = 0
+        while True:
+            params = {"offset": offset, "timeout": POLLING_TIMEOUT}
+            if self.allowed_updates is not None:
+                params["allowed_updates"] = self.allowed_updates
+            try:
+                async with session.post(
+                    url, json=params, timeout=aiohttp.ClientTimeout(total=POLLING_TIMEOUT + 10)
+                ) as response:
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error("Супервизор: ошибка getUpdates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if not data.get("ok"):
+                logger.error("Супервизор: getUpdates вернул ошибку: %s", data.get('description'))
+                await asyncio.sleep(1)
+                continue
+            for update in data["result"]:
+                offset = update["update_id"] + 1
+                # Заполненная очередь шарда приостанавливает получение новых обновлений.
+                await self._route(update).queue.put(update)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        '''
+        Прием webhook Telegram: обновление сразу ставится в очередь своего шарда.
+        '''
+
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.webhook_secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        try:
+            self._route(update).queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def start(self, webhook: dict = None):
+        '''
+        Запуск воркеров и прием обновлений: long polling либо webhook, если
+        передан webhook = {"host", "port", "path", "secret", "url"}.
+        '''
+
+        await http_client.start()
+        await asyncio.gather(*(self._spawn(shard) for shard in self.shards))
+        await asyncio.gather(*(self._wait_ready(shard) for shard in self.shards))
+        self._tasks = [asyncio.ensure_future(self._forward(shard)) for shard in self.shards]
+        self._tasks.append(asyncio.ensure_future(self._watch()))
+
+        if webhook is None:
+            self._tasks.append(asyncio.ensure_future(self._poll()))
+        else:
+            if not webhook["secret"]:
+                raise ValueError("Webhook супервизора требует секретный токен.")
+            self.webhook_secret = webhook["secret"]
+            app = web.Application()
+            app.router.add_post(webhook["path"], self.handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, webhook["host"], webhook["port"]).start()
+            if webhook["url"]:
+                await self.bot.set_webhook(
+                    url=webhook["url"], secret_token=self.webhook_secret,
+                    allowed_updates=self.allowed_updates
+                )
+        logger.info("Супервизор: запущено шардов %s.", len(self.shards))
+
+    async def stop(self, drain_timeout: float = 10):
+        '''
+        Остановка приема, досылка очередей воркерам и плавная остановка воркеров.
+        '''
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        # Получение обновлений и проверки здоровья прекращаются, пересылка продолжается.
+        for task in self._tasks[len(self.shards):]:
+            task.cancel()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(shard.queue.join() for shard in self.shards)), timeout=drain_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Супервизор: не все обновления переданы воркерам до остановки.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for shard in self.shards:
+            if shard.process is not None and shard.process.returncode is None:
+                shard.process.send_signal(signal.SIGTERM)
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            try:
+                await asyncio.wait_for(shard.process.wait(), timeout=drain_timeout + 5)
+            except asyncio.TimeoutError:
+                shard.process.kill()
+                await shard.process.wait()
+        await http_client.close()
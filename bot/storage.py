@@ -0,0 +1,635 @@
+import asyncio
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Optional
+
+from config import (
+    logger, USER_STORAGE, USER_STORAGE_PATH, USER_STORAGE_FLUSH_INTERVAL, USER_STORAGE_FLUSH_BATCH,
+    USER_STORAGE_HOT_SIZE, USER_STORAGE_IDLE_TTL
+)
+from models import UserProfile, PROFILE_FIELDS
+
+# Типы столбцов SQLite для полей профиля.
+_COLUMN_TYPES = {
+    "weight": "REAL", "height": "REAL", "age": "INTEGER", "gender": "TEXT", "activity": "INTEGER",
+    "activity_type": "TEXT", "city": "TEXT", "water_goal": "REAL", "calorie_goal": "REAL",
+    "logged_water": "REAL", "logged_calories": "REAL", "burned_calories": "REAL",
+    "tz_offset": "INTEGER", "day": "INTEGER"
+}
+# Номер дня (ordinal) 1 января 1970 года: местный день - (время + смещение) // 86400 + _EPOCH_DAY.
+_EPOCH_DAY = date(1970, 1, 1).toordinal()
+
+
+def new_profile() -> UserProfile:
+    '''
+    Пустой профиль пользователя с обнуленными счетчиками.
+    '''
+
+    return UserProfile()
+
+
+def reset_profile_day(profile: UserProfile, day: int, water_goal: float = None,
+                      if_before: bool = False) -> Optional[UserProfile]:
+    '''
+    Сброс дневных счетчиков профиля на месте, общий для хранилищ.
+    '''
+
+    if profile is None or (if_before and profile.day is not None and profile.day >= day):
+        return None
+    previous = profile.copy()
+    profile.logged_water = profile.logged_calories = profile.burned_calories = 0
+    if water_goal is not None:
+        profile.water_goal = water_goal
+    profile.day = day
+    return previous
+
+
+def is_due(profile: UserProfile, now: float, tz_from: int, tz_to: int) -> bool:
+    '''
+    Заполненный профиль с часовым поясом из [tz_from, tz_to), у которого на
+    момент now наступил новый местный день.
+    '''
+
+    if profile.weight is None or profile.water_goal is None or profile.day is None:
+        return False
+    tz_offset = profile.tz_offset or 0
+    return tz_from <= tz_offset < tz_to and profile.day < (int(now) + tz_offset) // 86400 + _EPOCH_DAY
+
+
+def open_user_db(path: str) -> sqlite3.Connection:
+    '''
+    Подключение к базе профилей с созданием таблицы и недостающих столбцов.
+    '''
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    columns = ", ".join(f"{field} {_COLUMN_TYPES[field]}" for field in PROFILE_FIELDS)
+    db.execute(f"CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, {columns})")
+    # Добавление столбцов, появившихся после создания базы.
+    existing = {row[1] for row in db.execute("PRAGMA table_info(users)")}
+    for field in PROFILE_FIELDS:
+        if field not in existing:
+            db.execute(f"ALTER TABLE users ADD COLUMN {field} {_COLUMN_TYPES[field]}")
+    # Выбор пользователей, у которых наступил новый день, по часовым поясам.
+    db.execute("CREATE INDEX IF NOT EXISTS users_day ON users (tz_offset, day)")
+    db.commit()
+    return db
+
+
+def split_user_db(sources: list, targets: list, batch_size: int = 10000) -> int:
+    '''
+    Раскладка строк баз профилей sources по базам targets: строка пользователя
+    попадает в targets[user_id % len(targets)]. Возвращает число строк.
+    '''
+
+    fields = ", ".join(PROFILE_FIELDS)
+    placeholders = ", ".join("?" * (len(PROFILE_FIELDS) + 1))
+    target_dbs = [open_user_db(path) for path in targets]
+    copied = 0
+    try:
+        for source in sources:
+            source_db = open_user_db(source)
+            try:
+                cursor = source_db.execute(f"SELECT user_id, {fields} FROM users ORDER BY user_id")
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    by_target = [[] for _ in target_dbs]
+                    for row in rows:
+                        by_target[row[0] % len(target_dbs)].append(row)
+                    for db, target_rows in zip(target_dbs, by_target):
+                        with db:
+                            db.executemany(
+                                f"INSERT OR REPLACE INTO users (user_id, {fields}) VALUES ({placeholders})",
+                                target_rows
+                            )
+                    copied += len(rows)
+            finally:
+                source_db.close()
+    finally:
+        for db in target_dbs:
+            db.close()
+    return copied
+
+
+class UserStorage(ABC):
+    '''
+    Интерфейс хранилища профилей и дневных счетчиков пользователей.
+
+    Методы чтения возвращают копию профиля, изменения выполняются
+    только через set / update / incr.
+    '''
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        '''
+        Профиль пользователя либо None, если профиль не создан.
+        '''
+
+    @abstractmethod
+    async def set(self, user_id: int, profile: UserProfile):
+        '''
+        Создание или полная замена профиля.
+        '''
+
+    @abstractmethod
+    async def update(self, user_id: int, **fields):
+        '''
+        Изменение отдельных полей профиля.
+        '''
+
+    @abstractmethod
+    async def incr(self, user_id: int, field: str, amount: float) -> float:
+        '''
+        Увеличение числового поля, возвращает новое значение.
+        '''
+
+    @abstractmethod
+    async def count(self) -> int:
+        '''
+        Количество сохраненных профилей.
+        '''
+
+    @abstractmethod
+    async def iter_profiles(self, batch_size: int):
+        '''
+        Обход всех профилей пачками: асинхронный генератор списков (user_id, профиль).
+        '''
+
+    @abstractmethod
+    async def iter_due(self, now: float, tz_from: int, tz_to: int, batch_size: int):
+        '''
+        Обход профилей, для которых is_due(профиль, now, tz_from, tz_to):
+        асинхронный генератор списков (user_id, профиль). Остальные профили
+        не читаются.
+        '''
+
+    @abstractmethod
+    async def active_cities(self) -> set:
+        '''
+        Различные города заполненных профилей.
+        '''
+
+    @abstractmethod
+    async def reset_day(self, user_id: int, day: int, water_goal: float = None,
+                        if_before: bool = False) -> Optional[UserProfile]:
+        '''
+        Сброс дневных счетчиков и переход на день day одной операцией, без
+        ожидания между чтением профиля и записью: логи, записанные до сброса,
+        попадают в возвращаемые итоги, а не теряются. Возвращает копию профиля
+        до сброса либо None, если профиля нет или (при if_before) его день уже
+        не меньше day; при if_before хранилище может не переписывать профиль с
+        нулевыми счетчиками и тоже вернуть None.
+        '''
+
+    async def exists(self, user_id: int) -> bool:
+        return await self.get(user_id) is not None
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryUserStorage(UserStorage):
+    '''
+    Хранение профилей в словаре процесса, данные теряются при перезапуске.
+    '''
+
+    def __init__(self):
+        self._profiles = {}
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        profile = self._profiles.get(user_id)
+        return profile.copy() if profile is not None else None
+
+    async def set(self, user_id: int, profile: UserProfile):
+        self._profiles[user_id] = profile.copy()
+
+    async def update(self, user_id: int, **fields):
+        profile = self._profiles[user_id]
+        for field, value in fields.items():
+            setattr(profile, field, value)
+
+    async def incr(self, user_id: int, field: str, amount: float) -> float:
+        profile = self._profiles[user_id]
+        value = getattr(profile, field) + amount
+        setattr(profile, field, value)
+        return value
+
+    async def reset_day(self, user_id: int, day: int, water_goal: float = None,
+                        if_before: bool = False) -> Optional[UserProfile]:
+        return reset_profile_day(self._profiles.get(user_id), day, water_goal, if_before)
+
+    async def count(self) -> int:
+        return len(self._profiles)
+
+    async def iter_profiles(self, batch_size: int):
+        user_ids = list(self._profiles)
+        for start in range(0, len(user_ids), batch_size):
+            batch = []
+            for user_id in user_ids[start:start + batch_size]:
+                profile = self._profiles.get(user_id)
+                if profile is not None:
+                    batch.append((user_id, profile.copy()))
+            yield batch
+
+    async def iter_due(self, now: float, tz_from: int, tz_to: int, batch_size: int):
+        due = [user_id for user_id, profile in self._profiles.items() if is_due(profile, now, tz_from, tz_to)]
+        for start in range(0, len(due), batch_size):
+            yield [(user_id, self._profiles[user_id].copy()) for user_id in due[start:start + batch_size]]
+
+    async def active_cities(self) -> set:
+        return {
+            profile.city for profile in self._profiles.values()
+            if profile.city is not None and profile.water_goal is not None
+        }
+
+
+class SQLiteUserStorage(UserStorage):
+    '''
+    Хранение профилей в SQLite (режим WAL) с отложенной пакетной записью.
+
+    Загруженные профили держатся в памяти, изменения применяются к ним сразу
+    и помечают профиль как измененный. Фоновая задача раз в flush_interval
+    секунд (или при накоплении flush_batch изменений) записывает все измененные
+    профили одной транзакцией, поэтому частые счетчики вроде logged_water
+    объединяются в одну запись вместо записи на каждое сообщение.
+
+    В памяти остаются только активные пользователи: не больше hot_size
+    профилей, при переполнении вытесняется профиль, к которому дольше всех не
+    обращались, а после каждого сброса - профили без обращений дольше idle_ttl
+    секунд. Измененный профиль при вытеснении хранится строкой базы до
+    ближайшего сброса; следующее обращение загружает профиль из этой строки
+    или с диска.
+    '''
+
+    def __init__(self, path: str = USER_STORAGE_PATH, flush_interval: float = USER_STORAGE_FLUSH_INTERVAL,
+                 flush_batch: int = USER_STORAGE_FLUSH_BATCH, hot_size: int = USER_STORAGE_HOT_SIZE,
+                 idle_ttl: float = USER_STORAGE_IDLE_TTL):
+        if hot_size <= 0:
+            raise ValueError("Размер горячего уровня должен быть положительным числом.")
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.hot_size = hot_size
+        self.idle_ttl = idle_ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-storage")
+        self._db = None
+        # Профили в памяти в порядке обращений и время последнего обращения.
+        self._rows = OrderedDict()
+        self._touched = {}
+        # Вытесненные измененные профили до записи на диск: user_id -> строка базы.
+        self._evicted = {}
+        self._dirty = set()
+        # Профили, которые сейчас записываются на диск.
+        self._writing = set()
+        self._flush_needed = None
+        self._flush_lock = None
+        self._flusher = None
+        self._closing = False
+        self.commits = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+
+    def _open(self):
+        return open_user_db(self.path)
+
+    def _select(self, user_id: int):
+        row = self._db.execute(
+            f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return UserProfile.from_row(row) if row is not None else None
+
+    def _write_many(self, rows: list):
+        placeholders = ", ".join("?" * (len(PROFILE_FIELDS) + 1))
+        with self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO users (user_id, {', '.join(PROFILE_FIELDS)}) VALUES ({placeholders})",
+                rows
+            )
+
+    def _count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def _select_batch(self, after_id: int, batch_size: int) -> list:
+        rows = self._db.execute(
+            f"SELECT user_id, {', '.join(PROFILE_FIELDS)} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_id, batch_size)
+        ).fetchall()
+        return [(row[0], UserProfile.from_row(row[1:])) for row in rows]
+
+    def _select_due(self, now: int, tz_from: int, tz_to: int) -> list:
+        # Поиск по индексу (tz_offset, day): читаются только строки часовых поясов диапазона.
+        rows = self._db.execute(
+            f"SELECT user_id, {', '.join(PROFILE_FIELDS)} FROM users "
+            "WHERE tz_offset >= ? AND tz_offset < ? AND day < (? + tz_offset) / 86400 + ? "
+            "AND weight IS NOT NULL AND water_goal IS NOT NULL",
+            (tz_from, tz_to, now, _EPOCH_DAY)
+        ).fetchall()
+        return [(row[0], UserProfile.from_row(row[1:])) for row in rows]
+
+    def _reset_row(self, user_id: int, day: int, water_goal: Optional[float], if_before: bool) -> Optional[UserProfile]:
+        with self._db:
+            previous = self._select(user_id)
+            if previous is None or (if_before and previous.day is not None and previous.day >= day):
+                return None
+            if if_before and not (previous.logged_water or previous.logged_calories or previous.burned_calories):
+                # У неактивного пользователя сбрасывать нечего: строка не перезаписывается.
+                return None
+            self._db.execute(
+                "UPDATE users SET logged_water = 0, logged_calories = 0, burned_calories = 0, day = ?, "
+                "water_goal = COALESCE(?, water_goal) WHERE user_id = ?",
+                (day, water_goal, user_id)
+            )
+        return previous
+
+    def _select_cities(self) -> set:
+        rows = self._db.execute(
+            "SELECT DISTINCT city FROM users WHERE city IS NOT NULL AND water_goal IS NOT NULL"
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        if self._db is not None:
+            return
+        self._db = await self._run(self._open)
+        self._flush_needed = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        if self._db is None:
+            return
+        # Остановка флагом, а не отменой: wait_for теряет отмену, пришедшую вместе с событием сброса.
+        self._closing = True
+        self._flush_needed.set()
+        await self._flusher
+        await self.flush()
+        await self._run(self._db.close)
+        self._db = None
+        self._executor.shutdown(wait=True)
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                logger.error("Хранилище пользователей: ошибка записи на диск: %s", e)
+            self.evict_idle()
+
+    async def flush(self):
+        '''
+        Запись всех измененных и вытесненных профилей одной транзакцией.
+        '''
+
+        if not self._dirty and not self._evicted:
+            return
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            evicted = list(self._evicted.items())
+            if not dirty and not evicted:
+                return
+            rows = [(user_id,) + self._rows[user_id].to_row() for user_id in dirty] + [row for _, row in evicted]
+            self._writing = dirty
+            try:
+                await self._run(self._write_many, rows)
+            except sqlite3.Error:
+                # Неудачная запись повторится при следующем сбросе, вытесненные строки остаются в памяти.
+                self._dirty |= {user_id for user_id in dirty if user_id in self._rows}
+                raise
+            finally:
+                self._writing = set()
+            for user_id, row in evicted:
+                # Строка, замененная после начала записи, запишется следующим сбросом.
+                if self._evicted.get(user_id) is row:
+                    del self._evicted[user_id]
+            self.commits += 1
+
+    async def _throttle(self):
+        # Запись на диск не успевает за вытеснением: обработчик ждет сброса, чтобы строки не копились в памяти.
+        if len(self._evicted) >= 2 * self.flush_batch:
+            await self.flush()
+
+    def _mark_dirty(self, user_id: int):
+        self._dirty.add(user_id)
+        self._check_flush()
+
+    def _check_flush(self):
+        if len(self._dirty) + len(self._evicted) >= self.flush_batch:
+            self._flush_needed.set()
+
+    def _touch(self, user_id: int):
+        self._rows.move_to_end(user_id)
+        self._touched[user_id] = time.monotonic()
+
+    def _admit(self, user_id: int, profile: UserProfile):
+        self._rows[user_id] = profile
+        self._touch(user_id)
+        while len(self._rows) > self.hot_size:
+            self._evict(next(iter(self._rows)))
+
+    def _evict(self, user_id: int):
+        profile = self._rows.pop(user_id)
+        del self._touched[user_id]
+        if user_id in self._dirty or user_id in self._writing:
+            self._dirty.discard(user_id)
+            self._evicted[user_id] = (user_id,) + profile.to_row()
+            self._check_flush()
+        self.evictions += 1
+
+    def evict_idle(self) -> int:
+        '''
+        Вытеснение профилей без обращений дольше idle_ttl секунд, возвращает их число.
+        '''
+
+        if not self.idle_ttl:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = 0
+        while self._rows:
+            user_id = next(iter(self._rows))
+            if self._touched[user_id] > deadline:
+                break
+            self._evict(user_id)
+            evicted += 1
+        return evicted
+
+    async def _load(self, user_id: int) -> Optional[UserProfile]:
+        if user_id in self._rows:
+            self.hits += 1
+        else:
+            self.misses += 1
+            if user_id not in self._evicted:
+                await self.start()
+                await self._throttle()
+                start = time.perf_counter()
+                loaded = await self._run(self._select, user_id)
+                self.loads += 1
+                self.load_seconds += time.perf_counter() - start
+                # Пока шло чтение, профиль мог быть загружен или изменен другим обработчиком.
+                if loaded is not None and user_id not in self._rows and user_id not in self._evicted:
+                    self._admit(user_id, loaded)
+            row = self._evicted.pop(user_id, None)
+            if row is not None:
+                # Вытесненный профиль еще не записан на диск.
+                self._admit(user_id, UserProfile.from_row(row[1:]))
+                self._mark_dirty(user_id)
+        profile = self._rows.get(user_id)
+        if profile is not None:
+            self._touch(user_id)
+        return profile
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        profile = await self._load(user_id)
+        return profile.copy() if profile is not None else None
+
+    async def set(self, user_id: int, profile: UserProfile):
+        await self.start()
+        self._evicted.pop(user_id, None)
+        self._admit(user_id, profile.copy())
+        self._mark_dirty(user_id)
+        await self._throttle()
+
+    async def update(self, user_id: int, **fields):
+        profile = await self._load(user_id)
+        if profile is None:
+            raise KeyError(user_id)
+        for field, value in fields.items():
+            setattr(profile, field, value)
+        self._mark_dirty(user_id)
+
+    async def incr(self, user_id: int, field: str, amount: float) -> float:
+        profile = await self._load(user_id)
+        if profile is None:
+            raise KeyError(user_id)
+        value = getattr(profile, field) + amount
+        setattr(profile, field, value)
+        self._mark_dirty(user_id)
+        return value
+
+    async def reset_day(self, user_id: int, day: int, water_goal: float = None,
+                        if_before: bool = False) -> Optional[UserProfile]:
+        '''
+        Профиль не из памяти сбрасывается одним запросом в базе и не попадает в
+        горячий уровень, поэтому смена дня у всех пользователей не вытесняет
+        активных. При if_before строка с нулевыми счетчиками не перезаписывается.
+        '''
+
+        if user_id in self._rows or user_id in self._evicted:
+            previous = reset_profile_day(await self._load(user_id), day, water_goal, if_before)
+            if previous is not None:
+                self._mark_dirty(user_id)
+            return previous
+        await self.start()
+        previous = await self._run(self._reset_row, user_id, day, water_goal, if_before)
+        if user_id in self._rows or user_id in self._evicted:
+            # Пока шел сброс, обработчик загрузил строку до него: сбрасывается и копия в памяти.
+            loaded = reset_profile_day(await self._load(user_id), day, water_goal, if_before=True)
+            if loaded is not None:
+                self._mark_dirty(user_id)
+                return loaded
+        return previous
+
+    async def count(self) -> int:
+        await self.start()
+        await self.flush()
+        return await self._run(self._count)
+
+    async def iter_profiles(self, batch_size: int):
+        await self.start()
+        await self.flush()
+        after_id = -(2 ** 63)
+        while True:
+            rows = await self._run(self._select_batch, after_id, batch_size)
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            batch = []
+            for user_id, profile in rows:
+                # Профиль в памяти или вытесненный до записи на диск может быть новее строки в базе.
+                current = self._rows.get(user_id)
+                if current is not None:
+                    profile = current.copy()
+                elif user_id in self._evicted:
+                    profile = UserProfile.from_row(self._evicted[user_id][1:])
+                batch.append((user_id, profile))
+            yield batch
+
+    async def iter_due(self, now: float, tz_from: int, tz_to: int, batch_size: int):
+        await self.start()
+        await self.flush()
+        rows = await self._run(self._select_due, int(now), tz_from, tz_to)
+        for start in range(0, len(rows), batch_size):
+            batch = []
+            for user_id, profile in rows[start:start + batch_size]:
+                # Профиль в памяти может быть новее строки в базе.
+                current = self._rows.get(user_id)
+                if current is not None:
+                    profile = current.copy()
+                elif user_id in self._evicted:
+                    profile = UserProfile.from_row(self._evicted[user_id][1:])
+                if is_due(profile, now, tz_from, tz_to):
+                    batch.append((user_id, profile))
+            yield batch
+
+    async def active_cities(self) -> set:
+        # Города выбираются одним запросом в базе, без загрузки профилей в память.
+        await self.start()
+        await self.flush()
+        return await self._run(self._select_cities)
+
+    def stats(self) -> dict:
+        return {
+            "hot": len(self._rows),
+            "evicted_unflushed": len(self._evicted),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0.0,
+            "evictions": self.evictions,
+            "loads": self.loads,
+            "load_ms_avg": round(self.load_seconds / self.loads * 1000, 3) if self.loads else 0.0,
+            "commits": self.commits
+        }
+
+
+def create_user_storage(kind: str = USER_STORAGE) -> UserStorage:
+    '''
+    Создание хранилища по типу из конфигурации: memory или sqlite.
+    '''
+
+    if kind == "memory":
+        return MemoryUserStorage()
+    if kind == "sqlite":
+        return SQLiteUserStorage()
+    raise ValueError(f"Неизвестный тип хранилища пользователей: {kind}")
+
+
+# Хранилище данных пользователей, запускается и закрывается в bot.main().
+users = create_user_storage()
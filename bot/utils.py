@@ -1,42 +1,100 @@
-import aiohttp
 import io
-import matplotlib.pyplot as plt
-from config import OPEN_WEATHER_URL, OPEN_WEATHER_KEY, OPEN_FOOD_FACT_URL
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import Optional
+import matplotlib
+import numpy as np
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from config import OPEN_WEATHER_URL, OPEN_WEATHER_GROUP_URL, OPEN_WEATHER_KEY, OPEN_FOOD_FACT_URL
+from food_db import name_score
+from http_client import http_client
+from models import UserProfile, ActivityType, Gender
+from metrics import timed
+from resilience import resilient, open_weather, open_food_facts, UpstreamError
 
 
+# Ккал в минуту по кодам ActivityType (бег, йога, плавание, силовая).
+ACTIVITY_KCAL_PER_MIN = np.array([10, 3, 8, 6], dtype=np.int64)
+# Дополнительная вода (мл) за каждые полные 30 минут тренировки по кодам ActivityType.
+WORKOUT_WATER_PER_30_MIN = np.array([200, 150, 250, 200], dtype=np.int64)
+
 # Соотношение типов активности и ккал/мин.
-ACTIVITY_CALORIES = {
-    "бег": 10,     
-    "плавание": 8,  
-    "силовая": 6,   
-    "йога": 3   
-}
+ACTIVITY_CALORIES = {activity.key: int(ACTIVITY_KCAL_PER_MIN[activity]) for activity in ActivityType}
 
+# Температура в городе и смещение его часового пояса от UTC в секундах.
+WeatherInfo = namedtuple("WeatherInfo", ["temp", "tz_offset"])
 
-async def open_weather_api(city: str):
+
+@resilient(open_weather)
+@timed("bot_external_call_latency_seconds", "open_weather_api")
+async def fetch_weather(city: str, city_id: int = None) -> WeatherInfo:
     '''
-    Получение температуры из OpenWeatherMap API.
+    Получение температуры и часового пояса города из OpenWeatherMap API.
+    Город ищется по id OpenWeatherMap, если он известен, иначе по названию.
     '''
 
     params = {
-        'q': city,
+        'id' if city_id is not None else 'q': city_id if city_id is not None else city,
         'appid': OPEN_WEATHER_KEY,
         'units': 'metric',
         'lang': 'ru'
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPEN_WEATHER_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data["main"]["temp"]
-            else:
-                raise ValueError(f"Ошибка при получении данных о погоде: {response.status}")
+    session = await http_client.get_session()
+    async with session.get(OPEN_WEATHER_URL, params=params) as response:
+        if response.status == 200:
+            data = await response.json()
+            return WeatherInfo(data["main"]["temp"], data.get("timezone", 0))
+        elif response.status >= 500 or response.status == 429:
+            raise UpstreamError(response.status)
+        else:
+            raise ValueError(f"Ошибка при получении данных о погоде: {response.status}")
+
+
+@resilient(open_weather)
+@timed("bot_external_call_latency_seconds", "open_weather_group_api")
+async def fetch_weather_group(city_ids: list) -> dict:
+    '''
+    Погода нескольких городов одним запросом к OpenWeatherMap (не больше 20 id):
+    {id города: WeatherInfo}. Неизвестные API города в ответ не попадают.
+    '''
+
+    params = {
+        'id': ",".join(str(city_id) for city_id in city_ids),
+        'appid': OPEN_WEATHER_KEY,
+        'units': 'metric',
+        'lang': 'ru'
+    }
+
+    session = await http_client.get_session()
+    async with session.get(OPEN_WEATHER_GROUP_URL, params=params) as response:
+        if response.status == 200:
+            data = await response.json()
+            return {
+                item["id"]: WeatherInfo(item["main"]["temp"], item.get("sys", {}).get("timezone", 0))
+                for item in data.get("list", [])
+            }
+        elif response.status >= 500 or response.status == 429:
+            raise UpstreamError(response.status)
+        else:
+            raise ValueError(f"Ошибка при получении данных о погоде: {response.status}")
+
+
+async def open_weather_api(city: str):
+    '''
+    Получение температуры из OpenWeatherMap API.
+    '''
+
+    return (await fetch_weather(city)).temp
             
 
-async def open_food_fact_api(product_name: str, product_weight: float) -> float:
+@resilient(open_food_facts)
+@timed("bot_external_call_latency_seconds", "open_food_fact_api")
+async def fetch_product_calories(product_name: str) -> Optional[float]:
     '''
-    Получение калорийности продукта из Open Food Facts.
+    Получение калорийности продукта на 100 грамм из Open Food Facts.
+    Возвращает None, если продукт не найден или калорийность не указана.
     '''
 
     params = {
@@ -46,28 +104,80 @@ async def open_food_fact_api(product_name: str, product_weight: float) -> float:
         "json": 1
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPEN_FOOD_FACT_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                if data.get("products"):
-                    # Первый продукт из результата поиска.
-                    product = data["products"][0]
-                    nutriments = product.get("nutriments", {})
-                    # Калории на 100 грамм.
-                    calories_100 = nutriments.get("energy-kcal_100g", "Нет данных")
-                    
-                    # Калории на заданный вес.
-                    if calories_100 != "Нет данных":
-                        calories = round(calories_100 * product_weight / 100, 2)
-                    else:
-                        calories = 0.0
-                    
-                    return calories
-                else:
-                    return 0.0
-            else:
-                return 0.0
+    session = await http_client.get_session()
+    async with session.get(OPEN_FOOD_FACT_URL, params=params) as response:
+        if response.status >= 500 or response.status == 429:
+            raise UpstreamError(response.status)
+        if response.status != 200:
+            raise ValueError(f"Ошибка при получении данных о продукте: {response.status}")
+        data = await response.json()
+        # Продукты с указанной калорийностью на 100 грамм.
+        products = [
+            product for product in data.get("products") or []
+            if (product.get("nutriments") or {}).get("energy-kcal_100g") is not None
+        ]
+        if not products:
+            return None
+        # Первый результат поиска часто не тот продукт: берется самый близкий по названию.
+        product = max(products, key=lambda product: name_score(product_name, product.get("product_name") or ""))
+        return product["nutriments"]["energy-kcal_100g"]
+
+
+def scale_calories(calories_100: Optional[float], product_weight: float) -> float:
+    '''
+    Пересчет калорийности на 100 грамм на заданный вес.
+    '''
+
+    if calories_100 is None:
+        return 0.0
+    return round(calories_100 * product_weight / 100, 2)
+
+
+async def open_food_fact_api(product_name: str, product_weight: float) -> float:
+    '''
+    Получение калорийности продукта заданного веса из Open Food Facts.
+    '''
+
+    try:
+        calories_100 = await fetch_product_calories(product_name)
+    except ValueError:
+        return 0.0
+    return scale_calories(calories_100, product_weight)
+
+
+def local_day(tz_offset: int, now: float = None) -> int:
+    '''
+    Номер текущего дня (ordinal) в часовом поясе со смещением tz_offset секунд.
+    '''
+
+    now = datetime.now(tz=timezone.utc).timestamp() if now is None else now
+    return datetime.fromtimestamp(now + (tz_offset or 0), tz=timezone.utc).date().toordinal()
+
+
+def day_summary(user_data: UserProfile) -> str:
+    '''
+    Итоги дня по воде и балансу калорий.
+    '''
+
+    water_log = user_data.logged_water
+    water_goal = user_data.water_goal
+    water_remain = max(0, water_goal - water_log)
+    if water_remain == 0:
+        water_str = f"Дневная норма воды в {water_goal} мл выполнена,\n"
+    else:
+        water_str = f"Дневная норма воды не выполнена, недобор в {water_remain} мл,\n"
+
+    calorie_log = user_data.logged_calories
+    calorie_burned = user_data.burned_calories
+    calorie_balance = calorie_log - calorie_burned
+    if calorie_balance > 0:
+        cal_str = f"Баланс калорий положительный ({calorie_balance} ккал), ожидаем набор веса."
+    elif calorie_balance < 0:
+        cal_str = f"Баланс калорий отрицательный ({calorie_balance} ккал), ожидаема потеря веса."
+    else:
+        cal_str = f"Нейтральный баланс калорий, ожидаем стабильный вес."
+
+    return f"\U0001F519 Статистика за предыдущий день:\n" + water_str + cal_str
 
 
 def calc_water_intake(weight: float, activity: int, temperature: float) -> float:
@@ -100,23 +210,54 @@ def calc_workout(workout_type: str, workout_time: int):
     Расчет сожженных калорий и дополнительной воды.
     '''
 
-    calories = 0
-    water_opt = 0
+    try:
+        activity = ActivityType.from_text(workout_type)
+    except KeyError:
+        return 0, 0
+
+    # Коэффициенты типа тренировки из таблиц по коду.
+    calories = workout_time * int(ACTIVITY_KCAL_PER_MIN[activity])
+    water_opt = (workout_time // 30) * int(WORKOUT_WATER_PER_30_MIN[activity])
+    return calories, water_opt
+
+
+def calc_water_intake_batch(weight, activity, temperature) -> np.ndarray:
+    '''
+    Пакетный расчет дневной нормы воды: массивы веса и минут активности,
+    температура - число или массив той же длины. Совпадает с calc_water_intake.
+    '''
+
+    weight = np.asarray(weight, dtype=np.float64)
+    activity = np.asarray(activity, dtype=np.int64)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    return weight * 30 + (activity // 30) * 500 + np.where(temperature > 25, 500, 0)
 
-    # Учет разных типов тренировок.
-    if workout_type == "бег":
-        calories = workout_time * ACTIVITY_CALORIES.get(workout_type.lower(), 0)
-        water_opt = (workout_time // 30) * 200
-    elif workout_type == "йога":
-        calories = workout_time * ACTIVITY_CALORIES.get(workout_type.lower(), 0)
-        water_opt = (workout_time // 30) * 150
-    elif workout_type == "плавание":
-        calories = workout_time * ACTIVITY_CALORIES.get(workout_type.lower(), 0)
-        water_opt = (workout_time // 30) * 250
-    elif workout_type == "силовая":
-        calories = workout_time * ACTIVITY_CALORIES.get(workout_type.lower(), 0)
-        water_opt = (workout_time // 30) * 200
 
+def calc_calories_intake_batch(weight, height, gender, age, activity, activity_type) -> np.ndarray:
+    '''
+    Пакетный расчет дневной нормы калорий. Пол и тип активности - коды Gender
+    и ActivityType. Совпадает с calc_calories_intake.
+    '''
+
+    weight = np.asarray(weight, dtype=np.float64)
+    height = np.asarray(height, dtype=np.float64)
+    age = np.asarray(age, dtype=np.int64)
+    # Порядок операций как в скалярной версии: результат совпадает до бита.
+    bmr = weight * 10 + 6.25 * height + age * 5 + np.where(np.asarray(gender) == Gender.FEMALE, -161.0, 5.0)
+    bmr += ACTIVITY_KCAL_PER_MIN[np.asarray(activity_type, dtype=np.intp)] * np.asarray(activity, dtype=np.int64)
+    return bmr
+
+
+def calc_workout_batch(workout_type, workout_time):
+    '''
+    Пакетный расчет сожженных калорий и дополнительной воды по кодам
+    ActivityType и минутам тренировок. Совпадает с calc_workout.
+    '''
+
+    workout_type = np.asarray(workout_type, dtype=np.intp)
+    workout_time = np.asarray(workout_time, dtype=np.int64)
+    calories = workout_time * ACTIVITY_KCAL_PER_MIN[workout_type]
+    water_opt = (workout_time // 30) * WORKOUT_WATER_PER_30_MIN[workout_type]
     return calories, water_opt
 
 
@@ -129,14 +270,15 @@ def plot_water_chart(water_logged, water_remains):
     labels = ["Выпито (мл)", "Осталось (мл)"]
     colors = ["#76c7c0", "#ffcccb"]
 
-    plt.figure(figsize=(6, 6))
-    plt.pie(data, labels=labels, autopct="%1.1f%%", startangle=90, colors=colors)
-    plt.title("Прогресс потребления воды за день")
+    # Объектный API без глобального состояния pyplot.
+    fig = Figure(figsize=(6, 6))
+    ax = fig.subplots()
+    ax.pie(data, labels=labels, autopct="%1.1f%%", startangle=90, colors=colors)
+    ax.set_title("Прогресс потребления воды за день")
 
     # Сохранение графика в байтовый объект.
     buffer = io.BytesIO()
-    plt.savefig(buffer, format="png")
-    plt.close()
+    fig.savefig(buffer, format="png")
     buffer.seek(0)
     return buffer
 
@@ -150,15 +292,77 @@ def plot_calories_chart(calories_goal, calories_logged, calories_burned):
     values = [calories_logged, calories_burned, calories_goal]
     colors = ["#76c7c0", "#ffcccb", "#ffda79"]
 
-    plt.figure(figsize=(8, 5))
-    plt.bar(categories, values, color=colors)
-    plt.title("Прогресс калорий")
-    plt.ylabel("Калории (ккал)")
-    plt.grid(True)
+    fig = Figure(figsize=(8, 5))
+    ax = fig.subplots()
+    ax.bar(categories, values, color=colors)
+    ax.set_title("Прогресс калорий")
+    ax.set_ylabel("Калории (ккал)")
+    ax.grid(True)
 
     # Сохранение графика в байтовый объект.
     buffer = io.BytesIO()
-    plt.savefig(buffer, format="png")
-    plt.close()
+    fig.savefig(buffer, format="png")
+    buffer.seek(0)
+    return buffer
+
+
+def downsample(values, points: int):
+    '''
+    Усреднение рядов по дням (строки - дни) до не более points точек: дни
+    объединяются в группы по bucket подряд, последняя группа может быть неполной.
+    Возвращает (bucket, усредненные строки).
+    '''
+
+    values = np.asarray(values, dtype=np.float64)
+    bucket = max(1, -(-len(values) // points))
+    if bucket == 1:
+        return 1, values
+    groups = -(-len(values) // bucket)
+    padded = np.full((groups * bucket,) + values.shape[1:], np.nan)
+    padded[:len(values)] = values
+    return bucket, np.nanmean(padded.reshape((groups, bucket) + values.shape[1:]), axis=1)
+
+
+def plot_trends_chart(first_day: float, bucket: float, *values):
+    '''
+    Построение графика трендов: вода, потребленные и сожженные калории и баланс.
+    values - ряды воды, потребленных и сожженных ккал подряд, по точке на
+    bucket дней начиная с дня first_day (порядковый номер даты).
+    '''
+
+    first_day, bucket = int(first_day), int(bucket)
+    water, consumed, burned = np.asarray(values, dtype=np.float64).reshape(3, -1)
+    balance = consumed - burned
+    days = [datetime.fromordinal(first_day + i * bucket) for i in range(len(water))]
+    labels = [f"{day:%d.%m}" for day in days]
+    x = np.arange(len(labels))
+    per = "в день" if bucket == 1 else f"в среднем за {bucket} дн."
+
+    fig = Figure(figsize=(9, 7))
+    water_ax, calories_ax = fig.subplots(2, 1, sharex=True)
+    water_ax.bar(x, water, color="#76c7c0")
+    water_ax.set_title(f"Вода, мл {per}")
+    water_ax.grid(True, axis="y")
+
+    calories_ax.bar(x, balance, color=np.where(balance > 0, "#ffda79", "#a8d5a2"), label="Баланс")
+    calories_ax.plot(x, consumed, marker="o", color="#e07a5f", label="Потреблено")
+    calories_ax.plot(x, burned, marker="o", color="#3d5a80", label="Сожжено")
+    calories_ax.set_title(f"Калории, ккал {per}")
+    calories_ax.grid(True, axis="y")
+    calories_ax.legend()
+    calories_ax.axhline(0, color="grey", linewidth=0.8)
+    calories_ax.set_xticks(x, labels, rotation=45)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+
+def render_chart(plot_func, *args) -> bytes:
+    '''
+    Построение графика в байтах PNG, точка входа для процессов рендеринга.
+    '''
+
+    return plot_func(*args).getvalue()
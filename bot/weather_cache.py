@@ -0,0 +1,220 @@
+import asyncio
+import time
+
+from cache import LRUCache
+from city_index import CityIndex, city_index
+from config import (
+    logger, WEATHER_CACHE_TTL, WEATHER_CACHE_SIZE, WEATHER_CACHE_STALE_TTL, WEATHER_GROUP_SIZE,
+    WEATHER_REFRESH_INTERVAL
+)
+from storage import UserStorage
+from utils import fetch_weather, fetch_weather_group, WeatherInfo
+
+
+def normalize_city(city: str) -> str:
+    '''
+    Нормализация названия города для ключа кэша.
+    '''
+
+    return " ".join(city.split()).casefold()
+
+
+class WeatherCache:
+    '''
+    Асинхронный кэш погоды (температура и часовой пояс) по городу.
+
+    Ключ кэша - id города OpenWeatherMap из индекса городов, поэтому разные
+    написания одного города делят значение; нераспознанный город кэшируется
+    по нормализованному названию. Значения живут ttl секунд, размер ограничен
+    LRU-вытеснением. Одновременные запросы одного города объединяются в один
+    запрос к API (single-flight), а при ошибке API отдается устаревшее
+    значение не старше stale_ttl. Погода известных по id городов обновляется
+    заранее групповыми запросами по group_size городов (refresh_ids).
+    '''
+
+    def __init__(self, fetch=fetch_weather, ttl: float = WEATHER_CACHE_TTL,
+                 maxsize: int = WEATHER_CACHE_SIZE, stale_ttl: float = WEATHER_CACHE_STALE_TTL,
+                 fetch_group=fetch_weather_group, index: CityIndex = city_index, group_size: int = WEATHER_GROUP_SIZE):
+        self._fetch = fetch
+        self._fetch_group = fetch_group
+        self._index = index
+        self.group_size = group_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = LRUCache(maxsize)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.errors = 0
+        self.group_requests = 0
+        self.prefetched = 0
+
+    def _key(self, city: str) -> tuple:
+        '''
+        Ключ кэша и id города: id из индекса городов либо нормализованное название и None.
+        '''
+
+        match = self._index.resolve(city) if self._index is not None else None
+        if match is not None:
+            return match.id, match.id
+        return normalize_city(city), None
+
+    async def get(self, city: str):
+        '''
+        Температура в городе из кэша либо из API.
+        '''
+
+        return (await self.get_info(city)).temp
+
+    async def get_info(self, city: str) -> WeatherInfo:
+        '''
+        Погода в городе из кэша либо из API.
+        '''
+
+        key, city_id = self._key(city)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._refresh(key, city, city_id, entry))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий запрос.
+        return await asyncio.shield(task)
+
+    async def _refresh(self, key, city: str, city_id, entry):
+        try:
+            value = await self._fetch(city, city_id)
+        except Exception as e:
+            self.errors += 1
+            if entry is not None and time.monotonic() - entry[0] < self.stale_ttl:
+                self.stale += 1
+                logger.warning("Погода: ошибка обновления для %s, отдано устаревшее значение: %s", key, e)
+                return entry[1]
+            raise
+        self._entries.set(key, (time.monotonic(), value))
+        return value
+
+    async def refresh_ids(self, city_ids, max_age: float = 0.0) -> int:
+        '''
+        Обновление погоды городов по id групповыми запросами: обновляются
+        города без значения или со значением старше max_age секунд.
+        Возвращает число обновленных городов.
+        '''
+
+        now = time.monotonic()
+        due = []
+        for city_id in dict.fromkeys(city_ids):
+            entry = self._entries.get(city_id)
+            if (entry is None or now - entry[0] >= max_age) and city_id not in self._inflight:
+                due.append(city_id)
+        batches = [due[start:start + self.group_size] for start in range(0, len(due), self.group_size)]
+        results = await asyncio.gather(*(self._fetch_group(batch) for batch in batches), return_exceptions=True)
+
+        refreshed = 0
+        for batch, result in zip(batches, results):
+            self.group_requests += 1
+            if isinstance(result, Exception):
+                self.errors += 1
+                logger.warning("Погода: ошибка группового обновления %s городов: %s", len(batch), result)
+                continue
+            stamp = time.monotonic()
+            for city_id, value in result.items():
+                self._entries.set(city_id, (stamp, value))
+            refreshed += len(result)
+        self.prefetched += refreshed
+        return refreshed
+
+    async def prefetch(self, names, max_age: float = 0.0) -> int:
+        '''
+        Обновление погоды городов по названиям: распознанные индексом города
+        обновляются групповыми запросами, остальные запрашиваются при обращении.
+        '''
+
+        city_ids = []
+        for name in names:
+            _, city_id = self._key(name)
+            if city_id is not None:
+                city_ids.append(city_id)
+        return await self.refresh_ids(city_ids, max_age)
+
+    def invalidate(self, city: str):
+        self._entries.pop(self._key(city)[0])
+
+    def stats(self) -> dict:
+        '''
+        Счетчики обращений для подбора TTL.
+        '''
+
+        requests = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale": self.stale,
+            "errors": self.errors,
+            "group_requests": self.group_requests,
+            "prefetched": self.prefetched,
+            "evictions": self._entries.evictions,
+            "hit_ratio": round((self.hits + self.coalesced) / requests, 4) if requests else 0.0
+        }
+
+
+class WeatherRefresher:
+    '''
+    Фоновое обновление погоды городов пользователей.
+
+    Раз в interval секунд хранилище возвращает множество различных городов
+    заполненных профилей (в SQLite - одним запросом, без чтения профилей), и их
+    погода обновляется групповыми запросами кэша. Обновляются значения, которые истекут до следующего обхода, поэтому
+    обработчики и смена дня берут погоду из кэша, а число запросов к API
+    зависит от числа различных городов, а не пользователей.
+    '''
+
+    def __init__(self, storage: UserStorage, weather: WeatherCache, interval: float = WEATHER_REFRESH_INTERVAL):
+        self.storage = storage
+        self.weather = weather
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Обновление погоды: ошибка обхода пользователей: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        '''
+        Один обход: обновление погоды всех городов пользователей.
+        '''
+
+        names = list(await self.storage.active_cities())
+        refreshed = await self.weather.prefetch(names, max(self.weather.ttl - self.interval, 0))
+        if refreshed:
+            logger.info("Обновление погоды: городов %s из %s.", refreshed, len(names))
+        return refreshed
+
+
+# Общий кэш погоды для обработчиков.
+weather_cache = WeatherCache()
@@ -0,0 +1,179 @@
+import asyncio
+import hmac
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiohttp import web
+
+from config import logger
+
+
+class WebhookServer:
+    '''
+    Прием обновлений Telegram через webhook на aiohttp-сервере.
+
+    Обработчик запроса только проверяет секретный токен, кладет обновление в
+    очередь его пользователя и сразу отвечает 200, обработку выполняют workers
+    фоновых воркеров. Воркер берет из общей очереди готовых пользователей
+    одного, обрабатывает его очередное обновление и возвращает пользователя в
+    конец очереди, если у него есть еще обновления. Поэтому обновления одного
+    пользователя обрабатываются по одному и по порядку (шаги FSM не
+    перемешиваются), а медленное обновление занимает один воркер и задерживает
+    только своего пользователя. Принятых и необработанных обновлений не больше
+    queue_size, сверх этого Telegram получает 503 и повторит доставку позже.
+    '''
+
+    def __init__(self, dp: Dispatcher, bot: Bot, host: str, port: int, path: str, secret: str,
+                 queue_size: int, workers: int):
+        if not secret:
+            raise ValueError("Webhook-сервер требует секретный токен.")
+        self.dp = dp
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.queue_size = max(1, queue_size)
+        self.workers = workers
+        # Очереди обновлений по пользователям: пользователь с очередью либо ждет
+        # в _ready, либо обрабатывается воркером.
+        self._mailboxes = {}
+        self._queued = 0
+        # Примитивы asyncio создаются в start(), внутри работающего цикла событий.
+        self._ready = None
+        self._space = None
+        self._tasks = []
+        self._runner = None
+        self.accepted = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _key(update: Update) -> int:
+        '''
+        Ключ очереди обновления: пользователь, иначе чат, иначе само обновление
+        (опросы, обновления без отправителя и типы, неизвестные aiogram).
+        '''
+
+        try:
+            event = update.event
+        except UpdateTypeLookupError:
+            return update.update_id
+        user = getattr(event, "from_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(event, "chat", None)
+        return chat.id if chat is not None else update.update_id
+
+    def _submit(self, update: Update):
+        key = self._key(update)
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            self._mailboxes[key] = deque((update,))
+            self._ready.put_nowait(key)
+        else:
+            mailbox.append(update)
+        self._queued += 1
+        self.accepted += 1
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.secret):
+            logger.warning("Webhook: запрос с неверным секретным токеном.")
+            return web.Response(status=401)
+
+        try:
+            payload = await request.json()
+            if isinstance(payload, list):
+                updates = [Update.model_validate(item, context={"bot": self.bot}) for item in payload]
+            else:
+                update = Update.model_validate(payload, context={"bot": self.bot})
+        except ValueError as e:
+            logger.error("Webhook: невалидное обновление: %s", e)
+            return web.Response(status=400)
+
+        if isinstance(payload, list):
+            # Пачка от супервизора шардов: вместо 503 ожидаем освобождения места,
+            # так переполнение замедляет пересылку, а обновления не теряются.
+            for update in updates:
+                while self._queued >= self.queue_size:
+                    self._space.clear()
+                    await self._space.wait()
+                self._submit(update)
+            return web.Response(status=200)
+
+        if self._queued >= self.queue_size:
+            self.rejected += 1
+            return web.Response(status=503)
+        self._submit(update)
+        return web.Response(status=200)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "queued": self._queued
+        })
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            mailbox = self._mailboxes[key]
+            update = mailbox[0]
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error("Webhook: ошибка обработки обновления %s: %s", update.update_id, e)
+            finally:
+                mailbox.popleft()
+                self._queued -= 1
+                self._space.set()
+                # Следующее обновление пользователя ждет в конце общей очереди,
+                # чтобы активный пользователь не занимал воркер надолго.
+                if mailbox:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._mailboxes[key]
+                self._ready.task_done()
+
+    async def start(self, webhook_url: str = None):
+        '''
+        Запуск воркеров и HTTP-сервера, регистрация webhook в Telegram.
+        '''
+
+        self._ready = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/health", self.health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Webhook-сервер слушает %s:%s%s.", self.host, self.port, self.path)
+
+        if webhook_url:
+            await self.bot.set_webhook(
+                url=webhook_url,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types()
+            )
+
+    async def stop(self, drain_timeout: float = 10):
+        '''
+        Плавная остановка: прием прекращается, принятые обновления дообрабатываются.
+        '''
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._ready is not None:
+            try:
+                await asyncio.wait_for(self._ready.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Webhook: не все обновления обработаны до остановки.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []